@@ -0,0 +1,58 @@
+import contextlib
+
+from unittest import mock
+
+
+class StubElasticBeanstalkClient(object):
+    """
+    Stands in for boto3.client('elasticbeanstalk') with a fixed set of environments
+    """
+
+    def __init__(self, environment_instances):
+        # EB environment name -> list of EC2 instance identifiers
+        self.environment_instances = environment_instances
+
+    def describe_environment_resources(self, EnvironmentName=None, EnvironmentId=None):
+        instances = self.environment_instances.get(EnvironmentName or EnvironmentId, [])
+        return {'EnvironmentResources': {'Instances': [{'Id': instance_id} for instance_id in instances]}}
+
+
+class StubEC2Client(object):
+    """
+    Stands in for boto3.client('ec2'), every instance is reachable on its own loopback address
+    """
+
+    def __init__(self, instance_hosts):
+        # EC2 instance identifier -> IP address
+        self.instance_hosts = instance_hosts
+        # EC2 instance identifier -> state name, instances are running unless listed
+        self.instance_states = {}
+
+    def describe_instances(self, InstanceIds=None, Filters=None):
+        states = None
+        for instance_filter in Filters or []:
+            if instance_filter['Name'] == 'instance-state-name':
+                states = instance_filter['Values']
+
+        instances = []
+        for instance_id in InstanceIds or []:
+            host = self.instance_hosts[instance_id]
+            state = self.instance_states.get(instance_id, 'running')
+            if states is not None and state not in states:
+                continue
+            instances.append({'InstanceId': instance_id, 'PrivateIpAddress': host,
+                              'PublicIpAddress': host, 'State': {'Name': state}})
+        return {'Reservations': [{'Instances': instances}]}
+
+
+@contextlib.contextmanager
+def stub_ssh_authorization():
+    """
+    Disables the security group calls done around each instance tail
+    :return:
+    """
+    with contextlib.ExitStack() as stack:
+        for module in ('classes.tail_ec2_instance', 'classes.backfill_eb_environment'):
+            stack.enter_context(mock.patch(module + '.authorize_ssh', return_value=''))
+            stack.enter_context(mock.patch(module + '.revoke_ssh_authorization', return_value=None))
+        yield
@@ -0,0 +1,42 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class HTTPSink(ThreadingHTTPServer):
+    """
+    Local HTTP endpoint counting the requests and bytes shipped by the collector
+    """
+    daemon_threads = True
+    # Uploads are concurrent with the asyncio engine
+    request_queue_size = 128
+
+    def __init__(self, counters, port=0):
+        super(HTTPSink, self).__init__(('127.0.0.1', port), _SinkRequestHandler)
+        self.counters = counters
+
+    def count(self, nb_bytes):
+        with self.counters['http_bytes'].get_lock():
+            self.counters['http_bytes'].value += nb_bytes
+        with self.counters['http_requests'].get_lock():
+            self.counters['http_requests'].value += 1
+
+
+class _SinkRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length', 0))
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        self.server.count(length - remaining)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_POST = do_PUT
+
+    def log_message(self, format, *args):
+        pass
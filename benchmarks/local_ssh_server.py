@@ -0,0 +1,203 @@
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+
+class LocalSSHServer(object):
+    """
+    Minimal SSH/SFTP server standing in for the EC2 instances of an EB environment.
+    Every loopback address (127.x.y.z) the server is reached on is mapped to its own local
+    directory, so one server can impersonate as many instances as needed.
+    Remote commands are executed by the local shell once the remote log root has been
+    replaced by the directory of the instance.
+    """
+
+    def __init__(self, host_key, authorized_key, remote_root, instance_roots, port=0, counters=None):
+        self.host_key = host_key
+        self.authorized_key = authorized_key
+        self.remote_root = remote_root
+        self.instance_roots = instance_roots
+        self.counters = counters
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('', port))
+        self.socket.listen(128)
+        self.port = self.socket.getsockname()[1]
+
+    def serve_forever(self):
+        """
+        Accepts SSH connections until the process is terminated
+        :return:
+        """
+        while True:
+            client, address = self.socket.accept()
+            thread = threading.Thread(target=self.handle_connection, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def handle_connection(self, client):
+        """
+        Negotiates one SSH transport and drains the channels opened on it
+        :param client:
+        :return:
+        """
+        local_address = client.getsockname()[0]
+        root = self.instance_roots.get(local_address)
+        if root is None:
+            client.close()
+            return
+
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, LocalSFTPServer)
+        try:
+            transport.start_server(server=_ServerInterface(self, root))
+            # Accepted channels are kept referenced, paramiko closes them once garbage collected
+            channels = []
+            while transport.is_active():
+                channel = transport.accept(1)
+                channels = [c for c in channels if not c.closed]
+                if channel is not None:
+                    channels.append(channel)
+        except (paramiko.SSHException, EOFError, OSError):
+            pass
+        finally:
+            transport.close()
+
+    def local_path(self, root, remote_path):
+        """
+        Maps a remote path onto the directory of one instance
+        :param root:
+        :param remote_path:
+        :return:
+        """
+        if remote_path.startswith(self.remote_root):
+            return root + remote_path[len(self.remote_root):]
+        return remote_path
+
+    def count(self, key, nb_bytes):
+        if self.counters is not None and key in self.counters:
+            with self.counters[key].get_lock():
+                self.counters[key].value += nb_bytes
+
+    def exec_command(self, channel, root, command):
+        """
+        Runs one remote command against the instance directory and streams its output
+        :param channel:
+        :param root:
+        :param command:
+        :return:
+        """
+        command = command.replace(self.remote_root, root)
+        process = subprocess.Popen(['/bin/sh', '-c', command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors = []
+        stderr_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()))
+        stderr_reader.start()
+        try:
+            while True:
+                chunk = process.stdout.read(65536)
+                if not chunk:
+                    break
+                channel.sendall(chunk)
+                self.count('ssh_bytes', len(chunk))
+            stderr_reader.join()
+            if errors and errors[0]:
+                channel.sendall_stderr(errors[0])
+            channel.send_exit_status(process.wait())
+        except (OSError, EOFError, paramiko.SSHException):
+            process.kill()
+        finally:
+            channel.close()
+
+
+class _ServerInterface(paramiko.ServerInterface):
+
+    def __init__(self, server, root):
+        self.server = server
+        self.root = root
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        if key == self.server.authorized_key:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode('utf-8') if isinstance(command, bytes) else command
+        thread = threading.Thread(target=self.server.exec_command, args=(channel, self.root, command))
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+class _CountingSFTPHandle(paramiko.SFTPHandle):
+
+    def __init__(self, server, flags=0):
+        super(_CountingSFTPHandle, self).__init__(flags)
+        self.server = server
+
+    def read(self, offset, length):
+        data = super(_CountingSFTPHandle, self).read(offset, length)
+        if isinstance(data, bytes):
+            self.server.count('sftp_bytes', len(data))
+        return data
+
+
+class LocalSFTPServer(paramiko.SFTPServerInterface):
+    """
+    Read-only SFTP subsystem serving the rotated archives of one instance
+    """
+
+    def __init__(self, server_interface, *args, **kwargs):
+        super(LocalSFTPServer, self).__init__(server_interface, *args, **kwargs)
+        self.server = server_interface.server
+        self.root = server_interface.root
+
+    def _local_path(self, path):
+        return self.server.local_path(self.root, path)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self._local_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def list_folder(self, path):
+        local_path = self._local_path(path)
+        try:
+            attributes = []
+            for file_name in os.listdir(local_path):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local_path, file_name)))
+                attr.filename = file_name
+                attributes.append(attr)
+            return attributes
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return paramiko.SFTP_PERMISSION_DENIED
+        try:
+            handle = _CountingSFTPHandle(self.server, flags)
+            handle.filename = self._local_path(path)
+            handle.readfile = open(handle.filename, 'rb')
+            return handle
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
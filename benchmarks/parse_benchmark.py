@@ -0,0 +1,99 @@
+import argparse
+import datetime
+import io
+import json
+import random
+import time
+
+from benchmarks.synthetic_logs import ACCESS_LOG_LINE, STATUS_CODES
+from util.parsing_util import LOG_FORMATS, parse_batches, write_records
+
+CATALINA_LINE = '{time} {level} [http-nio-8080-exec-{thread}] com.example.api.ItemsController.get Item {item} served\n'
+CATALINA_STACK_TRACE = ['java.lang.IllegalStateException: item {item} is locked\n',
+                        '\tat com.example.api.ItemsController.get(ItemsController.java:42)\n',
+                        '\tat java.lang.Thread.run(Thread.java:745)\n']
+
+
+def generate_lines(log_format, nb_lines, seed=0):
+    """
+    Generates synthetic lines of the given format
+    :param log_format: 'combined' or 'catalina'
+    :param nb_lines:
+    :param seed:
+    :return: list of lines
+    """
+    rand = random.Random(seed)
+    now = datetime.datetime(2017, 1, 1)
+    lines = []
+    while len(lines) < nb_lines:
+        now += datetime.timedelta(milliseconds=rand.randint(1, 50))
+        item = rand.randint(1, 100000)
+        if log_format == 'combined':
+            lines.append(ACCESS_LOG_LINE.format(a=rand.randint(0, 255), b=rand.randint(0, 255),
+                                                time=now.strftime('%d/%b/%Y:%H:%M:%S +0000'), item=item,
+                                                status=rand.choice(STATUS_CODES), size=rand.randint(100, 20000),
+                                                latency=rand.randint(200, 900000)))
+        else:
+            error = rand.random() < 0.02
+            lines.append(CATALINA_LINE.format(time=now.strftime('%d-%b-%Y %H:%M:%S.') + '%03d' % (now.microsecond // 1000),
+                                              level='SEVERE' if error else 'INFO', thread=rand.randint(1, 200),
+                                              item=item))
+            if error:
+                lines += [line.format(item=item) for line in CATALINA_STACK_TRACE]
+    return lines[:nb_lines]
+
+
+def measure(function, lines, repeat):
+    """
+    :return: best lines per second out of the repeated runs
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(lines)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(lines) / best
+
+
+def raw_output(lines):
+    output = io.StringIO()
+    for log in lines:
+        output.write("[{eb_env}] - {log}".format(eb_env='bench-env', log=log))
+
+
+def run(nb_lines, repeat):
+    tags = {'eb_env': 'bench-env', 'instance': 'i-bench0000000'}
+    results = []
+    for name in sorted(LOG_FORMATS):
+        log_format = LOG_FORMATS[name]
+        lines = generate_lines(name, nb_lines)
+        results.append({
+            'format': name,
+            'lines': nb_lines,
+            'raw_lines_per_second': measure(raw_output, lines, repeat),
+            'parse_lines_per_second': measure(lambda l: [b for b in parse_batches(l, log_format)], lines, repeat),
+            'ndjson_lines_per_second': measure(lambda l: write_records(io.StringIO(), l, log_format, 'ndjson', tags),
+                                               lines, repeat),
+            'columnar_lines_per_second': measure(
+                lambda l: write_records(io.StringIO(), l, log_format, 'columnar', tags), lines, repeat)
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the structured parsing of log lines')
+    parser.add_argument('--lines', type=int, default=200000, help='number of lines per format')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each measure, the best one is kept')
+    parser.add_argument('--json', action='store_true', help='prints results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.lines, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        columns = ['format', 'lines', 'raw_lines_per_second', 'parse_lines_per_second',
+                   'ndjson_lines_per_second', 'columnar_lines_per_second']
+        print('  '.join(columns))
+        for result in results:
+            print('  '.join(str(int(result[c])) if c != 'format' else result[c] for c in columns))
@@ -0,0 +1,326 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import tempfile
+import time
+
+import paramiko
+
+from benchmarks.aws_stubs import StubEC2Client, StubElasticBeanstalkClient, stub_ssh_authorization
+from benchmarks.http_sink import HTTPSink
+from benchmarks.local_ssh_server import LocalSSHServer
+from benchmarks.synthetic_logs import SyntheticLogFile
+from classes.tail_eb_environment import TailEBEnvironment
+from util.async_util import ENGINES, start_async_engine, get_async_engine, stop_async_engine
+from util.checkpoint_util import EnvironmentState
+from util.offload_util import start_offload_pool, stop_offload_pool
+from util.parsing_util import OUTPUTS
+from util.sink_util import stop_sinks
+from util.ssh_util import get_ssh_pool
+from util.profiling_util import start_profiling, profiling_cycle_started, profiling_cycle_completed
+
+REMOTE_ROOT = '/var/log/bench'
+
+# Scenarios scaled by environments x instances x files x file size (in KB)
+SCENARIOS = {
+    'small': {'environments': 1, 'instances': 2, 'files': 2, 'file_size_kb': 256},
+    'medium': {'environments': 2, 'instances': 4, 'files': 3, 'file_size_kb': 1024},
+    'large': {'environments': 4, 'instances': 8, 'files': 5, 'file_size_kb': 8192},
+}
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values
+    :param values:
+    :param pct:
+    :return:
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def loopback_address(index):
+    return '127.0.{high}.{low}'.format(high=index // 250, low=index % 250 + 2)
+
+
+def serve(server):
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    server.serve_forever()
+
+
+def run_cycle(environments, eb_environments, eb_client, ec2_client, shared_dictionary, logger):
+    """
+    One collection pass over every environment, as done by EBLogRetrievalService
+    :param environments:
+    :param eb_environments: TailEBEnvironment kept across cycles
+    :param eb_client:
+    :param ec2_client:
+    :param shared_dictionary:
+    :param logger:
+    :return:
+    """
+    profiling_cycle_started()
+    for env_config in environments:
+        eb_env = env_config['name']
+        if eb_env not in eb_environments:
+            eb_environments[eb_env] = TailEBEnvironment(eb_env, eb_client, ec2_client, env_config,
+                                                        EnvironmentState(), logger)
+        eb_environments[eb_env].prepare_cycle(eb_client, ec2_client,
+                                              shared_dictionary.setdefault(eb_env, EnvironmentState()))
+
+    engine = get_async_engine()
+    if engine is not None:
+        environment_states = engine.run(engine.gather(eb_environments[env_config['name']].run_async(engine)
+                                                     for env_config in environments))
+    else:
+        environment_states = (eb_environments[env_config['name']].run() for env_config in environments)
+    for env_config, environment_state in zip(environments, environment_states):
+        shared_dictionary[env_config['name']] = environment_state
+    profiling_cycle_completed()
+
+
+def scale_in(environment_instances, running_instances, ec2_client, instance_files, log_files, nb_scale_ins):
+    """
+    Takes the last running instance out of each environment, once they have written their last logs: it either
+    disappears from the environment resources or, every other time, is still listed but shutting down
+    :return:
+    """
+    for env_name, instances in running_instances.items():
+        if len(instances) <= 1:
+            continue
+        instance_id = instances.pop()
+        if nb_scale_ins % 2 == 1:
+            environment_instances[env_name].remove(instance_id)
+        else:
+            ec2_client.instance_states[instance_id] = 'shutting-down'
+        for log_file in instance_files[instance_id]:
+            log_files.remove(log_file)
+
+
+def run_scenario(name, scenario, cycles, growth_kb, rotate_every, ship, logger, merge=False, output='raw',
+                 rollups=False, sampling_rate=None, offload_workers=0, throttling=None, engine='threads',
+                 archive=False, scale_in_every=0):
+    """
+    Runs one scenario against a local SSH server and HTTP sink and measures the collector
+    :return: dictionary of measures
+    """
+    context = multiprocessing.get_context('fork')
+    workspace = tempfile.mkdtemp(prefix='eb_log_bench_')
+    output_dir = os.path.join(workspace, 'output')
+    os.makedirs(output_dir)
+    counters = {key: context.Value('q', 0) for key in ('ssh_bytes', 'sftp_bytes', 'http_bytes', 'http_requests')}
+
+    client_key = paramiko.RSAKey.generate(2048)
+    key_pem = os.path.join(workspace, 'bench_key.pem')
+    client_key.write_private_key_file(key_pem)
+
+    # Synthetic log files, one directory per instance
+    environment_instances, instance_hosts, instance_roots, log_files = {}, {}, {}, []
+    instance_files = {}
+    for e in range(scenario['environments']):
+        env_name = 'bench-env-{e}'.format(e=e)
+        environment_instances[env_name] = []
+        for i in range(scenario['instances']):
+            instance_id = 'i-bench{e:03d}{i:04d}'.format(e=e, i=i)
+            host = loopback_address(len(instance_hosts))
+            root = os.path.join(workspace, 'hosts', host)
+            environment_instances[env_name].append(instance_id)
+            instance_hosts[instance_id] = host
+            instance_roots[host] = root
+            instance_files[instance_id] = []
+            for f in range(scenario['files']):
+                log_files.append(SyntheticLogFile(os.path.join(root, 'app_{f}.log'.format(f=f)),
+                                                  scenario['file_size_kb'] * 1024, growth_kb * 1024,
+                                                  rotate_every, seed=len(log_files)))
+                instance_files[instance_id].append(log_files[-1])
+
+    server = LocalSSHServer(paramiko.RSAKey.generate(2048), client_key, REMOTE_ROOT, instance_roots,
+                            counters=counters)
+    sink = HTTPSink(counters)
+    processes = [context.Process(target=serve, args=(server,)), context.Process(target=sink.serve_forever)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+    server.socket.close()
+    sink.socket.close()
+
+    environments = [{
+        'name': env_name,
+        'key_pem': key_pem,
+        'files': [{'name': '{root}/app_{f}.log'.format(root=REMOTE_ROOT, f=f), 'rotated': rotate_every > 0,
+                   'format': 'combined'} for f in range(scenario['files'])],
+        'api_endpoint': 'http://127.0.0.1:{port}/'.format(port=sink.server_address[1]) if ship else None,
+        'keep_results_on_disk': False,
+        'use_private_ip': True,
+        'ssh_port': server.port,
+        'merge': {'enabled': merge},
+        'output': output,
+        'rollups': {'enabled': rollups, 'flush_interval_in_seconds': 0},
+        'throttling': throttling or {},
+        'sinks': [{'type': 'archive', 'directory': os.path.join(workspace, 'archive')}] if archive else []
+    } for env_name in environment_instances]
+
+    if sampling_rate is not None:
+        for env_config in environments:
+            for file in env_config['files']:
+                file['sampling'] = {'keep_pattern': '" [45][0-9][0-9] ', 'rate': sampling_rate}
+
+    start_offload_pool(offload_workers)
+    if engine == 'asyncio':
+        start_async_engine()
+    eb_client = StubElasticBeanstalkClient(environment_instances)
+    ec2_client = StubEC2Client(instance_hosts)
+    running_instances = {env_name: list(instances) for env_name, instances in environment_instances.items()}
+    shared_dictionary = {}
+    eb_environments = {}
+    latencies = []
+    current_dir = os.getcwd()
+    try:
+        os.chdir(output_dir)
+        with stub_ssh_authorization():
+            for cycle in range(cycles):
+                if cycle > 0:
+                    for log_file in log_files:
+                        log_file.next_cycle()
+                if scale_in_every > 0 and cycle > 0 and cycle % scale_in_every == 0:
+                    scale_in(environment_instances, running_instances, ec2_client, instance_files, log_files,
+                             cycle // scale_in_every)
+                start = time.perf_counter()
+                run_cycle(environments, eb_environments, eb_client, ec2_client, shared_dictionary, logger)
+                latencies.append(time.perf_counter() - start)
+    finally:
+        os.chdir(current_dir)
+        get_ssh_pool().close_all()
+        stop_sinks()
+        stop_offload_pool()
+        stop_async_engine()
+        for process in processes:
+            process.terminate()
+            process.join()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    total_time = sum(latencies)
+    transferred = counters['ssh_bytes'].value + counters['sftp_bytes'].value
+    return {
+        'scenario': name,
+        'environments': scenario['environments'],
+        'instances': scenario['instances'],
+        'files': scenario['files'],
+        'file_size_kb': scenario['file_size_kb'],
+        'cycles': cycles,
+        'throughput_mb_per_s': round(transferred / 1048576.0 / total_time, 2) if total_time else 0.0,
+        'cycle_p50_s': round(percentile(latencies, 50), 3),
+        'cycle_p90_s': round(percentile(latencies, 90), 3),
+        'cycle_p99_s': round(percentile(latencies, 99), 3),
+        'cycle_max_s': round(max(latencies), 3) if latencies else 0.0,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        'ssh_bytes': counters['ssh_bytes'].value,
+        'sftp_bytes': counters['sftp_bytes'].value,
+        'http_bytes': counters['http_bytes'].value,
+        'http_requests': counters['http_requests'].value,
+    }
+
+
+def _run_scenario_process(results, profile_dir, *args):
+    if profile_dir:
+        start_profiling(os.path.join(profile_dir, args[0]), args[2], True, args[6])
+    results.put(run_scenario(*args))
+
+
+def run_isolated_scenario(profile_dir, *args):
+    """
+    Runs one scenario in its own process, so that its peak RSS is not the one of the scenarios run before
+    :param profile_dir: directory of the profiles of the scenario, None if not profiled
+    :param args: arguments of run_scenario
+    :return: dictionary of measures
+    """
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=_run_scenario_process, args=(results, profile_dir) + args)
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError("Scenario {name} failed with exit code {code}".format(
+                        name=args[0], code=process.exitcode))
+    finally:
+        process.join()
+
+
+def print_report(results):
+    columns = ['scenario', 'environments', 'instances', 'files', 'file_size_kb', 'throughput_mb_per_s',
+               'cycle_p50_s', 'cycle_p90_s', 'cycle_p99_s', 'peak_rss_mb', 'ssh_bytes', 'sftp_bytes', 'http_bytes']
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print('  '.join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks the EB log retrieval collector against local stand-ins')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='predefined scenario, can be repeated (default: small)')
+    parser.add_argument('--environments', type=int, help='overrides the number of EB environments')
+    parser.add_argument('--instances', type=int, help='overrides the number of instances per environment')
+    parser.add_argument('--files', type=int, help='overrides the number of files per instance')
+    parser.add_argument('--file-size-kb', type=int, help='overrides the initial size of each file')
+    parser.add_argument('--cycles', type=int, default=5, help='number of collection cycles')
+    parser.add_argument('--growth-kb', type=int, default=64, help='bytes appended to each file between cycles')
+    parser.add_argument('--rotate-every', type=int, default=0, help='rotates files every N cycles (0 disables)')
+    parser.add_argument('--no-ship', action='store_true', help='does not send logs to the local HTTP sink')
+    parser.add_argument('--merge', action='store_true', help='merges the logs of the instances of each environment')
+    parser.add_argument('--output', choices=OUTPUTS, default='raw', help='raw lines or structured records')
+    parser.add_argument('--rollups', action='store_true', help='ships per-minute rollups instead of access logs')
+    parser.add_argument('--sampling-rate', type=float, help='ships errors and this share of the other lines')
+    parser.add_argument('--offload-workers', type=int, default=0, help='frames logs in a pool of N processes')
+    parser.add_argument('--max-bandwidth-per-host-kbps', type=int, help='caps the bandwidth of each host')
+    parser.add_argument('--max-channels-per-host', type=int, help='caps the concurrent channels of each host')
+    parser.add_argument('--nice', action='store_true', help='runs remote commands under nice -n 19 ionice -c 3')
+    parser.add_argument('--archive', action='store_true', help='also ships the logs to a local archive sink')
+    parser.add_argument('--scale-in-every', type=int, default=0,
+                        help='takes an instance out of each environment every N cycles (0 disables)')
+    parser.add_argument('--engine', choices=ENGINES, default='threads', help='collects with threads or asyncio')
+    parser.add_argument('--profile-dir', help='profiles every cycle into one sub-directory per scenario')
+    parser.add_argument('--json', action='store_true', help='prints results as JSON')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger('AWS_EB_Log_Retrieval_Benchmark')
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    throttling = {}
+    if args.max_bandwidth_per_host_kbps:
+        throttling['max_bandwidth_per_host_in_kbps'] = args.max_bandwidth_per_host_kbps
+    if args.max_channels_per_host:
+        throttling['max_channels_per_host'] = args.max_channels_per_host
+    if args.nice:
+        throttling.update({'nice': 19, 'ionice_class': 3})
+
+    results = []
+    for scenario_name in args.scenario or ['small']:
+        scenario = dict(SCENARIOS[scenario_name])
+        for key in ('environments', 'instances', 'files', 'file_size_kb'):
+            if getattr(args, key) is not None:
+                scenario[key] = getattr(args, key)
+        results.append(run_isolated_scenario(
+            os.path.abspath(args.profile_dir) if args.profile_dir else None,
+            scenario_name, scenario, args.cycles, args.growth_kb, args.rotate_every, not args.no_ship, logger,
+            args.merge, args.output, args.rollups, args.sampling_rate, args.offload_workers, throttling, args.engine,
+            args.archive, args.scale_in_every))
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print_report(results)
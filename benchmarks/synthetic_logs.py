@@ -0,0 +1,80 @@
+import datetime
+import gzip
+import os
+import random
+import shutil
+
+ACCESS_LOG_LINE = '10.0.{a}.{b} - - [{time}] "GET /api/v1/items/{item} HTTP/1.1" {status} {size} "-" "bench/1.0" {latency}\n'
+STATUS_CODES = ['200'] * 90 + ['304'] * 5 + ['404'] * 3 + ['500'] * 2
+
+
+class SyntheticLogFile(object):
+    """
+    Access log file growing at a configurable rate and rotated with gzip
+    like logrotate does on Elastic Beanstalk instances
+    """
+
+    def __init__(self, path, initial_size, growth_per_cycle, rotate_every=0, seed=0):
+        self.path = path
+        self.dir_name = os.path.dirname(path)
+        self.base_name = os.path.basename(path)
+        self.rotated_dir = os.path.join(self.dir_name, 'rotated')
+        self.growth_per_cycle = growth_per_cycle
+        self.rotate_every = rotate_every
+        self.random = random.Random(seed)
+        self.time = datetime.datetime(2017, 1, 1)
+        self.nb_cycles = 0
+        self.nb_rotations = 0
+
+        os.makedirs(self.rotated_dir, exist_ok=True)
+        open(self.path, 'w').close()
+        self.append(initial_size)
+
+    def generate(self, nb_bytes):
+        """
+        Generates at least nb_bytes of access log lines
+        :param nb_bytes:
+        :return:
+        """
+        lines = []
+        size = 0
+        while size < nb_bytes:
+            self.time += datetime.timedelta(milliseconds=self.random.randint(1, 50))
+            line = ACCESS_LOG_LINE.format(a=self.random.randint(0, 255), b=self.random.randint(0, 255),
+                                          time=self.time.strftime('%d/%b/%Y:%H:%M:%S +0000'),
+                                          item=self.random.randint(1, 100000),
+                                          status=self.random.choice(STATUS_CODES),
+                                          size=self.random.randint(100, 20000),
+                                          latency=self.random.randint(200, 900000))
+            lines.append(line)
+            size += len(line)
+        return ''.join(lines)
+
+    def append(self, nb_bytes):
+        if nb_bytes > 0:
+            with open(self.path, 'a') as log_file:
+                log_file.write(self.generate(nb_bytes))
+
+    def rotate(self):
+        """
+        Compresses the current file into the rotated directory and truncates it
+        :return:
+        """
+        self.nb_rotations += 1
+        archive = os.path.join(self.rotated_dir, '{base_name}{suffix}.gz'.format(
+            base_name=self.base_name, suffix=self.time.strftime('%Y%m%d%H%M%S')))
+        with open(self.path, 'rb') as log_file, gzip.open(archive, 'wb') as gz:
+            shutil.copyfileobj(log_file, gz)
+        # Keeps archives ordered by modification time for 'ls -Artl'
+        os.utime(archive, (self.nb_rotations, self.nb_rotations))
+        open(self.path, 'w').close()
+
+    def next_cycle(self):
+        """
+        Grows the file, rotating it first when the rotation period is reached
+        :return:
+        """
+        self.nb_cycles += 1
+        if self.rotate_every and self.nb_cycles % self.rotate_every == 0:
+            self.rotate()
+        self.append(self.growth_per_cycle)
@@ -1,36 +1,84 @@
-import boto3
 import json
+import logging
 import os
+import re
 import signal
 import time
 
-from ebcli.lib.aws import set_region, set_session_creds
+import yaml
+
 from classes.tail_eb_environment import TailEBEnvironment
+from util.async_util import ENGINES, MAX_CONCURRENT_CHANNELS, MAX_CONCURRENT_AWS_CALLS
+from util.async_util import start_async_engine, get_async_engine, stop_async_engine
 from util.aws_util import AWSConfig
+from util.checkpoint_util import EnvironmentState, load_state, dump_state
+from util.offload_util import start_offload_pool, stop_offload_pool
+from util.parsing_util import OUTPUTS, LOG_FORMATS
+from util.profiling_util import start_profiling, profiling_cycle_started, profiling_cycle_completed
+from util.scheduling_util import CycleScheduler, SHED_WORK
+from util.sink_util import SINK_TYPES, sink_stats, stop_sinks, set_spool_directory
+from util.ssh_util import get_ssh_pool
+
+# Sleeping polls for configuration reloads at this interval, signal handlers only set a flag
+RELOAD_POLL_INTERVAL_IN_SECONDS = 1
+
+
+def environment_alias(env_config):
+    """
+    Name identifying one EB environment in the shared dictionary, its name or else its id
+    :param env_config:
+    :return:
+    """
+    if 'name' not in env_config and 'id' not in env_config:
+        raise KeyError("Environment id and name have been omitted, please specify at least one")
+    return env_config['name'] if 'name' in env_config else env_config['id']
 
 
 class EBLogRetrievalService(object):
 
-    def __init__(self, config, config_relative_dir_name, logger):
+    def __init__(self, config, config_relative_dir_name, logger, metrics_callback=None, config_file_path=None,
+                 started_at=None):
         self.config = config
         self.config_dir_name = config_relative_dir_name
+        self.config_file_path = config_file_path
         self.logger = logger
+        self.metrics_callback = metrics_callback
 
         self.attempt_previously_failed = False
         self.aws_config = AWSConfig(self.logger)
+        self.backup_restored = False
         self.credentials = {}
+        self.eb_environments = {}
         self.environments_config = []
         self.environments_name = []
+        self.health_file_location = None
         self.is_sleeping = False
         self.job_name = config['job_name']
+        self.lease_manager = None
         self.local_backup_file_location = '{backup_dir}/{file_name}'
+        self.metrics = {'cycles': 0, 'failed_cycles': 0, 'environments': 0, 'startup_seconds': 0.0,
+                        'files_collected': 0, 'lines_collected': 0, 'bytes_collected': 0,
+                        'last_cycle_files': 0, 'last_cycle_lines': 0, 'last_cycle_bytes': 0,
+                        'last_cycle_seconds': 0.0, 'last_cycle_completed_at': 0.0,
+                        'cycle_overruns': 0, 'cycle_overrun_seconds': 0.0, 'shed_rotated_archives': 0,
+                        'shed_environments': 0, 'shed_backfills': 0, 'last_cycle_overrun_seconds': 0.0,
+                        'last_shedding_level': 0}
         self.missing_required_parameters = False
+        self.profiling_config = {'enabled': False, 'cycles': 1, 'output_dir': 'profiles', 'tracemalloc': False}
+        self.profiling_requested = False
+        self.reload_requested = False
+        self.scheduler = CycleScheduler(120)
+        self.stop_requested = False
         self.shared_dictionary = {}
         self.sleeping_start_time = time.time()
         self.sleeping_window_in_seconds = 120
+        self.ssh_idle_timeout_in_seconds = 240
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.startup_budget_in_seconds = self.config.get('startup_budget_in_seconds', 2.0)
         self.target_arn = self.config['target_arn'] if 'target_arn' in self.config else False
 
         signal.signal(signal.SIGUSR1, self.load_eb_environments_config)
+        signal.signal(signal.SIGUSR2, self.request_profiling)
 
     def start_eb_log_retrieval_process(self):
         """
@@ -39,44 +87,12 @@ class EBLogRetrievalService(object):
         """
         self.load_config()
         self.logger.info("Configuration dictionary loaded")
+        self.report_startup()
         self.logger.info("Starting constantly running process")
 
-        while not (self.missing_required_parameters or self.attempt_previously_failed):
+        while not (self.missing_required_parameters or self.attempt_previously_failed or self.stop_requested):
             try:
-                if 'aws_access_key_id' in self.credentials and 'aws_secret_access_key' in self.credentials:
-                    boto3.setup_default_session(**self.credentials)
-                else:
-                    boto3.setup_default_session(region_name=self.credentials['region_name'])
-
-                eb_client = boto3.client('elasticbeanstalk')
-                ec2_client = boto3.client('ec2')
-
-                try:
-                    with open(self.local_backup_file_location, 'r') as backup:
-                        content = backup.read()
-                        self.shared_dictionary = json.loads(content) if len(content) > 1 else {}
-                        if not isinstance(self.shared_dictionary, dict): self.shared_dictionary = {}
-                    self.logger.info("Shared dictionary from backup file restored")
-                except FileNotFoundError:
-                    pass
-
-                for i, env_config in enumerate(self.environments_config):
-
-                    if len(self.environments_config) != len(self.environments_name):
-                        self.init_eb_environment(env_config)
-
-                    eb_env = self.environments_name[i]
-
-                    self.logger.info("Tailing the Elastic Beanstalk environment {eb_env}".format(eb_env=eb_env))
-                    self.shared_dictionary[eb_env] = TailEBEnvironment(eb_env, eb_client, ec2_client,
-                                                                       env_config, self.shared_dictionary[eb_env],
-                                                                       self.logger).run()
-
-                self.logger.info("All environments completed")
-                self.logger.info(json.dumps(self.shared_dictionary, indent=4, sort_keys=True))
-
-                with open(self.local_backup_file_location, 'w+') as backup:
-                    backup.write(json.dumps(self.shared_dictionary, indent=4, sort_keys=True))
+                self.run_cycle()
 
                 if self.attempt_previously_failed:
                     message = "Logs successfully retrieved after unexpected exception"
@@ -85,10 +101,12 @@ class EBLogRetrievalService(object):
                     self.aws_config.sns_publish(subject="EB Tail Logs", message=message, target_arn=self.target_arn)
                     self.attempt_previously_failed = False
 
-                self.logger.info("Sleeping for {mins} min.".format(mins=float(self.sleeping_window_in_seconds/60)))
+                # The next cycle starts one window after the start of this one, right away if it overran
+                self.logger.info("Sleeping for {mins} min.".format(
+                    mins=float(self.scheduler.remaining_seconds(self.sleeping_window_in_seconds)/60)))
                 self.is_sleeping = True
                 self.sleeping_start_time = time.time()
-                time.sleep(self.sleeping_window_in_seconds)
+                self.sleep_until(self.scheduler.cycle_start_time + self.sleeping_window_in_seconds)
                 self.is_sleeping = False
 
             except KeyError as e:
@@ -98,15 +116,365 @@ class EBLogRetrievalService(object):
                 message = str(e)
                 self.logger.error("Unexpected exception {message}".format(message=message))
 
+                self.metrics['failed_cycles'] += 1
+                self.publish_metrics()
+
                 if not self.attempt_previously_failed:
                     self.logger.info("SNS-Publishing the following message '{message}'".format(message=message))
                     self.aws_config.sns_publish(subject="EB Log Retrieval Service - Unexpected exception caught", message=message, target_arn=self.target_arn)
                     self.attempt_previously_failed = True
-                time.sleep(120)
-
+                self.sleep_until(time.time() + 120)
+
+        self.flush_rollups()
+        stop_sinks()
+        stop_offload_pool()
+        stop_async_engine()
+        if self.lease_manager is not None:
+            self.lease_manager.release_all()
         self.logger.info("constantly running process stopped")
         self.aws_config.sns_publish(subject="EB Log Retrieval Service", message="Constantly running process stopped", target_arn=self.target_arn)
 
+    def start_one_shot_process(self):
+        """
+        Tails every EB environment once, then returns a throughput summary
+        :return: summary dictionary, None if the configuration is incomplete
+        """
+        self.load_config()
+        if self.missing_required_parameters:
+            return None
+        self.report_startup()
+        self.logger.info("Starting one-shot process")
+
+        try:
+            self.run_cycle()
+        except KeyError as e:
+            self.logger.error("Please configure the {key} key or section in the config file".format(key=str(e)))
+            return None
+        finally:
+            self.flush_rollups()
+            stop_sinks()
+            stop_offload_pool()
+            stop_async_engine()
+            if self.lease_manager is not None:
+                self.lease_manager.release_all()
+
+        return self.summary('once', self.metrics['last_cycle_seconds'], {
+            'environments': self.metrics['environments'],
+            'files': self.metrics['last_cycle_files'],
+            'lines': self.metrics['last_cycle_lines'],
+            'bytes': self.metrics['last_cycle_bytes']
+        })
+
+    def start_backfill_process(self, max_bandwidth_in_kbps=None, concurrency=4):
+        """
+        Ships every rotated archive of every log file of every EB environment, then returns a throughput summary
+        Archives are fetched and uncompressed concurrently across hosts, within a global bandwidth cap
+        :param max_bandwidth_in_kbps: None for no cap
+        :param concurrency: number of hosts processed at once
+        :return: summary dictionary, None if the configuration is incomplete
+        """
+        from classes.backfill_eb_environment import BackfillEBEnvironment
+        from util.throttle_util import TokenBucket
+
+        self.load_config()
+        if self.missing_required_parameters:
+            return None
+        self.report_startup()
+        self.logger.info("Starting backfill process")
+
+        start_time = time.time()
+        eb_client, ec2_client = self.create_aws_clients()
+        bucket = TokenBucket(max_bandwidth_in_kbps * 1024) if max_bandwidth_in_kbps else None
+        totals = {'environments': 0, 'instances': 0, 'archives': 0, 'compressed_bytes': 0, 'lines': 0, 'bytes': 0}
+
+        try:
+            for env_config in self.environments_config:
+                eb_env = environment_alias(env_config)
+                self.validate_eb_environment(eb_env, env_config)
+                self.logger.info("Backfilling the Elastic Beanstalk environment {eb_env}".format(eb_env=eb_env))
+                stats = BackfillEBEnvironment(eb_env, eb_client, ec2_client, env_config, self.logger,
+                                              bucket=bucket, concurrency=concurrency).run()
+                totals['environments'] += 1
+                for key, value in stats.items():
+                    totals[key] += value
+        finally:
+            # The backfill is shipped once the sinks delivered their queued files
+            stop_sinks()
+            stop_offload_pool()
+
+        return self.summary('backfill', time.time() - start_time, totals)
+
+    def summary(self, mode, seconds, totals):
+        """
+        Logs and returns the throughput summary of a batch run
+        :param mode:
+        :param seconds:
+        :param totals:
+        :return:
+        """
+        summary = dict(totals)
+        summary['mode'] = mode
+        summary['seconds'] = round(seconds, 3)
+        summary['startup_seconds'] = self.metrics['startup_seconds']
+        summary['lines_per_second'] = round(totals['lines'] / seconds, 1) if seconds > 0 else 0.0
+        summary['mb_per_second'] = round(totals['bytes'] / 1048576.0 / seconds, 3) if seconds > 0 else 0.0
+        self.logger.info("Summary: {summary}".format(summary=json.dumps(summary, sort_keys=True)))
+        return summary
+
+    def create_aws_clients(self):
+        """
+        Creates the EB and EC2 clients of a new cycle
+        :return: tuple (eb_client, ec2_client)
+        """
+        # Loaded once the configuration is known to be valid
+        import boto3
+
+        if 'aws_access_key_id' in self.credentials and 'aws_secret_access_key' in self.credentials:
+            boto3.setup_default_session(**self.credentials)
+        else:
+            boto3.setup_default_session(region_name=self.credentials['region_name'])
+
+        return boto3.client('elasticbeanstalk'), boto3.client('ec2')
+
+    def run_cycle(self):
+        """
+        Tails every EB environment once and saves the shared dictionary into the backup file
+        The checkpoints are restored from the backup file by the first cycle, then kept in memory
+        :return:
+        """
+        shed_work = self.scheduler.start_cycle()
+        cycle_start_time = self.scheduler.cycle_start_time
+        eb_client, ec2_client = self.create_aws_clients()
+
+        if not self.backup_restored:
+            self.restore_backup()
+
+        if self.profiling_requested:
+            self.profiling_requested = False
+            start_profiling(self.profiling_config['output_dir'], self.profiling_config['cycles'],
+                            self.profiling_config['tracemalloc'], self.logger)
+        profiling_cycle_started()
+        try:
+            cycle_stats = self.tail_environments(eb_client, ec2_client, shed_work)
+        finally:
+            # A failed cycle is still a profiled cycle
+            profiling_cycle_completed()
+            # Connections to hosts no longer tailed, e.g. of removed or shed environments, are not kept open
+            get_ssh_pool().close_idle(self.ssh_idle_timeout_in_seconds)
+        self.cycle_completed(cycle_start_time, cycle_stats)
+
+    def tail_environments(self, eb_client, ec2_client, shed_work):
+        """
+        Tails the EB environments of this node, then saves the shared dictionary into the backup file
+        :param eb_client:
+        :param ec2_client:
+        :param shed_work: work shed during this cycle
+        :return: files, lines and bytes collected
+        """
+        if self.reload_requested:
+            self.reload_config()
+
+        # With several collector nodes, only the environments leased to this node are tailed
+        acquired_checkpoints = {}
+        if self.lease_manager is not None:
+            acquired_checkpoints = self.lease_manager.claim_environments(
+                [environment_alias(env_config) for env_config in self.environments_config])
+
+        cycle_stats = {'files': 0, 'lines': 0, 'bytes': 0}
+        environments = []
+        top_priority = max([env_config['priority'] if 'priority' in env_config else 0
+                            for env_config in self.environments_config] or [0])
+        for i, env_config in enumerate(self.environments_config):
+
+            if len(self.environments_config) != len(self.environments_name):
+                self.init_eb_environment(env_config)
+
+            eb_env = self.environments_name[i]
+
+            if self.lease_manager is not None:
+                if not self.lease_manager.owns(eb_env):
+                    self.logger.info("{eb_env}: leased to another node, skipped".format(eb_env=eb_env))
+                    self.shared_dictionary.pop(eb_env, None)
+                    continue
+                if acquired_checkpoints.get(eb_env) is not None:
+                    self.logger.info("{eb_env}: restarting from the last committed checkpoint".format(eb_env=eb_env))
+                    self.shared_dictionary[eb_env] = EnvironmentState.from_dict(acquired_checkpoints[eb_env])
+
+            eb_environment = self.get_eb_environment(eb_env, env_config)
+            if 'environments' in shed_work and eb_environment.priority < top_priority:
+                self.logger.info("{eb_env}: shed from this cycle, previous cycles overran".format(eb_env=eb_env))
+                self.scheduler.count('environments', 1)
+                continue
+
+            self.logger.info("Tailing the Elastic Beanstalk environment {eb_env}".format(eb_env=eb_env))
+            eb_environment.prepare_cycle(eb_client, ec2_client, self.shared_dictionary.setdefault(eb_env, EnvironmentState()),
+                                         shed_work)
+            environments.append((eb_env, eb_environment))
+
+        # Environments with the highest priority first, the order of the config otherwise
+        environments.sort(key=lambda environment: -environment[1].priority)
+
+        # With the asyncio engine, every environment is tailed at once within the limits of the engine
+        engine = get_async_engine()
+        if engine is not None:
+            environment_states = engine.run(engine.gather(eb_environment.run_async(engine) for _, eb_environment in environments))
+        else:
+            environment_states = self.run_environments(environments, top_priority)
+
+        for (eb_env, eb_environment), environment_state in zip(environments, environment_states):
+            if environment_state is None:
+                self.logger.info("{eb_env}: shed from this cycle, past its deadline".format(eb_env=eb_env))
+                self.scheduler.count('environments', 1)
+                continue
+
+            self.shared_dictionary[eb_env] = environment_state
+            for key in cycle_stats:
+                cycle_stats[key] += eb_environment.stats[key]
+            for work, nb in eb_environment.shed_stats.items():
+                self.scheduler.count(work, nb)
+
+            if self.lease_manager is not None:
+                self.lease_manager.commit(eb_env, environment_state.to_dict())
+
+        self.logger.info("All environments completed")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(json.dumps(dump_state(self.shared_dictionary), indent=4, sort_keys=True))
+
+        self.save_backup()
+        return cycle_stats
+
+    def run_environments(self, environments, top_priority):
+        """
+        Tails environments one after the other, those with a lower priority are shed once the cycle is past its deadline
+        :param environments: list of (alias, TailEBEnvironment)
+        :param top_priority:
+        :return: generator of their EnvironmentState, None for a shed environment
+        """
+        for _, eb_environment in environments:
+            if eb_environment.priority < top_priority and self.scheduler.past_deadline():
+                yield None
+            else:
+                yield eb_environment.run()
+
+    def report_startup(self):
+        """
+        Reports the time spent from the process start (imports, config parsing) until the first cycle
+        :return:
+        """
+        self.metrics['startup_seconds'] = round(time.perf_counter() - self.started_at, 3)
+        message = "Startup completed in {seconds} s (budget {budget} s)".format(
+            seconds=self.metrics['startup_seconds'], budget=self.startup_budget_in_seconds)
+        if self.metrics['startup_seconds'] > self.startup_budget_in_seconds:
+            self.logger.warning(message)
+        else:
+            self.logger.info(message)
+
+    def sleep_until(self, wake_up_time):
+        """
+        Sleeps until the given time, configuration reloads requested meanwhile are applied without delaying it
+        A requested stop ends the sleep
+        :param wake_up_time:
+        :return:
+        """
+        while not self.stop_requested:
+            remaining_seconds = wake_up_time - time.time()
+            if remaining_seconds <= 0:
+                return
+            time.sleep(min(remaining_seconds, RELOAD_POLL_INTERVAL_IN_SECONDS))
+            if self.reload_requested:
+                self.reload_config()
+
+    def restore_backup(self):
+        """
+        Restores the checkpoints of every environment from the backup file, if any
+        :return:
+        """
+        self.backup_restored = True
+        try:
+            with open(self.local_backup_file_location, 'r') as backup:
+                content = backup.read()
+                dictionary = json.loads(content) if len(content) > 1 else {}
+                self.shared_dictionary = load_state(dictionary) if isinstance(dictionary, dict) else {}
+            self.logger.info("Shared dictionary from backup file restored")
+        except FileNotFoundError:
+            pass
+
+    def save_backup(self):
+        # Written without indentation, the backup holds every instance and file of every environment
+        with open(self.local_backup_file_location, 'w+') as backup:
+            json.dump(dump_state(self.shared_dictionary), backup, sort_keys=True)
+
+    def flush_rollups(self):
+        """
+        Flushes the pending rollups of every environment, e.g. before stopping
+        :return:
+        """
+        for eb_environment in self.eb_environments.values():
+            eb_environment.flush_rollups(force=True)
+
+    def get_eb_environment(self, eb_env, env_config):
+        """
+        Environment tailed across cycles, its discovered hosts are kept while its config does not change
+        :param eb_env:
+        :param env_config:
+        :return:
+        """
+        eb_environment = self.eb_environments.get(eb_env)
+        if eb_environment is None or eb_environment.config is not env_config:
+            new_eb_environment = TailEBEnvironment(eb_env, None, None, env_config, {}, self.logger)
+            if eb_environment is not None:
+                eb_environment.flush_rollups(force=True)
+            if eb_environment is not None and eb_environment.has_same_instances(env_config):
+                new_eb_environment.known_hosts = eb_environment.known_hosts
+            self.eb_environments[eb_env] = eb_environment = new_eb_environment
+        return eb_environment
+
+    def cycle_completed(self, cycle_start_time, cycle_stats):
+        """
+        Updates the metrics of the service once every environment has been tailed
+        :param cycle_start_time:
+        :param cycle_stats: files, lines and bytes collected during the cycle
+        :return:
+        """
+        self.metrics['cycles'] += 1
+        for key, value in cycle_stats.items():
+            self.metrics['{key}_collected'.format(key=key)] += value
+            self.metrics['last_cycle_{key}'.format(key=key)] = value
+        self.metrics['environments'] = len(self.environments_config)
+        self.metrics['last_cycle_seconds'] = round(time.time() - cycle_start_time, 3)
+        self.metrics['last_cycle_completed_at'] = time.time()
+
+        overrun = self.scheduler.cycle_completed()
+        if overrun > 0:
+            self.logger.warning("Cycle overran its deadline of {deadline} s by {overrun} s, shedding {work}".format(
+                deadline=self.scheduler.deadline_in_seconds, overrun=round(overrun, 3),
+                work=', '.join(work for work in SHED_WORK if work in self.scheduler.shed_work()) or 'nothing'))
+        for key, value in self.scheduler.stats.items():
+            self.metrics[key] = round(value, 3) if isinstance(value, float) else value
+        self.metrics['last_cycle_overrun_seconds'] = round(overrun, 3)
+        self.metrics['last_shedding_level'] = self.scheduler.level
+        for key, value in sink_stats().items():
+            self.metrics['sink_files_{key}'.format(key=key)] = value
+        self.publish_metrics()
+
+    def publish_metrics(self):
+        """
+        Hands the metrics over to the supervisor, or writes them to the health file in the single process mode
+        :return:
+        """
+        if self.metrics_callback is not None:
+            self.metrics_callback(self.metrics)
+            return
+        if self.health_file_location is None:
+            return
+        health = {'updated_at': time.time(), 'pid': os.getpid(), 'metrics': self.metrics}
+        try:
+            with open(self.health_file_location, 'w+') as health_file:
+                health_file.write(json.dumps(health, indent=4, sort_keys=True))
+        except IOError as e:
+            self.logger.error("Health file {file} not written: {error}".format(file=self.health_file_location,
+                                                                             error=str(e)))
+
     def load_config(self):
         """
         Loads the configuration parameters
@@ -116,6 +484,8 @@ class EBLogRetrievalService(object):
             if 'sleeping_window_in_seconds' in self.config:
                 self.sleeping_window_in_seconds = self.config['sleeping_window_in_seconds']
                 self.logger.info("Sleeping window set to {sec} seconds".format(sec=self.sleeping_window_in_seconds))
+            self.ssh_idle_timeout_in_seconds = self.config.get('ssh_idle_timeout_in_seconds',
+                                                               2 * self.sleeping_window_in_seconds)
 
             backup_file_name = self.config['backup_file_name']
             backup_directory = self.config['backup_directory']
@@ -123,8 +493,16 @@ class EBLogRetrievalService(object):
             self.logger.info("Backup directory set to {dir}".format(dir=backup_directory))
             self.local_backup_file_location = self.local_backup_file_location.format(backup_dir=backup_directory,
                                                                                      file_name=backup_file_name)
+            # Like the backup file, the spool of the sinks and the health file belong to this process
+            set_spool_directory('{file}_spool'.format(file=self.local_backup_file_location))
+            self.health_file_location = '{file}_health.json'.format(file=self.local_backup_file_location)
             self.load_credentials(self.config)
             self.load_environments(self.config)
+            self.load_profiling(self.config)
+            self.load_coordination(self.config)
+            self.load_offload(self.config)
+            self.load_engine(self.config)
+            self.load_scheduling(self.config)
         except KeyError as e:
             self.missing_required_parameters = True
             self.logger.error("Please configure the {key} key or section in the config file".format(key=str(e)))
@@ -135,6 +513,8 @@ class EBLogRetrievalService(object):
         :param config:
         :return:
         """
+        from ebcli.lib.aws import set_region, set_session_creds
+
         section = config['credentials']
 
         self.credentials['region_name'] = section['aws_region']
@@ -157,61 +537,224 @@ class EBLogRetrievalService(object):
         for env in section:
             self.environments_config.append(env)
 
+    def load_profiling(self, config):
+        """
+        Loads the optional profiling section, profiling can also be enabled with SIGUSR2
+        :param config:
+        :return:
+        """
+        if 'profiling' in config:
+            self.profiling_config.update(config['profiling'])
+            self.profiling_requested = bool(self.profiling_config['enabled'])
+
+    def load_coordination(self, config):
+        """
+        Loads the optional coordination section shared by several collector nodes
+        :param config:
+        :return:
+        """
+        if 'coordination' in config:
+            from classes.lease_manager import LeaseManager
+            self.lease_manager = LeaseManager(config['coordination'], self.logger)
+            self.logger.info("Coordinating environments as node {node}".format(node=self.lease_manager.node_id))
+
+    def load_offload(self, config):
+        """
+        Starts the optional process pool framing raw logs and decompressing archives out of the SSH process
+        :param config:
+        :return:
+        """
+        import multiprocessing
+
+        offload_workers = config['offload_workers'] if 'offload_workers' in config else 0
+        if offload_workers > 0 and multiprocessing.current_process().daemon:
+            self.logger.warning("CPU-bound stages not offloaded, a daemonic process is not allowed to start a process pool")
+        elif offload_workers > 0:
+            start_offload_pool(offload_workers)
+            self.logger.info("CPU-bound stages offloaded to {nb} processes".format(nb=offload_workers))
+
+    def load_engine(self, config):
+        """
+        Loads the optional engine section: environments are collected with threads (default) or by the asyncio engine
+        :param config:
+        :return:
+        """
+        engine_config = config['engine'] if 'engine' in config else {}
+        engine_type = engine_config['type'] if 'type' in engine_config else 'threads'
+        if engine_type not in ENGINES:
+            raise KeyError("Engine type {engine} unknown, expected one of {engines}".format(engine=engine_type,
+                                                                                           engines=', '.join(ENGINES)))
+        if engine_type == 'asyncio':
+            start_async_engine(
+                engine_config['max_concurrent_channels'] if 'max_concurrent_channels' in engine_config else MAX_CONCURRENT_CHANNELS,
+                engine_config['max_concurrent_aws_calls'] if 'max_concurrent_aws_calls' in engine_config else MAX_CONCURRENT_AWS_CALLS)
+            self.logger.info("Environments collected by the asyncio engine")
+
+    def load_scheduling(self, config):
+        """
+        Loads the deadline of the cycles, the sleeping window by default, and whether or not work is shed when they overrun
+        :param config:
+        :return:
+        """
+        self.scheduler.deadline_in_seconds = config['cycle_deadline_in_seconds'] if 'cycle_deadline_in_seconds' in config else self.sleeping_window_in_seconds
+        self.scheduler.load_shedding = config['load_shedding'] if 'load_shedding' in config else True
+
+    def request_profiling(self, signum, stack):
+        """
+        Profiles the next cycles, starting with the next one
+        :param signum:
+        :param stack:
+        :return:
+        """
+        if signum == signal.SIGUSR2:
+            self.logger.info("Profiling requested for the next {nb} cycles".format(nb=self.profiling_config['cycles']))
+            self.profiling_requested = True
+
     def init_eb_environment(self, env_config):
         """
         Initializes one EB environment for the first time
         :param env_config:
         :return:
         """
-        eb_env = ""
+        eb_env = environment_alias(env_config)
 
-        if 'name' not in env_config and 'id' not in env_config:
-            raise KeyError("Environment id and name have been omitted, please specify at least one")
-
-        if 'id' in env_config:
-            eb_env += env_config['id']
+        self.logger.info("Initialisation of {eb_env}".format(eb_env=eb_env))
+        self.validate_eb_environment(eb_env, env_config)
 
-        if 'name' in env_config:
-            eb_env = env_config['name']
+        self.environments_name.append(eb_env)
+        # Checkpoints restored from the backup file are kept
+        self.shared_dictionary.setdefault(eb_env, EnvironmentState())
 
-        self.logger.info("Initialisation of {eb_env}".format(eb_env=eb_env))
+        return eb_env
 
+    def validate_eb_environment(self, eb_env, env_config):
+        """
+        Checks the required parameters of one EB environment
+        :param eb_env:
+        :param env_config:
+        :return:
+        """
         if 'key_pem' not in env_config:
             raise KeyError("Parameter 'key_pem' is not defined for environment {eb_env}".format(eb_env=eb_env))
 
         if 'files' not in env_config or ('files' in env_config and not isinstance(env_config['files'], list)):
             raise KeyError("Parameter 'files' is not defined for environment {eb_env}".format(eb_env=eb_env))
 
-        self.environments_name.append(eb_env)
-        self.shared_dictionary[eb_env] = {}
-
-        return eb_env
+        if 'priority' in env_config and not isinstance(env_config['priority'], int):
+            raise KeyError("Parameter 'priority' of environment {eb_env} should be an integer".format(eb_env=eb_env))
+
+        if 'output' in env_config and env_config['output'] not in OUTPUTS:
+            raise KeyError("Parameter 'output' of environment {eb_env} should be one of {outputs}".format(
+                eb_env=eb_env, outputs=', '.join(OUTPUTS)))
+
+        for file in env_config['files']:
+            if 'format' in file and file['format'] not in LOG_FORMATS:
+                raise KeyError("Format of {file} in environment {eb_env} should be one of {formats}".format(
+                    file=file['name'], eb_env=eb_env, formats=', '.join(sorted(LOG_FORMATS))))
+            if 'sampling' in file:
+                rate = file['sampling']['rate'] if 'rate' in file['sampling'] else 1.0
+                if not 0 <= rate <= 1:
+                    raise KeyError("Sampling rate of {file} in environment {eb_env} should be between 0 and 1".format(
+                        file=file['name'], eb_env=eb_env))
+                try:
+                    re.compile(file['sampling']['keep_pattern'] if 'keep_pattern' in file['sampling'] else '')
+                except re.error as e:
+                    raise KeyError("Sampling keep_pattern of {file} in environment {eb_env} is invalid, {error}".format(
+                        file=file['name'], eb_env=eb_env, error=str(e)))
+
+        for sink in env_config['sinks'] if 'sinks' in env_config else []:
+            if 'type' not in sink or sink['type'] not in SINK_TYPES:
+                raise KeyError("Sink type in environment {eb_env} should be one of {types}".format(
+                    eb_env=eb_env, types=', '.join(SINK_TYPES)))
+            destination = 'url' if sink['type'] == 'http' else 'directory'
+            if destination not in sink:
+                raise KeyError("Parameter '{destination}' is not defined for a {sink_type} sink of environment {eb_env}".format(
+                    destination=destination, sink_type=sink['type'], eb_env=eb_env))
 
     def load_eb_environments_config(self, signum, stack):
         """
-        Dynamically update EB log retrieval configuration if the process is not currently running
+        Requests a reload of the EB environments configuration
+        The reload itself is applied outside of the signal handler, while sleeping or before the next cycle
         :param signum:
         :param stack:
         :return:
         """
         if signum == signal.SIGUSR1:
-            if not self.is_sleeping:
-                self.logger.info("Re-loading EB environments config is currently not possible")
-            else:
-                self.logger.info("Re-loads configuration file")
-                cfg = {}
-                with open(self.config_dir_name, 'r') as ymlfile:
-                    yaml = __import__('yaml')
-                    cfg = yaml.load(ymlfile)
-                assert isinstance(cfg, dict)
-                self.logger.info("Re-loads EB environments parameters")
-                self.config = cfg
-                self.environments_name = []
-                self.environments_config = []
-                self.load_environments(cfg)
-
-                delta = time.time() - self.sleeping_start_time
-                remaining_seconds = self.sleeping_window_in_seconds - delta
-                self.logger.info("Will resume in {seconds}".format(seconds=round(float(remaining_seconds/60), 2)))
-                time.sleep(remaining_seconds)
-                self.is_sleeping = False
+            self.reload_requested = True
+
+    def request_stop(self, signum, stack):
+        """
+        Requests the constantly running process to stop once its current cycle completed, its queued logs are
+        then delivered
+        :param signum:
+        :param stack:
+        :return:
+        """
+        self.stop_requested = True
+
+    def reload_config(self):
+        """
+        Re-loads the configuration file and applies the changes of the EB environments
+        :return:
+        """
+        self.reload_requested = False
+        if self.config_file_path is None:
+            self.logger.error("Re-loading EB environments config is not possible without a configuration file")
+            return
+
+        self.logger.info("Re-loads configuration file {file}".format(file=self.config_file_path))
+        try:
+            with open(self.config_file_path, 'r') as yml_file:
+                cfg = yaml.safe_load(yml_file)
+            assert isinstance(cfg, dict)
+            cfg = self.reloaded_config(cfg)
+            self.apply_environments_diff(cfg['environments'])
+            self.config = cfg
+        except (IOError, yaml.YAMLError, AssertionError) as e:
+            self.logger.error("Configuration file {file} not re-loaded: {error}".format(file=self.config_file_path,
+                                                                                       error=str(e)))
+        except KeyError as e:
+            self.logger.error("Configuration not re-loaded, please configure the {key} key".format(key=str(e)))
+
+    def reloaded_config(self, config):
+        """
+        Configuration to apply from a re-loaded configuration file
+        :param config:
+        :return:
+        """
+        return config
+
+    def apply_environments_diff(self, environments):
+        """
+        Applies added, removed and changed EB environments
+        Unchanged environments keep their state, discovered hosts and SSH connections
+        :param environments:
+        :return:
+        """
+        old_environments = dict((environment_alias(env), env) for env in self.environments_config)
+        new_environments = [(environment_alias(env), env) for env in environments]
+        for eb_env, env_config in new_environments:
+            self.validate_eb_environment(eb_env, env_config)
+
+        new_aliases = set(eb_env for eb_env, env_config in new_environments)
+        added = [eb_env for eb_env, env_config in new_environments if eb_env not in old_environments]
+        removed = [eb_env for eb_env in old_environments if eb_env not in new_aliases]
+        changed = [eb_env for eb_env, env_config in new_environments
+                   if eb_env in old_environments and env_config != old_environments[eb_env]]
+
+        for eb_env in removed:
+            self.shared_dictionary.pop(eb_env, None)
+            eb_environment = self.eb_environments.pop(eb_env, None)
+            if eb_environment is not None:
+                eb_environment.close()
+        for eb_env in added:
+            self.shared_dictionary.setdefault(eb_env, EnvironmentState())
+
+        # Unchanged environments keep their config object, so their TailEBEnvironment is reused as is
+        self.environments_config = [old_environments[eb_env] if eb_env in old_environments and eb_env not in changed
+                                    else env_config for eb_env, env_config in new_environments]
+        self.environments_name = [eb_env for eb_env, env_config in new_environments]
+        self.save_backup()
+
+        self.logger.info("EB environments re-loaded: {added} added, {removed} removed, {changed} changed".format(
+            added=added, removed=removed, changed=changed))
@@ -0,0 +1,156 @@
+import gzip
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from classes.get_last_rotated_logs import GetLastRotatedLogs
+from classes.tail_eb_environment import TailEBEnvironment
+from util.aws_util import authorize_ssh, revoke_ssh_authorization, format_aws_file, format_key_pem_path
+from util.checkpoint_util import EnvironmentState
+from util.framing_util import count_lines, frame_blocks
+from util.offload_util import get_offload_pool, MIN_OFFLOAD_SIZE
+from util.sink_util import ship_files
+
+# Size of the uncompressed logs framed at once, cut on line boundaries
+ARCHIVE_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class BackfillEBEnvironment(object):
+    """
+    Ships the history of one EB environment: every rotated archive of every log file of every instance
+    Hosts are processed concurrently, archives of one host one after the other
+    """
+
+    def __init__(self, eb_env_alias, eb_client, ec2_client, config, logger, bucket=None, concurrency=4):
+        self.eb_env_alias = eb_env_alias
+        self.environment = TailEBEnvironment(eb_env_alias, eb_client, ec2_client, config, EnvironmentState(), logger)
+        self.bucket = bucket
+        self.concurrency = concurrency
+        self.logger = logger
+
+    def run(self):
+        """
+        Finds the instances of the environment and backfills them
+        :return: dictionary of instances, archives, compressed bytes, lines and bytes shipped
+        """
+        stats = {'instances': 0, 'archives': 0, 'compressed_bytes': 0, 'lines': 0, 'bytes': 0}
+
+        self.logger.info("{eb_env}: Finding EC2 instances ...".format(eb_env=self.eb_env_alias))
+        self.environment.find_instances()
+        self.environment.find_ec2_instance_hosts()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.backfill_instance, instance_id, host)
+                       for instance_id, host in self.environment.hosts.items()]
+            for future in futures:
+                for key, value in future.result().items():
+                    stats[key] += value
+                stats['instances'] += 1
+
+        self.logger.info("{eb_env}: Backfill completed, {nb} archives shipped".format(eb_env=self.eb_env_alias,
+                                                                                      nb=stats['archives']))
+        return stats
+
+    def backfill_instance(self, instance_id, host):
+        """
+        Ships every rotated archive of one instance
+        :param instance_id:
+        :param host:
+        :return: dictionary of archives, compressed bytes, lines and bytes shipped
+        """
+        env = self.environment
+        stats = {'archives': 0, 'compressed_bytes': 0, 'lines': 0, 'bytes': 0}
+        key_pem_path = format_key_pem_path(env.key_pem)
+
+        group = None
+        try:
+            group = authorize_ssh(instance_id, self.logger)
+            for file in env.files:
+                rotated_logs = GetLastRotatedLogs(file['name'], instance_id, host, env.user, os.curdir,
+                                                  key_pem_path, self.logger, env.ssh_port)
+                archives = rotated_logs.list_rotated_archives() or []
+                self.logger.info("{instance}: {nb} archives to backfill for {file}".format(
+                    instance=instance_id, nb=len(archives), file=file['name']))
+
+                for archive in archives:
+                    local_archive = "{dir}/{file_name}.gz".format(
+                        dir=os.curdir, file_name=format_aws_file(archive.replace('.gz', ''), instance_id))
+                    local_archive = rotated_logs.copy_rotated_archive(archive, local_archive, self.bucket)
+                    if local_archive is False:
+                        continue
+                    stats['archives'] += 1
+                    stats['compressed_bytes'] += os.path.getsize(local_archive)
+                    log_file = self.uncompress_archive(local_archive, stats)
+                    self.ship(log_file)
+        except Exception as e:
+            self.logger.error("{instance}: backfill failed, {error}".format(instance=instance_id, error=str(e)))
+        finally:
+            if group is not None:
+                revoke_ssh_authorization(instance_id, group, self.logger)
+        return stats
+
+    def uncompress_archive(self, local_archive, stats):
+        """
+        Uncompresses one archive into a log file prefixed like the tailed logs, then removes the archive
+        Archives are decompressed and framed by blocks, in the offload pool when it is enabled
+        :param local_archive:
+        :param stats:
+        :return: log file name
+        """
+        log_file_name = local_archive[:-len('.gz')]
+        # Lines are copied as bytes, like the tailed logs, whatever their encoding
+        prefix = "[{eb_env}] - ".format(eb_env=self.eb_env_alias).encode('utf-8')
+        offload_pool = get_offload_pool()
+        uncompressed_file_name = None
+        if offload_pool is not None:
+            uncompressed_file_name = log_file_name + '.raw'
+            offload_pool.decompress(local_archive, uncompressed_file_name)
+            source = open(uncompressed_file_name, 'rb')
+        else:
+            source = gzip.open(local_archive, 'rb')
+
+        try:
+            with source, open(log_file_name, 'wb') as log_file:
+                pending = b''
+                while True:
+                    block = source.read(ARCHIVE_BLOCK_SIZE)
+                    data = pending + block
+                    if len(block) > 0:
+                        # The last line of the block may continue in the next one
+                        end = data.rfind(b'\n') + 1
+                        data, pending = data[:end], data[end:]
+                    self.write_framed(log_file, data, prefix, stats)
+                    if len(block) == 0:
+                        break
+        finally:
+            if uncompressed_file_name is not None:
+                os.remove(uncompressed_file_name)
+        os.remove(local_archive)
+        return log_file_name
+
+    def write_framed(self, log_file, data, prefix, stats):
+        """
+        Writes a block of raw logs with every line prefixed
+        :param log_file: file opened in binary mode
+        :param data: raw logs, cut on a line boundary
+        :param prefix: bytes
+        :param stats:
+        :return:
+        """
+        stats['lines'] += count_lines(data)
+        offload_pool = get_offload_pool()
+        if offload_pool is not None and len(data) >= MIN_OFFLOAD_SIZE:
+            stats['bytes'] += offload_pool.write_framed(log_file, data, 0, prefix)
+            return
+        for buffers in frame_blocks(data, prefix):
+            log_file.writelines(buffers)
+            stats['bytes'] += sum(len(buffer) for buffer in buffers)
+
+    def ship(self, log_file):
+        """
+        Hands one log file over to the sinks of the environment, its api_endpoint included
+        Large files are uploaded by acknowledged chunks and files not delivered are kept on disk
+        :param log_file:
+        :return:
+        """
+        ship_files([log_file], self.environment.sinks, self.environment.keep_results_on_disk)
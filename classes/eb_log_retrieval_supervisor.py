@@ -0,0 +1,370 @@
+import copy
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import time
+
+import yaml
+
+from classes.aws_eb_log_retrieval_service import EBLogRetrievalService, environment_alias
+from util.hash_ring import ConsistentHashRing
+from util.ssh_util import reset_ssh_pool
+
+
+def partition_environments(config, nb_workers):
+    """
+    Assigns each EB environment to one worker
+    :param config:
+    :param nb_workers:
+    :return: dictionary of worker id -> list of environment configs
+    """
+    worker_ids = ['worker-{i}'.format(i=i) for i in range(nb_workers)]
+    ring = ConsistentHashRing(worker_ids)
+    partitions = {worker_id: [] for worker_id in worker_ids}
+    for env_config in config['environments']:
+        partitions[ring.get_node(environment_alias(env_config))].append(env_config)
+    return partitions
+
+
+def worker_config(config, worker_id, environments):
+    """
+    Configuration of one worker, only its environments and its own backup file
+    :param config:
+    :param worker_id:
+    :param environments:
+    :return:
+    """
+    config = copy.deepcopy(config)
+    backup_file_name = config['backup_file_name']
+    config.pop('workers', None)
+    config['environments'] = environments
+    config['backup_file_name'] = '{file_name}_{worker}'.format(file_name=backup_file_name, worker=worker_id)
+    # Workers with the same id on several collector nodes compete for the same environments
+    if 'coordination' in config:
+        config['coordination']['group'] = worker_id
+        config['coordination']['node_id'] = '{node}_{worker}'.format(
+            node=config['coordination'].get('node_id', socket.gethostname()), worker=worker_id)
+    return config
+
+
+class EBLogRetrievalWorker(EBLogRetrievalService):
+    """
+    Service of one worker process, re-loaded configuration files are cut down to the environments of the worker
+    """
+
+    def __init__(self, worker_id, nb_workers, **kwargs):
+        super().__init__(**kwargs)
+        self.worker_id = worker_id
+        self.nb_workers = nb_workers
+
+    def reloaded_config(self, config):
+        # The number of workers is only changed by a restart of the supervisor
+        environments = partition_environments(config, self.nb_workers)[self.worker_id]
+        return worker_config(config, self.worker_id, environments)
+
+
+def run_worker(worker_id, nb_workers, config, config_relative_dir_name, config_file_path, metrics_queue):
+    """
+    Entry point of one worker process, tails its own share of the EB environments
+    :param worker_id:
+    :param nb_workers:
+    :param config:
+    :param config_relative_dir_name:
+    :param config_file_path: configuration file re-loaded on SIGUSR1, forwarded by the supervisor
+    :param metrics_queue:
+    :return:
+    """
+    reset_ssh_pool()
+    # Ctrl-C signals the whole process group, the supervisor then stops its workers with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger = logging.getLogger('AWS_EB_Log_Retrieval.{worker}'.format(worker=worker_id))
+
+    def publish(metrics):
+        metrics_queue.put((worker_id, dict(metrics)))
+
+    service = EBLogRetrievalWorker(worker_id, nb_workers, config=config,
+                                   config_relative_dir_name=config_relative_dir_name, logger=logger,
+                                   metrics_callback=publish, config_file_path=config_file_path)
+    # The supervisor stops workers with SIGTERM, they complete their cycle and deliver their queued logs
+    signal.signal(signal.SIGTERM, service.request_stop)
+    service.start_eb_log_retrieval_process()
+
+
+class EBLogRetrievalSupervisor(object):
+    """
+    Splits the EB environments across worker processes with consistent hashing
+    Each worker has its own SSH connection pool and its own backup file (checkpoint partition),
+    the supervisor restarts dead workers and merges their health and metrics into one file
+    """
+
+    def __init__(self, config, config_relative_dir_name, logger, config_file_path=None):
+        self.config = config
+        self.config_dir_name = config_relative_dir_name
+        self.config_file_path = config_file_path
+        self.logger = logger
+
+        self.nb_workers = int(config['workers'])
+        self.health_check_interval_in_seconds = config.get('health_check_interval_in_seconds', 10)
+        self.stop_timeout_in_seconds = config.get('stop_timeout_in_seconds', 300)
+        self.health_file_location = '{backup_dir}/{file_name}_health.json'.format(
+            backup_dir=os.path.expanduser(config['backup_directory']), file_name=config['backup_file_name'])
+
+        self.metrics_queue = multiprocessing.Queue()
+        self.workers = {}
+        self.reload_requested = False
+        self.running = True
+
+    def partition_environments(self):
+        """
+        Assigns each EB environment to one worker
+        :return: dictionary of worker id -> list of environment configs
+        """
+        return partition_environments(self.config, self.nb_workers)
+
+    def worker_config(self, worker_id, environments):
+        return worker_config(self.config, worker_id, environments)
+
+    def backup_files(self):
+        """
+        :return: backup files of the single process mode and of every worker, whatever their number was
+        """
+        backup_file_location = '{backup_dir}/{file_name}'.format(
+            backup_dir=os.path.expanduser(self.config['backup_directory']), file_name=self.config['backup_file_name'])
+        # Health file and spool directories of the workers are not backup files
+        worker_file_names = [file_name for file_name in glob.glob(glob.escape(backup_file_location) + '_worker-*')
+                             if file_name.rsplit('-', 1)[-1].isdigit()]
+        return [file_name for file_name in [backup_file_location] + sorted(worker_file_names)
+                if os.path.isfile(file_name)]
+
+    def seed_backup(self, worker_id):
+        """
+        Seeds the backup file of a worker with the checkpoints of its environments found in the other backup files,
+        so that environments moved to this worker, e.g. by a change of the number of workers, are not collected
+        again from the beginning of their log files. The most recently updated checkpoint of an environment wins
+        :param worker_id:
+        :return:
+        """
+        worker = self.workers[worker_id]
+        worker_backup_location = '{backup_dir}/{file_name}'.format(
+            backup_dir=os.path.expanduser(worker['config']['backup_directory']),
+            file_name=worker['config']['backup_file_name'])
+        backups = {}
+        for file_name in self.backup_files():
+            try:
+                with open(file_name, 'r') as backup:
+                    content = backup.read()
+                    dictionary = json.loads(content) if len(content) > 1 else {}
+                backups[file_name] = dictionary if isinstance(dictionary, dict) else {}
+            except (IOError, ValueError) as e:
+                self.logger.error("Backup file {file} not read: {error}".format(file=file_name, error=str(e)))
+        if worker_backup_location not in backups and os.path.isfile(worker_backup_location):
+            # An unreadable backup file is left as it is, for the worker to report it
+            return
+
+        seeded = dict(backups.pop(worker_backup_location, {}))
+        moved = []
+        for eb_env in worker['environments']:
+            # The checkpoint of the worker's own backup file comes first, so that it is kept on a tie
+            checkpoints = [backup[eb_env] for backup in [seeded] + list(backups.values())
+                           if isinstance(backup.get(eb_env), dict)]
+            if len(checkpoints) == 0:
+                continue
+            latest = max(checkpoints, key=lambda environment: str(environment.get('last_time_updated', '')))
+            if seeded.get(eb_env) is not latest:
+                seeded[eb_env] = latest
+                moved.append(eb_env)
+        if len(moved) == 0:
+            return
+        with open(worker_backup_location, 'w+') as backup:
+            backup.write(json.dumps(seeded))
+        self.logger.info("{worker}: checkpoints of {envs} seeded from the other backup files".format(
+            worker=worker_id, envs=', '.join(moved)))
+
+    def start_worker(self, worker_id):
+        worker = self.workers[worker_id]
+        process = multiprocessing.Process(target=run_worker, name=worker_id,
+                                          args=(worker_id, self.nb_workers, worker['config'], self.config_dir_name,
+                                                self.config_file_path, self.metrics_queue))
+        # Not daemonic, so that workers can start their own offload pool, they are stopped and joined by the supervisor
+        process.start()
+        worker['process'] = process
+        worker['started_at'] = time.time()
+        self.logger.info("{worker}: started with pid {pid} for {nb} environments".format(
+            worker=worker_id, pid=process.pid, nb=len(worker['config']['environments'])))
+
+    def start(self):
+        """
+        Starts the workers and supervises them until SIGTERM or SIGINT
+        :return:
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.request_reload)
+        signal.signal(signal.SIGUSR2, self.forward_signal)
+
+        self.assign_environments()
+
+        try:
+            last_health_check = 0
+            while self.running:
+                if self.reload_requested:
+                    self.reload_config()
+
+                try:
+                    worker_id, metrics = self.metrics_queue.get(timeout=1)
+                    if worker_id in self.workers:
+                        self.workers[worker_id]['metrics'] = metrics
+                except queue.Empty:
+                    pass
+
+                if time.time() - last_health_check >= self.health_check_interval_in_seconds:
+                    last_health_check = time.time()
+                    self.check_workers()
+                    self.write_health()
+        finally:
+            self.stop_workers()
+        self.write_health()
+        self.logger.info("All workers stopped")
+
+    def stop_workers(self):
+        """
+        Sends SIGTERM to every worker, then waits for them to complete their cycle and deliver their queued logs
+        Workers still running after the stop timeout are killed
+        :return:
+        """
+        processes = [worker['process'] for worker in self.workers.values()
+                     if worker['process'] is not None and worker['process'].is_alive()]
+        for process in processes:
+            process.terminate()
+        deadline = time.time() + self.stop_timeout_in_seconds
+        for process in processes:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                self.logger.error("{worker}: not stopped after {sec} s, killed".format(
+                    worker=process.name, sec=self.stop_timeout_in_seconds))
+                process.kill()
+                process.join()
+
+    def assign_environments(self):
+        """
+        Gives each worker its share of the EB environments, workers without any are not started
+        Running workers keep running, they re-load their own share of the configuration file
+        :return:
+        """
+        for worker_id, environments in self.partition_environments().items():
+            if worker_id in self.workers:
+                self.workers[worker_id]['config'] = self.worker_config(worker_id, environments)
+                self.workers[worker_id]['environments'] = [environment_alias(env) for env in environments]
+                continue
+            if len(environments) == 0:
+                self.logger.info("{worker}: no environment assigned, not started".format(worker=worker_id))
+                continue
+            self.workers[worker_id] = {'config': self.worker_config(worker_id, environments),
+                                       'environments': [environment_alias(env) for env in environments],
+                                       'process': None, 'restarts': 0, 'metrics': {}}
+            self.seed_backup(worker_id)
+            self.start_worker(worker_id)
+
+    def reload_config(self):
+        """
+        Re-loads the configuration file: workers given their first environments are started, and the running
+        workers are sent SIGUSR1 to re-load their share
+        :return:
+        """
+        self.reload_requested = False
+        if self.config_file_path is None:
+            self.logger.error("Re-loading EB environments config is not possible without a configuration file")
+            return
+
+        self.logger.info("Re-loads configuration file {file}".format(file=self.config_file_path))
+        try:
+            with open(self.config_file_path, 'r') as yml_file:
+                cfg = yaml.safe_load(yml_file)
+            assert isinstance(cfg, dict)
+            cfg['backup_file_name']
+            partition_environments(cfg, self.nb_workers)
+        except (IOError, yaml.YAMLError, AssertionError) as e:
+            self.logger.error("Configuration file {file} not re-loaded: {error}".format(file=self.config_file_path,
+                                                                                       error=str(e)))
+            return
+        except KeyError as e:
+            self.logger.error("Configuration not re-loaded, please configure the {key} key".format(key=str(e)))
+            return
+
+        if int(cfg.get('workers', 1)) != self.nb_workers:
+            self.logger.warning("The number of workers is only changed by a restart, keeping {nb}".format(
+                nb=self.nb_workers))
+        cfg['workers'] = self.nb_workers
+        self.config = cfg
+        self.forward_signal(signal.SIGUSR1, None)
+        self.assign_environments()
+
+    def check_workers(self):
+        """
+        Restarts the workers that died, waiting longer after each restart
+        :return:
+        """
+        for worker_id, worker in self.workers.items():
+            process = worker['process']
+            if process.is_alive():
+                continue
+            backoff = min(300, 10 * (2 ** worker['restarts']))
+            if time.time() - worker['started_at'] < backoff:
+                continue
+            self.logger.error("{worker}: exited with code {code}, restarting".format(worker=worker_id,
+                                                                                     code=process.exitcode))
+            worker['restarts'] += 1
+            self.start_worker(worker_id)
+
+    def merged_metrics(self):
+        """
+        Merges the metrics of every worker, counters are summed and 'last_*' values are maxed
+        :return:
+        """
+        totals = {}
+        for worker in self.workers.values():
+            for key, value in worker['metrics'].items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key.startswith('last_'):
+                    totals[key] = max(totals.get(key, value), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def write_health(self):
+        health = {
+            'updated_at': time.time(),
+            'workers': {worker_id: {'pid': worker['process'].pid,
+                                    'alive': worker['process'].is_alive(),
+                                    'restarts': worker['restarts'],
+                                    'environments': worker['environments'],
+                                    'metrics': worker['metrics']}
+                        for worker_id, worker in self.workers.items()},
+            'totals': self.merged_metrics()
+        }
+        with open(self.health_file_location, 'w+') as health_file:
+            health_file.write(json.dumps(health, indent=4, sort_keys=True))
+
+    def forward_signal(self, signum, stack):
+        for worker in self.workers.values():
+            if worker['process'] is not None and worker['process'].is_alive():
+                os.kill(worker['process'].pid, signum)
+
+    def request_reload(self, signum, stack):
+        """
+        Requests a reload of the configuration file, applied by the supervision loop
+        :param signum:
+        :param stack:
+        :return:
+        """
+        self.reload_requested = True
+
+    def stop(self, signum, stack):
+        self.logger.info("Stopping workers")
+        self.running = False
@@ -1,17 +1,18 @@
 import os
-import paramiko
-import paramiko.config
 import gzip
+import shutil
 
 from datetime import datetime
-from paramiko.ssh_exception import SSHException
 
 from util.aws_util import format_aws_file
+from util.offload_util import get_offload_pool
+from util.ssh_util import get_ssh_pool
+from util.profiling_util import profiled_stage
 
 class GetLastRotatedLogs(object):
 
     def __init__(self, based_on_file, for_ec2_instance, from_ec2_host, with_user,
-                 destination_dir, key_pem_file=None, logger=None):
+                 destination_dir, key_pem_file=None, logger=None, ssh_port=22):
         self.rotated_path = 'rotated'
         self.ydm = datetime.now().strftime("%Y%d%m")
         self.dir_name = os.path.dirname(based_on_file)
@@ -22,10 +23,9 @@ class GetLastRotatedLogs(object):
         self.destination_dir = destination_dir
         self.key_pem_file = key_pem_file
         self.logger = logger
+        self.ssh_port = ssh_port
 
-        self.ssh_cli = paramiko.SSHClient()
-        self.ssh_cli.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh_cli.load_system_host_keys()
+        self.ssh_pool = get_ssh_pool()
 
         self.cd_command = "cd {dir_name}/{rotated_path}".format(dir_name=self.dir_name, rotated_path=self.rotated_path)
         self.ls_command = "ls -Artl {base_name}*gz".format(base_name=self.base_name)
@@ -35,17 +35,53 @@ class GetLastRotatedLogs(object):
         self.ls_tail_grep = " | ".join((self.ls_command, self.tail_command, self.grep_command))
         self.cd_ls_tail_grep = " && ".join((self.cd_command, self.ls_tail_grep))
 
+        # Every archive, the oldest first
+        self.ls_all_command = "ls -1tr {base_name}*gz".format(base_name=self.base_name)
+        self.cd_ls_all_grep = " && ".join((self.cd_command, " | ".join((self.ls_all_command, self.grep_command))))
+
+    @profiled_stage('GetLastRotatedLogs.list_rotated_archives')
+    def list_rotated_archives(self):
+        """
+        Lists every rotated archive of the file, the oldest first
+        :return: list of archive names, None if they could not be listed
+        """
+        from paramiko.ssh_exception import SSHException
+
+        archives = None
+        ssh_cli = None
+        broken = False
+        try:
+            ssh_cli = self.ssh_pool.acquire(self.host, self.ssh_port, self.user, self.key_pem_file)
+            self.logger.debug(self.cd_ls_all_grep)
+            stdin, stdout, stderr = ssh_cli.exec_command(self.cd_ls_all_grep)
+            archives = [line.strip() for line in stdout.readlines() if line.strip() != '']
+            for line in stderr.readlines():
+                self.logger.debug(line)
+        except SSHException as e:
+            broken = True
+            self.logger.error("SSH exception while connecting to {host}: {err}".format(host=self.host, err=str(e)))
+        finally:
+            if ssh_cli is not None:
+                self.ssh_pool.release(ssh_cli, broken)
+
+        return archives
+
+    @profiled_stage('GetLastRotatedLogs.get_last_rotated_archive')
     def get_last_rotated_archive(self):
         """
         Get the most recent archive containing all the logs from the previous rotation
         :return:
         """
+        from paramiko.ssh_exception import SSHException
+
         last_rotated_archive = None
+        ssh_cli = None
+        broken = False
         try:
-            self.ssh_cli.connect(self.host, username=self.user, key_filename=self.key_pem_file)
+            ssh_cli = self.ssh_pool.acquire(self.host, self.ssh_port, self.user, self.key_pem_file)
             self.logger.debug("Retrieving the most recent logs archive for {base_name} ...".format(base_name=self.base_name))
             self.logger.debug(self.cd_ls_tail_grep)
-            stdin, stdout, stderr = self.ssh_cli.exec_command(self.cd_ls_tail_grep)
+            stdin, stdout, stderr = ssh_cli.exec_command(self.cd_ls_tail_grep)
 
             error = stderr.readlines()
             output = stdout.readlines()
@@ -60,53 +96,89 @@ class GetLastRotatedLogs(object):
             else: last_rotated_archive = "No rotated archive for {base_name}".format(base_name=self.base_name)
 
         except SSHException as e:
+            broken = True
             self.logger.error("SSH exception while connecting to {host}: {err}".format(host=self.host, err=str(e)))
         finally:
-            self.ssh_cli.close()
+            if ssh_cli is not None:
+                self.ssh_pool.release(ssh_cli, broken)
 
         return last_rotated_archive
 
-    def copy_rotated_archive(self, last_rotated_archive):
+    @profiled_stage('GetLastRotatedLogs.copy_rotated_archive')
+    def copy_rotated_archive(self, last_rotated_archive, local_path_file=None, bucket=None):
         """
         Download the compressed archive locally
         :param last_rotated_archive:
+        :param local_path_file: local copy, defaults to the rotated file of the instance
+        :param bucket: optional token bucket capping the bandwidth, in bytes per second
         :return:
         """
+        from paramiko.ssh_exception import SSHException
+
         if last_rotated_archive != "":
 
             rotated_path_file = "{dir_name}/{rotated_path}/{rotated_archive}".format(dir_name=self.dir_name,
                                                                                      rotated_path=self.rotated_path,
                                                                                      rotated_archive=last_rotated_archive)
 
-            base_file_name = format_aws_file(self.base_name, self.instance_id)
-            local_path_file = "{dir}/{base_file_name}_{rotated}.gz".format(dir=self.destination_dir,
-                                                                           base_file_name=base_file_name,
-                                                                           rotated=self.rotated_path)
+            if local_path_file is None:
+                base_file_name = format_aws_file(self.base_name, self.instance_id)
+                local_path_file = "{dir}/{base_file_name}_{rotated}.gz".format(dir=self.destination_dir,
+                                                                               base_file_name=base_file_name,
+                                                                               rotated=self.rotated_path)
+            ssh_cli = None
+            sftp = None
+            broken = False
             try:
-                self.logger.debug("Opening transport for SFTP transfer ...")
-                private_key = paramiko.RSAKey.from_private_key_file(self.key_pem_file)
-                transport = paramiko.Transport((self.host, paramiko.config.SSH_PORT))
-                transport.connect(username=self.user, pkey=private_key)
+                self.logger.debug("Opening SFTP channel on the pooled SSH connection ...")
+                ssh_cli = self.ssh_pool.acquire(self.host, self.ssh_port, self.user, self.key_pem_file)
 
                 self.logger.debug("Copying {archive} from remote to local ...".format(archive=last_rotated_archive))
-                sftp = paramiko.SFTPClient.from_transport(transport)
-                sftp.get(rotated_path_file, local_path_file)
+                sftp = ssh_cli.open_sftp()
+                if bucket is None:
+                    sftp.get(rotated_path_file, local_path_file)
+                else:
+                    self.throttled_get(sftp, rotated_path_file, local_path_file, bucket)
 
             except SSHException as e:
+                broken = True
                 local_path_file = False
                 self.logger.error("SSH exception while copying {file} using SFTP: {err}".format(file=last_rotated_archive, err=str(e)))
             except Exception as e:
                 local_path_file = False
                 self.logger.error(str(e))
             finally:
-                sftp.close()
-                transport.close()
+                if sftp is not None:
+                    sftp.close()
+                if ssh_cli is not None:
+                    self.ssh_pool.release(ssh_cli, broken)
 
         return local_path_file
 
-    def get_rotated_file(self):
+    @staticmethod
+    def throttled_get(sftp, remote_path, local_path, bucket, chunk_size=32768):
+        """
+        Copies a remote file chunk by chunk, within the bandwidth of the token bucket
+        :param sftp:
+        :param remote_path:
+        :param local_path:
+        :param bucket:
+        :param chunk_size:
+        :return:
+        """
+        with sftp.open(remote_path, 'rb') as remote_file, open(local_path, 'wb') as local_file:
+            while True:
+                bucket.consume(chunk_size)
+                chunk = remote_file.read(chunk_size)
+                if not chunk:
+                    break
+                local_file.write(chunk)
+
+    @profiled_stage('GetLastRotatedLogs.get_rotated_file')
+    def get_rotated_file(self, bucket=None):
         """
         Get the most recent remote archive, download it and uncompress it
+        :param bucket: optional token bucket capping the bandwidth of the download, in bytes per second
         :return:
         """
         # Get the archive name of the most recent rotated logs
@@ -115,19 +187,21 @@ class GetLastRotatedLogs(object):
         # Copy the archive remotely to locally
         local_path_archive = False
         if last_rotated_archive is not None and last_rotated_archive != '':
-            local_path_archive = self.copy_rotated_archive(last_rotated_archive)
+            local_path_archive = self.copy_rotated_archive(last_rotated_archive, bucket=bucket)
 
         # Uncompress the archive and remove it
         local_path_uncompressed_archive = False
         if local_path_archive is not False:
 
-            with gzip.open(local_path_archive, 'rb') as gz:
-                self.logger.debug("Uncompressing {archive} ...".format(archive=local_path_archive))
-                bytes = gz.read()
-                uncompressed_file_name = local_path_archive.replace('.gz', '')
-                with open(uncompressed_file_name, 'wb') as file:
-                    file.write(bytes)
-                local_path_uncompressed_archive = uncompressed_file_name
+            self.logger.debug("Uncompressing {archive} ...".format(archive=local_path_archive))
+            uncompressed_file_name = local_path_archive.replace('.gz', '')
+            offload_pool = get_offload_pool()
+            if offload_pool is not None:
+                offload_pool.decompress(local_path_archive, uncompressed_file_name)
+            else:
+                with gzip.open(local_path_archive, 'rb') as gz, open(uncompressed_file_name, 'wb') as file:
+                    shutil.copyfileobj(gz, file, 1024 * 1024)
+            local_path_uncompressed_archive = uncompressed_file_name
 
             self.logger.debug("Removing {archive} ...".format(archive=local_path_archive))
             os.remove(local_path_archive)
@@ -0,0 +1,216 @@
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class LeaseBackend(object):
+    """
+    Storage of the environment leases shared by every collector node
+    """
+
+    def heartbeat(self, node_id, group):
+        raise NotImplementedError
+
+    def live_nodes(self, group, ttl):
+        raise NotImplementedError
+
+    def acquire(self, resource, node_id, ttl):
+        """
+        Claims or renews a lease
+        :return: tuple (acquired, previous owner)
+        """
+        raise NotImplementedError
+
+    def release(self, resource, node_id):
+        raise NotImplementedError
+
+    def owned_by(self, node_id):
+        raise NotImplementedError
+
+    def save_checkpoint(self, resource, node_id, checkpoint):
+        """
+        Commits the checkpoint of a resource, only if the node still owns its lease
+        :return: True if committed
+        """
+        raise NotImplementedError
+
+    def load_checkpoint(self, resource):
+        raise NotImplementedError
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Lease table stored in a SQLite database, on a filesystem shared by the collector nodes
+    """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock = threading.Lock()
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS leases (resource TEXT PRIMARY KEY, owner TEXT, "
+                               "expires_at REAL, checkpoint TEXT, checkpoint_at REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, node_group TEXT, "
+                               "heartbeat_at REAL)")
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return _Transaction(connection)
+
+    def heartbeat(self, node_id, group):
+        with self.lock, self.connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO nodes (node_id, node_group, heartbeat_at) VALUES (?, ?, ?)",
+                               (node_id, group, time.time()))
+
+    def live_nodes(self, group, ttl):
+        with self.lock, self.connect() as connection:
+            rows = connection.execute("SELECT node_id FROM nodes WHERE node_group = ? AND heartbeat_at > ?",
+                                      (group, time.time() - ttl)).fetchall()
+        return [row[0] for row in rows]
+
+    def acquire(self, resource, node_id, ttl):
+        now = time.time()
+        with self.lock, self.connect() as connection:
+            row = connection.execute("SELECT owner, expires_at FROM leases WHERE resource = ?",
+                                     (resource,)).fetchone()
+            if row is None:
+                connection.execute("INSERT INTO leases (resource, owner, expires_at) VALUES (?, ?, ?)",
+                                   (resource, node_id, now + ttl))
+                return True, None
+
+            owner, expires_at = row
+            if owner == node_id or owner is None or expires_at < now:
+                connection.execute("UPDATE leases SET owner = ?, expires_at = ? WHERE resource = ?",
+                                   (node_id, now + ttl, resource))
+                return True, owner
+            return False, owner
+
+    def release(self, resource, node_id):
+        with self.lock, self.connect() as connection:
+            connection.execute("UPDATE leases SET owner = NULL, expires_at = 0 WHERE resource = ? AND owner = ?",
+                               (resource, node_id))
+
+    def owned_by(self, node_id):
+        with self.lock, self.connect() as connection:
+            rows = connection.execute("SELECT resource FROM leases WHERE owner = ? AND expires_at > ?",
+                                      (node_id, time.time())).fetchall()
+        return [row[0] for row in rows]
+
+    def save_checkpoint(self, resource, node_id, checkpoint):
+        with self.lock, self.connect() as connection:
+            cursor = connection.execute("UPDATE leases SET checkpoint = ?, checkpoint_at = ? "
+                                        "WHERE resource = ? AND owner = ?",
+                                        (json.dumps(checkpoint), time.time(), resource, node_id))
+            return cursor.rowcount == 1
+
+    def load_checkpoint(self, resource):
+        with self.lock, self.connect() as connection:
+            row = connection.execute("SELECT checkpoint FROM leases WHERE resource = ?", (resource,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] is not None else None
+
+
+class _Transaction(object):
+    """
+    Runs statements of a SQLite connection in one immediate transaction, then closes the connection
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.connection.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            self.connection.close()
+
+
+LEASE_BACKENDS = {
+    'sqlite': SQLiteLeaseBackend
+}
+
+
+class LeaseManager(object):
+    """
+    Decides which EB environments this collector node tails
+    Every node claims its fair share of the environments, renews its leases on each cycle and
+    takes over the environments of dead nodes, restarting from their last committed checkpoint
+    """
+
+    def __init__(self, config, logger):
+        self.node_id = config.get('node_id', socket.gethostname())
+        self.group = config.get('group', 'default')
+        self.ttl = config.get('lease_ttl_in_seconds', 600)
+        self.logger = logger
+
+        backend = config.get('backend', 'sqlite')
+        if backend not in LEASE_BACKENDS:
+            raise KeyError("Lease backend '{backend}' is not supported".format(backend=backend))
+        self.backend = LEASE_BACKENDS[backend](config['path'])
+        self.owned = set()
+
+    def claim_environments(self, environments):
+        """
+        Renews the leases of this node and claims free or expired environments up to its fair share
+        :param environments: list of environment aliases
+        :return: dictionary of newly owned environments -> last committed checkpoint (None if never committed)
+        """
+        self.backend.heartbeat(self.node_id, self.group)
+
+        # Environments removed from the configuration file are handed back and no longer count toward the share
+        for env in self.owned - set(environments):
+            self.logger.info("{env}: lease released, environment no longer configured".format(env=env))
+            self.backend.release(env, self.node_id)
+            self.owned.discard(env)
+
+        nb_nodes = max(1, len(self.backend.live_nodes(self.group, self.ttl)))
+        fair_share = int(math.ceil(len(environments) / float(nb_nodes)))
+
+        # Hands environments over to nodes that joined since the leases were claimed
+        owned = [env for env in environments if env in self.owned]
+        for env in owned[fair_share:]:
+            self.logger.info("{env}: lease released for a new node".format(env=env))
+            self.backend.release(env, self.node_id)
+            self.owned.discard(env)
+
+        acquired = {}
+        for env in environments:
+            if env not in self.owned and len(self.owned) >= fair_share:
+                continue
+            is_acquired, previous_owner = self.backend.acquire(env, self.node_id, self.ttl)
+            if not is_acquired:
+                self.owned.discard(env)
+                continue
+            if env not in self.owned:
+                if previous_owner not in (None, self.node_id):
+                    self.logger.info("{env}: taken over from {node}".format(env=env, node=previous_owner))
+                acquired[env] = self.backend.load_checkpoint(env)
+                self.owned.add(env)
+        return acquired
+
+    def owns(self, environment):
+        return environment in self.owned
+
+    def commit(self, environment, checkpoint):
+        """
+        Commits the checkpoint of one environment, drops it if the lease was lost in the meantime
+        :param environment:
+        :param checkpoint:
+        :return:
+        """
+        if not self.backend.save_checkpoint(environment, self.node_id, checkpoint):
+            self.logger.error("{env}: lease lost, checkpoint not committed".format(env=environment))
+            self.owned.discard(environment)
+            return False
+        return True
+
+    def release_all(self):
+        for environment in list(self.owned):
+            self.backend.release(environment, self.node_id)
+        self.owned = set()
@@ -1,10 +1,32 @@
-import copy
 import datetime
-
-from botocore.parsers import ResponseParserError
-from botocore.exceptions import ClientError, EndpointConnectionError
+import os
+import time
 
 from classes.tail_ec2_instance import TailEC2Instance
+from util.async_util import get_async_engine
+from util.aws_util import format_aws_file
+from util.checkpoint_util import EnvironmentState
+from util.merge_util import merge_log_files
+from util.profiling_util import profiled_stage
+from util.rollup_util import AccessLogRollup
+from util.sink_util import get_sink, ship_files
+from util.ssh_util import get_ssh_pool
+from util.throttle_util import HostThrottle
+
+# EC2 instance states of the instances leaving an environment
+LEAVING_STATES = ('shutting-down', 'stopping', 'terminated', 'stopped')
+
+
+def environment_checkpoints(environment_dict):
+    """
+    :param environment_dict: EnvironmentState, its persisted format or None
+    :return: EnvironmentState
+    """
+    if environment_dict is None:
+        return EnvironmentState()
+    if isinstance(environment_dict, dict):
+        return EnvironmentState.from_dict(environment_dict)
+    return environment_dict
 
 
 class TailEBEnvironment(object):
@@ -16,6 +38,7 @@ class TailEBEnvironment(object):
         self.ec2_client = ec2_client
 
         # Config
+        self.config = config
         self.eb_env_alias = eb_env_alias
         self.environment_id = config['id'] if 'id' in config else ''
         self.environment_name = config['name'] if 'name' in config else ''
@@ -26,15 +49,103 @@ class TailEBEnvironment(object):
         self.user = config['user'] if 'user' in config else 'ec2-user'
         self.use_private_ip = config['use_private_ip'] if 'use_private_ip' in config else False
         self.api_endpoint = config['api_endpoint'] if 'api_endpoint' in config else None
+        self.ssh_port = config['ssh_port'] if 'ssh_port' in config else 22
+
+        # Environments with a lower priority are collected last and shed first when cycles overrun
+        self.priority = config['priority'] if 'priority' in config else 0
+
+        # Destinations of the saved files, each with its own queue and workers, the api_endpoint is an HTTP sink
+        sinks_config = list(config['sinks']) if 'sinks' in config else []
+        if self.api_endpoint is not None:
+            sinks_config.append({'type': 'http', 'url': self.api_endpoint})
+        self.sinks = [get_sink(sink_config, logger) for sink_config in sinks_config]
+
+        # Logs of files with a format can be shipped as structured records instead of raw lines
+        self.output = config['output'] if 'output' in config else 'raw'
+
+        # Optional merge of the logs of every instance into one time ordered file per cycle, of raw lines only
+        merge_config = config['merge'] if 'merge' in config else {}
+        self.merge_logs = merge_config['enabled'] if 'enabled' in merge_config else False
+        if self.merge_logs and self.output != 'raw':
+            logger.warning("{eb_env}: logs are not merged with the {output} output".format(eb_env=eb_env_alias,
+                                                                                           output=self.output))
+            self.merge_logs = False
+        self.reorder_window = merge_config['reorder_window_in_seconds'] if 'reorder_window_in_seconds' in merge_config else 5
+
+        # Optional per-minute rollups of the access logs, flushed every interval instead of shipping every line
+        rollups_config = config['rollups'] if 'rollups' in config else {}
+        rollups_enabled = rollups_config['enabled'] if 'enabled' in rollups_config else False
+        self.rollup = AccessLogRollup(eb_env_alias) if rollups_enabled else None
+        self.rollup_flush_interval = rollups_config['flush_interval_in_seconds'] if 'flush_interval_in_seconds' in rollups_config else 60
+        self.rollup_raw_files = rollups_config['raw_files'] if 'raw_files' in rollups_config else []
+        self.rollup_sinks = [get_sink({'type': 'http', 'url': rollups_config['api_endpoint']}, logger)] \
+            if 'api_endpoint' in rollups_config else self.sinks
+        self.last_rollup_flush = time.time()
+
+        # Optional limits on each host, so that the collection does not hurt the workloads of the instances
+        throttling_config = config['throttling'] if 'throttling' in config else {}
+        max_bandwidth = throttling_config['max_bandwidth_per_host_in_kbps'] if 'max_bandwidth_per_host_in_kbps' in throttling_config else None
+        self.max_bandwidth_per_host = max_bandwidth * 1024 if max_bandwidth else None
+        self.max_channels_per_host = throttling_config['max_channels_per_host'] if 'max_channels_per_host' in throttling_config else None
+        self.command_prefix = ''
+        if 'nice' in throttling_config:
+            self.command_prefix += "nice -n {nice} ".format(nice=throttling_config['nice'])
+        if 'ionice_class' in throttling_config:
+            self.command_prefix += "ionice -c {ionice_class} ".format(ionice_class=throttling_config['ionice_class'])
+
+        # Throttles of the hosts, their token buckets are kept across cycles
+        self.host_throttles = {}
 
         # EC2 host to tail logs
         self.hosts = {}
 
-        # Dictionary of one EB environment to keep track of previously retrieved logs
-        self.environment_dict = environment_dict
+        # EC2 hosts of the instances leaving the environment (scaled in, shutting down), tailed one last time first
+        self.leaving_hosts = {}
+
+        # Instances already flushed for the last time, ignored while the environment still lists them
+        self.left_instances = set()
+
+        # Files, lines and bytes collected from every host during the last run
+        self.stats = {'files': 0, 'lines': 0, 'bytes': 0}
+
+        # Work shed during the current run because the previous cycles overran, and the units of work shed
+        self.shed_work = frozenset()
+        self.shed_stats = {'rotated_archives': 0, 'backfills': 0}
+
+        # EC2 hosts already discovered, kept across cycles when the environment object is reused
+        self.known_hosts = {}
+
+        # Checkpoints of one EB environment to keep track of previously retrieved logs
+        self.environment_state = environment_checkpoints(environment_dict)
 
         self.logger = logger
 
+    def has_same_instances(self, config):
+        """
+        Whether or not the given config targets the same EC2 hosts, so that discovered hosts can be kept
+        :param config:
+        :return:
+        """
+        return all(config.get(key) == self.config.get(key) for key in ('id', 'name', 'use_private_ip'))
+
+    def prepare_cycle(self, eb_client, ec2_client, environment_dict, shed_work=frozenset()):
+        """
+        Reuses this environment for a new cycle
+        :param eb_client:
+        :param ec2_client:
+        :param environment_dict: EnvironmentState, or its persisted format
+        :param shed_work: work shed during this cycle, see SHED_WORK
+        :return:
+        """
+        self.eb_client = eb_client
+        self.ec2_client = ec2_client
+        self.environment_state = environment_checkpoints(environment_dict)
+        self.hosts = {}
+        self.stats = {'files': 0, 'lines': 0, 'bytes': 0}
+        self.shed_work = shed_work
+        self.shed_stats = {'rotated_archives': 0, 'backfills': 0}
+
+    @profiled_stage('TailEBEnvironment.find_instances')
     def find_instances(self):
         """
         Retrieves EC2 instance identifiers for the given EB environment
@@ -46,52 +157,245 @@ class TailEBEnvironment(object):
         if self.environment_id != '':
             eb_env_args["EnvironmentId"] = self.environment_id
 
-        try:
-            responses = self.eb_client.describe_environment_resources(**eb_env_args)
-            resources = responses['EnvironmentResources']
-            for instance in resources['Instances']:
-                self.hosts[instance['Id']] = {}
-                self.logger.info("{eb_env}: Found instance {instance}".format(eb_env= self.eb_env_alias, instance=instance['Id']))
-        except EndpointConnectionError as e:
-            raise e
+        responses = self.eb_client.describe_environment_resources(**eb_env_args)
+        resources = responses['EnvironmentResources']
+        for instance in resources['Instances']:
+            self.hosts[instance['Id']] = {}
+            self.logger.info("{eb_env}: Found instance {instance}".format(eb_env= self.eb_env_alias, instance=instance['Id']))
 
+    @profiled_stage('TailEBEnvironment.find_ec2_instance_hosts')
     def find_ec2_instance_hosts(self):
         """
         Looks for EC2 instance hosts based on the EC2 identifiers retrieved
+        Hosts discovered during previous cycles are not looked for again
+        Instances gone from the environment or shutting down are leaving, their cached host is kept for a final flush
         :return:
         """
-        try:
-            responses = self.ec2_client.describe_instances(InstanceIds=list(self.hosts.keys()))
+        self.left_instances = {instance_id for instance_id in self.left_instances if instance_id in self.hosts}
+        for instance_id in self.left_instances:
+            self.hosts.pop(instance_id)
+
+        for instance_id in list(self.known_hosts):
+            if instance_id not in self.hosts:
+                self.leaving_hosts[instance_id] = self.known_hosts.pop(instance_id)
+
+        leaving_instances = []
+        unknown_instances = [instance_id for instance_id in self.hosts if instance_id not in self.known_hosts]
+        if len(unknown_instances) > 0:
+            responses = self.ec2_client.describe_instances(InstanceIds=unknown_instances)
             for reservation in responses['Reservations']:
                 for instance in reservation['Instances']:
-                    ip = instance['PrivateIpAddress'] if self.use_private_ip else instance['PublicIpAddress']
+                    ip = instance.get('PrivateIpAddress' if self.use_private_ip else 'PublicIpAddress')
+                    if ip is None:
+                        continue
                     self.logger.info("{eb_env}: Found host {ip} for instance {instance}".format(eb_env=self.eb_env_alias, ip=ip, instance=instance['InstanceId']))
-                    self.hosts[instance['InstanceId']] = ip
-        except ClientError as e:
-            raise e
-        except EndpointConnectionError as e:
-            raise e
+                    self.known_hosts[instance['InstanceId']] = ip
+                    if instance['State']['Name'] in LEAVING_STATES:
+                        leaving_instances.append(instance['InstanceId'])
 
+        # Only the instances shutting down are returned, so that the hosts of the others stay cached
+        known_instances = [instance_id for instance_id in self.hosts
+                           if instance_id in self.known_hosts and instance_id not in unknown_instances]
+        if len(known_instances) > 0:
+            responses = self.ec2_client.describe_instances(InstanceIds=known_instances, Filters=[
+                {'Name': 'instance-state-name', 'Values': list(LEAVING_STATES)}])
+            for reservation in responses['Reservations']:
+                for instance in reservation['Instances']:
+                    leaving_instances.append(instance['InstanceId'])
+
+        for instance_id in leaving_instances:
+            self.logger.info("{eb_env}: Instance {instance} is shutting down".format(eb_env=self.eb_env_alias, instance=instance_id))
+            self.leaving_hosts[instance_id] = self.known_hosts.pop(instance_id)
+
+        for instance_id in list(self.hosts):
+            if instance_id in self.known_hosts:
+                self.hosts[instance_id] = self.known_hosts[instance_id]
+            else:
+                self.hosts.pop(instance_id)
+
+    @profiled_stage('TailEBEnvironment.tail_ec2_hosts')
     def tail_ec2_hosts(self):
         """
-        Tails logs of each EC2 host listed for this EN environment
+        Tails logs of each EC2 host listed for this EN environment, one host after the other
+        The instances leaving the environment are tailed first, one last time
         :return:
         """
-        for instance_id in self.hosts.keys():
+        instances = []
+        for instance_id, host, final in self.instances_to_tail():
+            ec2_instance = self.new_ec2_instance(instance_id, host, final)
+            ec2_instance.run()
+            instances.append(ec2_instance)
+        self.close_leaving_hosts()
+        self.instances_completed(instances)
 
-            if instance_id not in self.environment_dict.keys():
-                self.environment_dict[instance_id] = {}
+    async def tail_ec2_hosts_async(self, engine):
+        """
+        Same as tail_ec2_hosts, every host being tailed concurrently as a task of the asyncio engine
+        :param engine: AsyncEngine
+        :return:
+        """
+        instances = [self.new_ec2_instance(instance_id, host, final)
+                     for instance_id, host, final in self.instances_to_tail()]
+        leaving_instances = [ec2_instance for ec2_instance in instances if ec2_instance.final]
+        other_instances = [ec2_instance for ec2_instance in instances if not ec2_instance.final]
+
+        # Final flushes do not wait behind the channels of the other instances
+        await engine.gather(ec2_instance.run_async(engine) for ec2_instance in leaving_instances)
+        await engine.blocking(None, self.close_leaving_hosts)
+        await engine.gather(ec2_instance.run_async(engine) for ec2_instance in other_instances)
+        await engine.blocking(None, self.instances_completed, instances)
+
+    def instances_to_tail(self):
+        """
+        Instances to tail during this run, the ones leaving the environment first
+        When backfills are shed, instances without checkpoint wait for a later run
+        :return: list of (instance id, host, whether or not this is the final run of the instance)
+        """
+        for instance_id in self.leaving_hosts:
+            self.logger.info("{eb_env}: Final flush of leaving instance {instance}".format(eb_env=self.eb_env_alias, instance=instance_id))
+
+        hosts = self.hosts
+        if 'backfills' in self.shed_work:
+            hosts = {instance_id: host for instance_id, host in self.hosts.items() if instance_id in self.environment_state.instances}
+            self.shed_stats['backfills'] += len(self.hosts) - len(hosts)
+            for instance_id in self.hosts:
+                if instance_id not in hosts:
+                    self.logger.info("{eb_env}: backfill of instance {instance} deferred".format(eb_env=self.eb_env_alias, instance=instance_id))
 
-            self.environment_dict[instance_id] = TailEC2Instance(self.eb_env_alias, instance_id, self.hosts[instance_id],
-                                                                 self.user, self.files, self.key_pem,
-                                                                 self.environment_dict[instance_id], self.api_endpoint,
-                                                                 self.keep_results_on_disk, self.logger).run()
+        return [(instance_id, host, True) for instance_id, host in self.leaving_hosts.items()] + \
+               [(instance_id, host, False) for instance_id, host in hosts.items()]
 
+    def close_leaving_hosts(self):
+        """
+        Closes the SSH connections of the instances which left the environment, once flushed
+        Their dictionaries are removed when the run completes
+        :return:
+        """
+        for host in self.leaving_hosts.values():
+            get_ssh_pool().close_host(host)
+            self.host_throttles.pop(host, None)
+        self.left_instances.update(self.leaving_hosts)
+        self.leaving_hosts = {}
+
+    def new_ec2_instance(self, instance_id, host, final=False):
+        """
+        Instance to tail during this run
+        When merging, instances keep their files which are then shipped as one file
+        :param instance_id:
+        :param host:
+        :param final: whether or not this is the last run of an instance leaving the environment
+        :return: TailEC2Instance
+        """
+        api_endpoint = None if self.merge_logs else self.api_endpoint
+        keep_files = True if self.merge_logs else self.keep_results_on_disk
+        sinks = [] if self.merge_logs else self.sinks
+
+        return TailEC2Instance(self.eb_env_alias, instance_id, host,
+                               self.user, self.files, self.key_pem,
+                               self.environment_state.instance(instance_id), api_endpoint,
+                               keep_files, self.logger, self.ssh_port, self.output,
+                               self.rollup, self.rollup_raw_files,
+                               self.get_host_throttle(host), self.command_prefix, sinks, final,
+                               'rotated_archives' in self.shed_work)
+
+    def instances_completed(self, instances):
+        """
+        Adds up the stats of the tailed instances and, when merging, ships their logs as one file
+        :param instances: TailEC2Instance
+        :return:
+        """
+        instance_files = []
+        sources = []
+        sampling_files = []
+        for ec2_instance in instances:
+            instance_files += ec2_instance.saved_files
+            sources += ["[{instance} {file}] ".format(instance=ec2_instance.instance_id,
+                                                      file=ec2_instance.file_sources.get(file_name, file_name))
+                        for file_name in ec2_instance.saved_files]
+            sampling_files += ec2_instance.sampling_files
+            for key in self.stats:
+                self.stats[key] += ec2_instance.stats[key]
+            self.shed_stats['rotated_archives'] += ec2_instance.deferred_archives
+
+        if self.merge_logs and len(instance_files) > 0:
+            self.merge_instance_logs(instance_files, sources)
+        if self.merge_logs:
+            ship_files(sampling_files, self.sinks, self.keep_results_on_disk)
+
+    def get_host_throttle(self, host):
+        """
+        Throttle shared by every transfer from the host
+        :param host:
+        :return: HostThrottle
+        """
+        if host not in self.host_throttles:
+            self.host_throttles[host] = HostThrottle(self.max_bandwidth_per_host, self.max_channels_per_host)
+        return self.host_throttles[host]
+
+    @profiled_stage('TailEBEnvironment.merge_instance_logs')
+    def merge_instance_logs(self, files, sources=None):
+        """
+        Merges the files saved from every instance into one time ordered file, then ships it
+        :param files:
+        :param sources: instance and log file of each file, added to the prefix of its lines
+        :return: merged file name
+        """
+        merged_file_name = format_aws_file('merged.log', self.eb_env_alias.replace('/', '_'))
+        prefix_length = len("[{eb_env}] - ".format(eb_env=self.eb_env_alias).encode('utf-8'))
+        nb_lines = merge_log_files(files, merged_file_name, self.reorder_window, prefix_length, sources)
+        self.logger.info("{eb_env}: {nb} logs of {nb_files} files merged into {file}".format(
+            eb_env=self.eb_env_alias, nb=nb_lines, nb_files=len(files), file=merged_file_name))
+
+        for file_name in files:
+            os.remove(file_name)
+        ship_files([merged_file_name], self.sinks, self.keep_results_on_disk)
+        return merged_file_name
+
+    @profiled_stage('TailEBEnvironment.flush_rollups')
+    def flush_rollups(self, force=False):
+        """
+        Writes the rollups of the access logs and ships them once the flush interval has elapsed
+        :param force: flushes whether or not the interval has elapsed
+        :return: rollups file name, None if nothing has been flushed
+        """
+        if self.rollup is None or self.rollup.nb_lines == 0:
+            return None
+        if not force and time.time() - self.last_rollup_flush < self.rollup_flush_interval:
+            return None
+
+        nb_lines = self.rollup.nb_lines
+        rollups_file_name = format_aws_file('rollups.json', self.eb_env_alias.replace('/', '_'))
+        with open(rollups_file_name, 'w') as rollups_file:
+            nb_rollups = self.rollup.flush(rollups_file)
+        self.last_rollup_flush = time.time()
+        self.logger.info("{eb_env}: {nb_lines} requests rolled up into {nb} rollups".format(
+            eb_env=self.eb_env_alias, nb_lines=nb_lines, nb=nb_rollups))
+
+        ship_files([rollups_file_name], self.rollup_sinks, self.keep_results_on_disk)
+        return rollups_file_name
+
+    def close(self):
+        """
+        Closes the SSH connections of this environment once it has been removed from the config
+        Pending rollups are flushed
+        :return:
+        """
+        self.flush_rollups(force=True)
+        for host in list(self.known_hosts.values()) + list(self.leaving_hosts.values()):
+            get_ssh_pool().close_host(host)
+        self.known_hosts = {}
+
+    @profiled_stage('TailEBEnvironment.run')
     def run(self):
         """
         Orchestrates the tailing logs process for one EB environment
+        With the asyncio engine, it is run as a task of the engine
         :return:
         """
+        engine = get_async_engine()
+        if engine is not None:
+            return engine.run(self.run_async(engine))
+
         try:
             self.logger.info("{eb_env}: Finding EC2 instances ...".format(eb_env=self.eb_env_alias))
             self.find_instances()
@@ -101,30 +405,70 @@ class TailEBEnvironment(object):
 
             self.logger.info("{eb_env}: Tailing logs from EC2 hosts ...".format(eb_env=self.eb_env_alias))
             self.tail_ec2_hosts()
+            self.flush_rollups()
 
-            self.logger.info("{eb_env}: Tailing logs completed".format(eb_env=self.eb_env_alias))
+            self.run_completed()
+        except Exception as e:
+            self.log_error(e)
+        finally:
+            return self.environment_state
+
+    async def run_async(self, engine):
+        """
+        Same as run, as tasks of the asyncio engine: the AWS discovery calls and SSH channels
+        of every environment share the limits of the engine
+        :param engine: AsyncEngine
+        :return:
+        """
+        try:
+            self.logger.info("{eb_env}: Finding EC2 instances ...".format(eb_env=self.eb_env_alias))
+            await engine.blocking('aws', self.find_instances)
+
+            self.logger.info("{eb_env}: Retrieving EC2 instance hosts ...".format(eb_env=self.eb_env_alias))
+            await engine.blocking('aws', self.find_ec2_instance_hosts)
+
+            self.logger.info("{eb_env}: Tailing logs from EC2 hosts ...".format(eb_env=self.eb_env_alias))
+            await self.tail_ec2_hosts_async(engine)
+            await engine.blocking(None, self.flush_rollups)
+
+            self.run_completed()
+        except Exception as e:
+            self.log_error(e)
+        finally:
+            return self.environment_state
+
+    def run_completed(self):
+        """
+        Updates the checkpoints of this EB environment once its hosts have been tailed
+        :return:
+        """
+        self.logger.info("{eb_env}: Tailing logs completed".format(eb_env=self.eb_env_alias))
 
-            # Add last date time updated
-            self.environment_dict['last_time_updated'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Add last date time updated
+        self.environment_state.last_time_updated = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            # Updating dictionary of this EB environment to remove EC2 instances keys that don't exist anymore
-            eb_dict_copy = copy.deepcopy(self.environment_dict)
-            for ec2_instance_key in list(eb_dict_copy):
-                if ec2_instance_key not in self.hosts.keys():
-                    self.environment_dict.pop(ec2_instance_key, None)
+        # Removes the checkpoints of the EC2 instances that don't exist anymore
+        self.environment_state.prune(self.hosts.keys())
 
-        except ResponseParserError as e:
+    def log_error(self, e):
+        """
+        Logs an error which stopped the tailing of this EB environment
+        :param e:
+        :return:
+        """
+        from botocore.parsers import ResponseParserError
+        from botocore.exceptions import ClientError, EndpointConnectionError
+
+        if isinstance(e, ResponseParserError):
             self.logger.error("{eb_env}: {error}".format(eb_env=self.eb_env_alias, error=str(e)))
             self.logger.info("{eb_env}: Expected to be fixed in botocore 1.4.53".format(eb_env=self.eb_env_alias))
-        except ClientError as e:
+        elif isinstance(e, ClientError):
             message = str(e)
             if 'Error' in e.response and 'Message' in e.response['Error']:
                 message = e.response['Error']['Message']
 
             self.logger.error("{eb_env}: {error}".format(eb_env=self.eb_env_alias, error=message))
-        except EndpointConnectionError as e:
+        elif isinstance(e, EndpointConnectionError):
             self.logger.error("{eb_env}: {error}".format(eb_env=self.eb_env_alias, error=str(e)))
-        except Exception as e:
+        else:
             self.logger.error("{eb_env}: Type ({type}) - Error ({error})".format(eb_env=self.eb_env_alias, type=type(e), error=str(e)))
-        finally:
-            return self.environment_dict
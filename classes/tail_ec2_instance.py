@@ -1,24 +1,31 @@
+import json
 import os
-import paramiko
 import queue
+import sys
 
-from botocore.exceptions import EndpointConnectionError
-from ebcli.objects.exceptions import NoRegionError
-from ebcli.objects.exceptions import ServiceError
-from os.path import expanduser
-from paramiko.ssh_exception import SSHException
 from threading import Thread
 from queue import Empty
 
-from util.aws_util import authorize_ssh, revoke_ssh_authorization, format_aws_file
-from util.curl_util import curl_post_data
+from util.aws_util import authorize_ssh, revoke_ssh_authorization, format_aws_file, format_key_pem_path
+from util.checkpoint_util import FileCheckpoint
+from util.framing_util import count_lines, skip_lines, frame_blocks, decode_lines
+from util.offload_util import get_offload_pool, MIN_OFFLOAD_SIZE
+from util.ssh_util import get_ssh_pool
+from util.parsing_util import get_log_format, write_records
+from util.profiling_util import profiled_stage
+from util.rotation_util import tail_command, parse_tail_output, has_rotated, starts_with_head, update_checkpoint
+from util.sampling_util import SamplingPolicy
+from util.sink_util import get_sink, ship_files
+from util.throttle_util import HostThrottle
 from classes.get_last_rotated_logs import GetLastRotatedLogs
 
 
 class TailEC2Instance(object):
 
     def __init__(self, eb_environment_id, instance_id, host, user, files, key_pem,
-                 instance_dict, api_endpoint=None, keep_files=True, logger=None):
+                 instance_dict, api_endpoint=None, keep_files=True, logger=None, ssh_port=22, output='raw',
+                 rollup=None, raw_files=None, throttle=None, command_prefix='', sinks=None, final=False,
+                 defer_rotated_logs=False):
 
         self.eb_environment_id = eb_environment_id
         self.instance_id = instance_id
@@ -26,25 +33,62 @@ class TailEC2Instance(object):
         self.user = user
         self.files = files
 
-        if os.path.basename(key_pem) == key_pem:
-            sep = os.path.sep
-            p = '~' + sep + '.ssh' + sep
-            p = expanduser(p)
-            self.key_pem_path = p + key_pem
-        else:
-            self.key_pem_path = key_pem
+        self.key_pem_path = format_key_pem_path(key_pem)
 
         self.instance_dict = instance_dict
         self.api_endpoint = api_endpoint
         self.keep_files = keep_files
         self.logger = logger
 
+        # Destinations of the saved files, the api_endpoint is an HTTP sink
+        if sinks is None:
+            sinks = [get_sink({'type': 'http', 'url': api_endpoint}, logger)] if api_endpoint is not None else []
+        self.sinks = sinks
+        self.ssh_port = ssh_port
+
+        # Bandwidth and channels of the host shared with the other transfers, remote commands run under nice/ionice
+        self.throttle = throttle if throttle is not None else HostThrottle()
+        self.command_prefix = command_prefix
+
+        # Last run of an instance leaving its environment: partial last lines are saved and archives swept
+        self.final = final
+
+        # Under overload, the archives of rotated files are caught up by a later run
+        self.defer_rotated_logs = defer_rotated_logs and not final
+        self.deferred_archives = 0
+
+        # Prefix of every raw log line
+        self.prefix = "[{eb_env}] - ".format(eb_env=eb_environment_id)
+        self.prefix_bytes = self.prefix.encode('utf-8')
+
+        # Logs of files with a format are written as structured records, unless the output is raw
+        self.output = output
+        self.log_formats = {file['name']: get_log_format(file.get('format')) for file in files}
+
+        # Access logs are aggregated into the rollup of the EB environment, only raw_files are still shipped
+        self.rollup = rollup
+        self.raw_files = raw_files if raw_files is not None else []
+
+        # High-volume files can be sampled, the lines sampled out are counted per file
+        self.sampling_policies = {file['name']: SamplingPolicy.from_config(file.get('sampling')) for file in files}
+        self.sampling_counts = {}
+
+        # Files, lines and bytes saved during this run
+        self.stats = {'files': 0, 'lines': 0, 'bytes': 0}
+
+        # Regular and rotated log files saved during this run, and the counts of their sampled out lines
+        self.saved_files = []
+        self.sampling_files = []
+        # Remote log file of each saved file
+        self.file_sources = {}
+
         # SSH-specific variables
         self.threads = []
         self.queue = queue.Queue()
         self.responses = []
         self.group = None
 
+    @profiled_stage('TailEC2Instance.run')
     def run(self):
         """
         Orchestrates a single EC2 instance log tailing process
@@ -57,10 +101,7 @@ class TailEC2Instance(object):
         :return:
         """
         try:
-            # Checks if log file path  exist in instance_dictionary
-            for file in self.files:
-                if file['name'] not in self.instance_dict:
-                    self.instance_dict[file['name']] = {}
+            self.init_files()
 
             # Pre-Tail step
             self.group = authorize_ssh(self.instance_id, self.logger)
@@ -68,33 +109,101 @@ class TailEC2Instance(object):
             # Part 1: Tail regular log files and, if enabled, rotated ones from archives
             regular_files = self.tail_regular_logs()
             rotated_files = self.tail_rotated_logs()
+            self.saved_files = regular_files + rotated_files
+            self.sampling_files = self.save_sampling_counts()
 
-            # Part 2 (optional): Send logs to a third-party platform
-            if self.api_endpoint is not None: self.send_log_files(regular_files + rotated_files)
-
-            # Part 3 (optional): Clear saved files of logs
-            if not self.keep_files: self.clear_log_files(regular_files + rotated_files)
+            # Part 2: Hand saved files over to the sinks, they are cleared once shipped unless kept
+            self.ship_log_files(regular_files + rotated_files + self.sampling_files)
 
             # Post-Tail step
             revoke_ssh_authorization(self.instance_id, self.group, self.logger)
 
             self.logger.info("{instance}: Tailing logs completed".format(instance=self.instance_id))
-        except KeyError as e:
-            self.logger.error("{instance}: {error}".format(instance=self.instance_id, error=str(e)))
-        except NoRegionError:
-            self.logger.error("{instance}: region should be specified with 'ebcli.classes.aws.set_region'".format(instance=self.instance_id))
-        except EndpointConnectionError as e:
-            self.logger.error("{instance}: {error}".format(instance=self.instance_id, error=str(e)))
-        except ServiceError as e:
-            self.logger.error("{instance}: code ({code}),  message({message})".format(instance=self.instance_id, code=e.code, message=str(e)))
         except Exception as e:
-            self.logger.error("{instance}: {error}".format(instance=self.instance_id, error=str(e)))
+            self.log_error(e)
         finally:
             return self.instance_dict
 
+    async def run_async(self, engine):
+        """
+        Same as run, as tasks of the asyncio engine: one task per SSH channel, the blocking steps
+        run in the executor of the engine within its limits
+        :param engine: AsyncEngine
+        :return:
+        """
+        try:
+            self.init_files()
+
+            self.group = await engine.blocking('aws', authorize_ssh, self.instance_id, self.logger)
+
+            await engine.gather(self.on_channel(engine, self.ssh_exec_command, self.tail_command(file), file['name'],
+                                                self.queue)
+                                for file in self.files)
+            # Files read again after their rotation take a channel like the tails
+            rotated_responses = await engine.blocking(None, self.check_file_identities)
+            await engine.gather(self.on_channel(engine, self.read_rotated_file, response)
+                                for response in rotated_responses)
+            regular_files = await engine.blocking(None, self.save_regular_log_files)
+            rotated_files = await self.on_channel(engine, self.tail_rotated_logs)
+            self.saved_files = regular_files + rotated_files
+            self.sampling_files = await engine.blocking(None, self.save_sampling_counts)
+
+            self.ship_log_files(regular_files + rotated_files + self.sampling_files)
+
+            await engine.blocking('aws', revoke_ssh_authorization, self.instance_id, self.group, self.logger)
+
+            self.logger.info("{instance}: Tailing logs completed".format(instance=self.instance_id))
+        except Exception as e:
+            self.log_error(e)
+        finally:
+            return self.instance_dict
+
+    async def on_channel(self, engine, function, *args):
+        """
+        Runs a blocking step taking an SSH channel of the host in the executor of the engine
+        The channel limit of the host is waited for in the loop first, so that a step waiting for it holds neither
+        a thread of the executor nor one of the 'channels' slots shared by every host
+        :param engine: AsyncEngine
+        :param function:
+        :param args:
+        :return: result of the function
+        """
+        async with self.throttle.async_channel():
+            return await engine.blocking('channels', function, *args)
+
+    def init_files(self):
+        """
+        Checks if log file paths exist in the instance dictionary
+        :return:
+        """
+        for file in self.files:
+            if file['name'] not in self.instance_dict:
+                self.instance_dict[sys.intern(file['name'])] = FileCheckpoint()
+
+    def log_error(self, e):
+        """
+        Logs an error which stopped the tailing of this instance
+        :param e:
+        :return:
+        """
+        from ebcli.objects.exceptions import NoRegionError, ServiceError
+
+        if isinstance(e, NoRegionError):
+            self.logger.error("{instance}: region should be specified with 'ebcli.classes.aws.set_region'".format(instance=self.instance_id))
+        elif isinstance(e, ServiceError):
+            self.logger.error("{instance}: code ({code}),  message({message})".format(instance=self.instance_id, code=e.code, message=str(e)))
+        else:
+            self.logger.error("{instance}: {error}".format(instance=self.instance_id, error=str(e)))
+
+    def tail_command(self, file):
+        checkpoint = self.instance_dict[file['name']]
+        offset = checkpoint.offset if checkpoint.offset is not None else 0
+        return tail_command(file['name'], offset, self.command_prefix)
+
+    @profiled_stage('TailEC2Instance.tail_regular_logs')
     def tail_regular_logs(self):
         """
-        Tails and saves the remotely regular log files
+        Tails and saves the remotely regular log files, from the byte offset reached by the previous run
         :return:
         """
         try:
@@ -102,7 +211,7 @@ class TailEC2Instance(object):
 
             self.logger.debug("{instance}: SSH into instance and tail logs".format(instance=self.instance_id))
             for file in self.files:
-                commands.append("tail --lines=+0 {log_file}".format(log_file=file['name']))
+                commands.append(self.tail_command(file))
 
             for i, cmd in enumerate(commands):
                 thread = Thread(target=self.ssh_exec_command, args=(cmd, self.files[i]['name'], self.queue))
@@ -112,76 +221,154 @@ class TailEC2Instance(object):
             for thread in self.threads:
                 thread.join()
 
-            while True:
-                self.responses.append(self.queue.get(False))
-        except Empty as e:
-            self.logger.debug("{instance}: Queue emptied".format(instance=self.instance_id))
-            return self.save_regular_log_files()
+            return self.save_responses()
         except Exception as e:
             self.logger.error("{instance}: Error type ({type})".format(instance=self.instance_id, type=type(e)))
             self.logger.error("{instance}: Error ({error})".format(instance=self.instance_id, error=str(e)))
             raise e
 
+    def save_responses(self):
+        """
+        Saves the outputs of the tail commands once every channel completed
+        :return: saved files
+        """
+        for response in self.check_file_identities():
+            self.read_rotated_file(response)
+        return self.save_regular_log_files()
+
+    def check_file_identities(self):
+        """
+        Compares the inode, size and head of every tailed file with its checkpoint
+        A replaced or truncated file has to be read again from its beginning, its previous checkpoint is kept
+        in the response for the rotated archive
+        :return: responses of the files to read again, see read_rotated_file
+        """
+        try:
+            while True:
+                self.responses.append(self.queue.get(False))
+        except Empty:
+            self.logger.debug("{instance}: Queue emptied".format(instance=self.instance_id))
+
+        rotated_responses = []
+        for response in self.responses:
+            filename = response['file']
+            checkpoint = self.instance_dict[filename]
+            response['identity'], response['start'] = parse_tail_output(response['output'])
+            response['offset'] = checkpoint.offset if checkpoint.offset is not None else 0
+            response['previous'] = None
+            response['sweep'] = False
+
+            if response['identity'] is None and self.final and checkpoint.head is not None:
+                # The file is gone from a leaving instance, its logs may only be left in the last archive
+                response['previous'], response['sweep'] = checkpoint.copy(), True
+                continue
+            if response['identity'] is None or not has_rotated(checkpoint, response['identity']):
+                continue
+
+            self.logger.info("{instance}: {filename} has been rotated since the last run".format(instance=self.instance_id, filename=filename))
+            response['previous'] = checkpoint.copy()
+            if response['offset'] > 0:
+                # The content was read from the offset reached in the previous file
+                rotated_responses.append(response)
+        return rotated_responses
+
+    def read_rotated_file(self, response):
+        """
+        Reads a rotated file again from its beginning on its own channel
+        :param response: response of the tail from the offset reached in the previous file
+        :return:
+        """
+        filename = response['file']
+        rotated_queue = queue.Queue()
+        self.ssh_exec_command(tail_command(filename, 0, self.command_prefix), filename, rotated_queue)
+        if rotated_queue.empty():
+            # The checkpoint is left as is, the rotation is detected again by the next run
+            response['identity'], response['previous'] = None, None
+            return
+        response.update(rotated_queue.get(False))
+        response['identity'], response['start'] = parse_tail_output(response['output'])
+        response['offset'] = 0
+
+    @profiled_stage('TailEC2Instance.tail_rotated_logs')
     def tail_rotated_logs(self):
         """
-        Collects the logs from the most recent archive if a rotation happened
+        Collects the logs from the most recent archive of the files rotated since the last run
+        The archive is only fetched when the identity of the file changed, or when its catch-up has been deferred
         :return:
         """
         rotated_files = []
 
         for response in self.responses:
-            output = response['output']
             filename = response['file']
-            new_nb_lines = len(output)
-
             rotated = [file['rotated'] for file in self.files if file['name'] == filename][0]
+            checkpoint = self.instance_dict[filename]
+            if not rotated:
+                continue
+
+            if response['previous'] is not None:
+                previous, sweep = response['previous'], response['sweep']
+                if checkpoint.deferred is not None:
+                    self.logger.warning("{instance}: {filename} rotated again before its deferred archive was caught up".format(instance=self.instance_id, filename=filename))
+                    checkpoint.deferred = None
+                if self.defer_rotated_logs:
+                    self.logger.info("{instance}: catch-up of the archive of {filename} deferred".format(instance=self.instance_id, filename=filename))
+                    checkpoint.deferred = previous
+                    self.deferred_archives += 1
+                    continue
+            elif checkpoint.deferred is not None and not self.defer_rotated_logs:
+                # Only caught up if the last archive is still the file previously tailed
+                previous, sweep = checkpoint.deferred, True
+                checkpoint.deferred = None
+            else:
+                continue
 
-            try:
-                # The number of lines might have never been set yet
-                if 'nb_lines' in self.instance_dict[filename]:
-                    old_nb_lines = self.instance_dict[filename]['nb_lines']
-
-                    # If already set, we have to know whether or not we are facing a log rotation
-                    if rotated and old_nb_lines > new_nb_lines:
-                        rotated_file_name = self.save_rotated_log_files(filename, old_nb_lines)
-                        if rotated_file_name is not False:
-                            rotated_files.append(rotated_file_name)
-
-                # We want to update the regular log file whether or not it's empty
-                self.instance_dict[filename]['nb_lines'] = new_nb_lines
-
-            except Exception as e:
-                self.logger.error("{instance}: Exception when updating instance dictionary, {err}".format(instance=self.instance_id, err=str(e)))
-                raise e
+            rotated_file_name = self.save_rotated_log_files(filename, previous, sweep)
+            if rotated_file_name is not False:
+                rotated_files.append(rotated_file_name)
 
         return rotated_files
 
-    def save_rotated_log_files(self, filename, old_nb_lines):
+    @profiled_stage('TailEC2Instance.save_rotated_log_files')
+    def save_rotated_log_files(self, filename, previous, sweep=False):
         """
         Saves one rotated log file from its last rotated archive
         :param filename:
-        :param old_nb_lines:
+        :param previous: checkpoint of the file before its rotation
+        :param sweep: the file is gone, the archive is only saved if it is the file previously tailed
         :return:
         """
         self.logger.debug("{instance} retrieving the most recent archive for {filename}".format(instance=self.instance_id, filename=filename))
 
         # Instantiate LastRotatedLogs to retrieve the most recent archive and copy it locally
-        local_rotated_file = GetLastRotatedLogs(filename, self.instance_id, self.host, self.user,
-                                             os.curdir, self.key_pem_path, self.logger).get_rotated_file()
+        with self.throttle.channel():
+            local_rotated_file = GetLastRotatedLogs(filename, self.instance_id, self.host, self.user,
+                                                 os.curdir, self.key_pem_path, self.logger,
+                                                 self.ssh_port).get_rotated_file(self.throttle.bucket)
 
         # We just want the logs we haven't previously processed
         if local_rotated_file is not False:
-            lines = open(local_rotated_file).readlines()
-            len_rotated_archive = len(lines)
-            difference = len_rotated_archive - old_nb_lines
+            with open(local_rotated_file, 'rb') as rotated_logs:
+                data = rotated_logs.read()
+
+            if starts_with_head(data, previous):
+                start = min(previous.offset, len(data))
+            elif sweep:
+                self.logger.debug("{instance}: the last archive of {filename} is not the file previously tailed, nothing to sweep".format(instance=self.instance_id, filename=filename))
+                os.remove(local_rotated_file)
+                return False
+            else:
+                self.logger.warning("{instance}: the last archive of {filename} is not the file previously tailed, saving it whole".format(instance=self.instance_id, filename=filename))
+                start = 0
+            difference = count_lines(data[start:])
 
             if difference > 0:
-                self.logger.debug("{instance}: {old_nb_lines} logs previously retrieved in {filename}".format(instance=self.instance_id, old_nb_lines=old_nb_lines, filename=filename))
+                self.logger.debug("{instance}: {offset} bytes previously retrieved in {filename}".format(instance=self.instance_id, offset=start, filename=filename))
                 self.logger.debug("{instance}: keeping {diff} new logs for {filename}".format(instance=self.instance_id, diff=difference, filename=filename))
-                with open(local_rotated_file, 'w') as rotated_logs:
-                    for log in lines[old_nb_lines:len_rotated_archive]:
-                        formatted_log = "[{eb_env}] - {log}".format(eb_env=self.eb_environment_id, log=log)
-                        rotated_logs.write(formatted_log)
+                self.stats['lines'] += difference
+                if not self.save_logs(local_rotated_file, data, start, filename):
+                    os.remove(local_rotated_file)
+                    return False
+                self.stats['files'] += 1
             else:
                 os.remove(local_rotated_file)
                 local_rotated_file = False
@@ -189,10 +376,12 @@ class TailEC2Instance(object):
             self.logger.error("{instance}: failed to get the rotated archive for {file}".format(instance=self.instance_id, file=filename))
         return local_rotated_file
 
+    @profiled_stage('TailEC2Instance.save_regular_log_files')
     def save_regular_log_files(self):
         """
         Saves regular log files whether or not the given outputs contain rows
-        Automatically take into consideration new logs and skips ones previously processed
+        Only complete lines are saved, a line still being written is read again by the next run,
+        unless this is the final run of the instance
         :return:
         """
         self.logger.debug("{instance}: Saving logs into disk".format(instance=self.instance_id))
@@ -201,77 +390,230 @@ class TailEC2Instance(object):
 
             file_name = format_aws_file(os.path.basename(response['file']), self.instance_id)
             file = response['file']
-            old_nb_lines = self.instance_dict[file]['nb_lines'] if 'nb_lines' in self.instance_dict[file] else 0
+            checkpoint = self.instance_dict[file]
             output = response['output']
-            output = output[old_nb_lines:len(output)]
             error = response['error']
 
-            difference = len(output)
-            self.instance_dict[file]['nb_lines'] = old_nb_lines + difference
-
             if len(error) > 0:
                 self.logger.error("{instance}: Errors in response during SSH, {error}".format(instance=self.instance_id, error=error))
+            if response['identity'] is None: continue
+
+            start = response['start']
+            if checkpoint.offset is None and checkpoint.nb_lines is not None:
+                # Checkpoints of previous versions count lines instead of bytes
+                start = skip_lines(output, checkpoint.nb_lines, start)
+            end = len(output) if self.final else max(output.rfind(b'\n', start) + 1, start)
+            difference = output.count(b'\n', start, end)
+            if end > start and output[end - 1:end] != b'\n':
+                difference += 1
+
+            try:
+                saved = difference > 0 and self.save_logs(file_name, output if end == len(output) else output[:end], start, file)
+            except Exception as e:
+                # The checkpoint only moves once the logs are saved, they are read again by the next run
+                self.logger.error("{instance}: logs of {file} not saved, {error}".format(instance=self.instance_id, file=file, error=str(e)))
+                continue
+            old_nb_lines = checkpoint.nb_lines if checkpoint.nb_lines is not None and response['previous'] is None else 0
+            checkpoint.nb_lines = old_nb_lines + difference
+            update_checkpoint(checkpoint, response['identity'], response['offset'] + end - response['start'])
             if difference == 0: continue
 
-            with open(file_name, 'w') as log_file:
-                for log in output:
-                    formatted_log = "[{eb_env}] - {log}".format(eb_env=self.eb_environment_id, log=log)
-                    log_file.write(formatted_log)
-                files.append(file_name)
-                self.logger.debug("{instance}: {nb} new logs saved for {file}".format(instance=self.instance_id, nb=difference, file=file_name))
+            self.stats['lines'] += difference
+            if not saved: continue
+
+            files.append(file_name)
+            self.stats['files'] += 1
+            self.logger.debug("{instance}: {nb} new logs saved for {file}".format(instance=self.instance_id, nb=difference, file=file_name))
         return files
 
-    def send_log_files(self, files):
+    def save_logs(self, file_name, data, start, filename):
         """
-        Sends logs from the saved files to a third-party platform through an endpoint
-        :param files:
-        :return:
+        Saves the new logs of one file, found from the given offset of its raw logs
+        Raw logs are only decoded into lines for the stages working on text: rollups, sampling and parsing
+        :param file_name: local file
+        :param data: raw logs
+        :param start: offset of the first new line
+        :param filename: remote log file the logs come from
+        :return: True if a file has been saved, False if nothing is left to ship
         """
-        self.logger.debug("{instance}: send logs to a third-party platform".format(instance=self.instance_id))
-        for file_name in files:
-            self.logger.debug("{instance}: using {api_endpoint} endpoint to perform curl".format(instance=self.instance_id, api_endpoint=self.api_endpoint))
-            self.logger.debug("{instance}: post log file {file_name}".format(instance=self.instance_id, file_name=file_name))
-            curl_post_data(self.api_endpoint, file_name, self.logger)
+        if not self.needs_lines(filename):
+            self.write_raw_logs(file_name, data, start)
+            self.file_sources[file_name] = filename
+            return True
+
+        logs = decode_lines(data, start)
+        if self.aggregate_logs(logs, filename): return False
+        logs = self.sample_logs(logs, filename)
+        if len(logs) == 0: return False
 
-    def clear_log_files(self, files):
+        self.write_logs(file_name, logs, filename)
+        self.file_sources[file_name] = filename
+        return True
+
+    def needs_lines(self, filename):
+        """
+        Whether or not the logs of the file are aggregated, sampled or parsed
+        :param filename:
+        :return:
+        """
+        if self.sampling_policies.get(filename) is not None:
+            return True
+        log_format = self.log_formats.get(filename)
+        if log_format is None:
+            return False
+        return self.output != 'raw' or (self.rollup is not None and log_format.name == 'combined')
+
+    def aggregate_logs(self, logs, filename):
+        """
+        Adds new access logs to the rollup of the EB environment
+        :param logs:
+        :param filename: remote log file the logs come from
+        :return: True if the logs are only aggregated and not shipped
+        """
+        log_format = self.log_formats.get(filename)
+        if self.rollup is None or log_format is None or log_format.name != 'combined':
+            return False
+        nb_requests = self.rollup.add_lines(logs, log_format)
+        self.logger.debug("{instance}: {nb} requests of {file} aggregated".format(instance=self.instance_id,
+                                                                                  nb=nb_requests, file=filename))
+        return filename not in self.raw_files
+
+    def sample_logs(self, logs, filename):
+        """
+        Applies the sampling policy of the file, if any, and counts the lines sampled out
+        :param logs:
+        :param filename: remote log file the logs come from
+        :return: logs to ship
+        """
+        policy = self.sampling_policies.get(filename)
+        if policy is None:
+            return logs
+        if filename not in self.sampling_counts:
+            self.sampling_counts[filename] = policy.new_counts()
+        return policy.sample(logs, self.sampling_counts[filename])
+
+    def save_sampling_counts(self):
+        """
+        Saves the exact counts of the sampled files, shipped with their logs so that totals can be rebuilt downstream
+        :return: list of the saved file, empty if no file is sampled
         """
-        Clears the previously saved log files (the regular and the rotated ones)
+        if len(self.sampling_counts) == 0:
+            return []
+
+        file_name = format_aws_file('sampling.json', self.instance_id)
+        with open(file_name, 'w') as counts_file:
+            for filename, counts in self.sampling_counts.items():
+                record = {'eb_env': self.eb_environment_id, 'instance': self.instance_id, 'file': filename}
+                record.update(counts)
+                counts_file.write(json.dumps(record) + '\n')
+                self.logger.debug("{instance}: {nb} of {total} logs sampled out for {file}".format(
+                    instance=self.instance_id, nb=counts['sampled_out'], total=counts['lines'], file=filename))
+        return [file_name]
+
+    def write_raw_logs(self, file_name, data, start):
+        """
+        Writes raw logs prefixed with the EB environment, a large block of lines at a time
+        Large logs are framed by the offload pool when enabled
+        :param file_name: local file
+        :param data: raw logs
+        :param start: offset of the first line
+        :return:
+        """
+        offload_pool = get_offload_pool()
+        with open(file_name, 'wb') as log_file:
+            if offload_pool is not None and len(data) - start >= MIN_OFFLOAD_SIZE:
+                self.stats['bytes'] += offload_pool.write_framed(log_file, data, start, self.prefix_bytes)
+                return
+            for buffers in frame_blocks(data, self.prefix_bytes, start):
+                log_file.writelines(buffers)
+                self.stats['bytes'] += sum(len(buffer) for buffer in buffers)
+
+    def write_logs(self, file_name, logs, filename):
+        """
+        Writes new log lines of one file, prefixed with the EB environment or parsed into structured records
+        :param file_name: local file
+        :param logs: lines
+        :param filename: remote log file the logs come from
+        :return:
+        """
+        with open(file_name, 'w') as log_file:
+            log_format = self.log_formats.get(filename)
+            if log_format is not None and self.output != 'raw':
+                tags = {'eb_env': self.eb_environment_id, 'instance': self.instance_id}
+                self.stats['bytes'] += write_records(log_file, logs, log_format, self.output, tags)
+                return
+
+            formatted_logs = self.prefix + self.prefix.join(logs)
+            log_file.write(formatted_logs)
+            self.stats['bytes'] += len(formatted_logs)
+
+    @profiled_stage('TailEC2Instance.send_log_files')
+    def ship_log_files(self, files):
+        """
+        Hands the saved log files over to the sinks (endpoints, local archives) without waiting for them,
+        files are cleared once every sink is done with them unless kept
         :param files:
         :return:
         """
-        if len(files) > 0:
+        if len(self.sinks) > 0:
+            self.logger.debug("{instance}: {nb} log files handed over to {sinks}".format(
+                instance=self.instance_id, nb=len(files), sinks=', '.join(sink.name for sink in self.sinks)))
+        elif not self.keep_files:
             self.logger.info("{instance}: Clearing saved logs".format(instance=self.instance_id))
-        else:
-            self.logger.info("{instance}: Nothing to clear".format(instance=self.instance_id))
-
-        for file_name in files:
-            os.remove(file_name)
-            self.logger.info("{instance}: {file} removed from local disk".format(instance=self.instance_id, file=file_name))
+        ship_files(files, self.sinks, self.keep_files)
 
     def ssh_exec_command(self, cmd, filename, queue):
         """
-        Executes command for a specific log file with its own SSH client
+        Executes command for a specific log file on its own channel of a pooled SSH connection
         :param cmd:
         :param filename:
         :param queue:
         :return:
         """
-        ssh_cli = paramiko.SSHClient()
-        ssh_cli.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        ssh_cli.load_system_host_keys()
+        from paramiko.ssh_exception import SSHException
+
+        ssh_pool = get_ssh_pool()
+        ssh_cli = None
+        broken = False
         try:
-            ssh_cli.connect(hostname=self.host, username=self.user, key_filename=self.key_pem_path)
-            stdin, stdout, stderr = ssh_cli.exec_command(cmd)
-            self.logger.debug("{instance}: Executing {cmd} through SSH".format(instance=self.instance_id, cmd=cmd))
-            out = stdout.readlines()
-            err = stderr.readlines()
+            with self.throttle.channel():
+                ssh_cli = ssh_pool.acquire(self.host, self.ssh_port, self.user, self.key_pem_path)
+                stdin, stdout, stderr = ssh_cli.exec_command(cmd)
+                self.logger.debug("{instance}: Executing {cmd} through SSH".format(instance=self.instance_id, cmd=cmd))
+                # Raw bytes, lines are framed by blocks when saving instead of being decoded one by one
+                out = self.read_output(stdout)
+                err = stderr.readlines()
             queue.put({"file": filename, "output": out, "error": err})
         except SSHException as e:
+            broken = True
             self.logger.error("{instance}: ssh exception says {error} ".format(instance=self.instance_id, error=str(e)))
         except FileNotFoundError:
             self.logger.error("{instance}: {key_pem} pem file not found".format(instance=self.instance_id, key_pem=self.key_pem_path))
         except Exception as e:
+            broken = True
             self.logger.error("{instance}: ssh_exec_command - {type}".format(instance=self.instance_id, type=type(e)))
             self.logger.error("{instance}: ssh_exec_command - {error} ".format(instance=self.instance_id, error=str(e)))
         finally:
-            ssh_cli.close()
+            if ssh_cli is not None:
+                ssh_pool.release(ssh_cli, broken)
+
+    def read_output(self, stdout, chunk_size=65536):
+        """
+        Reads the whole output of a command, within the bandwidth of the host when capped
+        A slow reader also slows down the remote command through the SSH flow control
+        :param stdout:
+        :param chunk_size:
+        :return: raw bytes
+        """
+        bucket = self.throttle.bucket
+        if bucket is None:
+            return stdout.read()
+
+        chunks = []
+        while True:
+            chunk = stdout.read(chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            bucket.consume(len(chunk))
+        return b''.join(chunks)
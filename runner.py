@@ -1,3 +1,10 @@
+import time
+
+# Measures the startup of the tool, from the process start until the first cycle
+started_at = time.perf_counter()
+
+import argparse
+import json
 import logging
 import os
 import sys
@@ -7,25 +14,70 @@ import yaml
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger('AWS_EB_Log_Retrieval')
 
-from classes.aws_eb_log_retrieval_service import EBLogRetrievalService
+MODES = ('run', 'once', 'backfill')
+
+
+def parse_arguments(argv):
+    """
+    Parses the command line, 'python3 -m runner config.yml' is kept as a shortcut for the 'run' mode
+    :param argv:
+    :return:
+    """
+    if len(argv) > 0 and argv[0] not in MODES and not argv[0].startswith('-'):
+        argv = ['run'] + argv
+
+    parser = argparse.ArgumentParser(prog='python3 -m runner')
+    subparsers = parser.add_subparsers(dest='mode')
+    subparsers.add_parser('run', help='constantly running process').add_argument('config')
+    subparsers.add_parser('once', help='tails every environment once, then exits').add_argument('config')
+    backfill = subparsers.add_parser('backfill', help='ships every rotated archive, then exits')
+    backfill.add_argument('config')
+    backfill.add_argument('--max-bandwidth-kbps', type=int, default=None,
+                          help='bandwidth cap shared by every archive transfer')
+    backfill.add_argument('--concurrency', type=int, default=4, help='number of hosts backfilled at once')
+    args = parser.parse_args(argv)
+    if args.mode is None:
+        raise IndexError
+    return args
+
 
 if __name__ == "__main__":
     try:
-        yaml_config_file_path = sys.argv[1]
+        args = parse_arguments(sys.argv[1:])
+        yaml_config_file_path = args.config
         config_dir_name = os.path.dirname(yaml_config_file_path)
         logger.info('Relative directory name is {dir_name}'.format(dir_name=config_dir_name))
 
         try:
             with open(yaml_config_file_path, 'r') as yml_file:
-                config_dict = yaml.load(yml_file)
+                config_dict = yaml.safe_load(yml_file)
             assert isinstance(config_dict, dict)
 
             logger.debug(config_dict)
-            EBLogRetrievalService(config=config_dict, config_relative_dir_name=config_dir_name,
-                                  logger=logger).start_eb_log_retrieval_process()
+
+            # Heavy dependencies (boto3, paramiko, ...) are only imported once the config has been parsed
+            if args.mode == 'run' and config_dict.get('workers', 1) > 1:
+                from classes.eb_log_retrieval_supervisor import EBLogRetrievalSupervisor
+                EBLogRetrievalSupervisor(config=config_dict, config_relative_dir_name=config_dir_name,
+                                         logger=logger, config_file_path=yaml_config_file_path).start()
+            else:
+                from classes.aws_eb_log_retrieval_service import EBLogRetrievalService
+                service = EBLogRetrievalService(config=config_dict, config_relative_dir_name=config_dir_name,
+                                                logger=logger, config_file_path=yaml_config_file_path,
+                                                started_at=started_at)
+                if args.mode == 'run':
+                    service.start_eb_log_retrieval_process()
+                else:
+                    if args.mode == 'once':
+                        summary = service.start_one_shot_process()
+                    else:
+                        summary = service.start_backfill_process(args.max_bandwidth_kbps, args.concurrency)
+                    if summary is None:
+                        sys.exit(1)
+                    print(json.dumps(summary, indent=4, sort_keys=True))
         except AssertionError:
-            logger.error("{filename}: configuration file content should be a dict".format(filename=path))
+            logger.error("{filename}: configuration file content should be a dict".format(filename=yaml_config_file_path))
         except FileNotFoundError:
-            logger.error("Configuration file {filename} does not exist".format(filename=path))
+            logger.error("Configuration file {filename} does not exist".format(filename=yaml_config_file_path))
     except IndexError:
-        logger.debug("Usage is: python3 -m runner path/to/config/file.yml")
\ No newline at end of file
+        logger.debug("Usage is: python3 -m runner [run|once|backfill] path/to/config/file.yml")
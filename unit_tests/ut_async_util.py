@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+from util.async_util import AsyncEngine
+from util.throttle_util import HostThrottle
+
+
+class AsyncUtilUT(object):
+
+    def __init__(self):
+        self.engine = AsyncEngine(max_channels=4, max_aws_calls=1)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def blocking_call(self, value):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.02)
+        with self.lock:
+            self.running -= 1
+        return value * 2
+
+    def run_limited(self, limit, nb_calls):
+        self.max_running = 0
+        return self.engine.run(self.engine.gather(self.engine.blocking(limit, self.blocking_call, value)
+                                                  for value in range(nb_calls)))
+
+    def test_limits(self):
+        for limit, max_running in (('channels', 4), ('aws', 1)):
+            assert self.run_limited(limit, 12) == [value * 2 for value in range(12)]
+            assert self.max_running == max_running
+            logger.info("{limit}: at most {nb} concurrent calls".format(limit=limit, nb=self.max_running))
+
+    def test_unlimited(self):
+        self.run_limited(None, 12)
+        assert self.max_running > 4
+
+    def test_host_channels(self):
+        throttles = {'busy-host': HostThrottle(max_channels=1), 'other-host': HostThrottle(max_channels=1)}
+        running = {host: 0 for host in throttles}
+        max_running = {host: 0 for host in throttles}
+        completed = []
+
+        def channel_call(host):
+            with throttles[host].channel():
+                with self.lock:
+                    running[host] += 1
+                    max_running[host] = max(max_running[host], running[host])
+                time.sleep(0.05)
+                with self.lock:
+                    running[host] -= 1
+                    completed.append(host)
+
+        async def on_channel(host):
+            async with throttles[host].async_channel():
+                return await self.engine.blocking('channels', channel_call, host)
+
+        hosts = ['busy-host'] * 6 + ['other-host'] * 2
+        self.engine.run(self.engine.gather(on_channel(host) for host in hosts))
+        assert max_running == {'busy-host': 1, 'other-host': 1}
+        # Calls waiting for the busy host do not hold the slots of the engine, the other host is not delayed by them
+        assert completed.index('other-host') < 2 and completed[:4].count('other-host') == 2
+        logger.info("Completion order: {hosts}".format(hosts=completed))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_async_util')
+
+    test_async_util = AsyncUtilUT()
+
+    logger.info("###### TEST LIMITS #####")
+    test_async_util.test_limits()
+
+    logger.info("###### TEST UNLIMITED #####")
+    test_async_util.test_unlimited()
+
+    logger.info("###### TEST HOST CHANNELS #####")
+    test_async_util.test_host_channels()
+
+    test_async_util.engine.close()
@@ -0,0 +1,77 @@
+import json
+import logging
+
+from util.checkpoint_util import FileCheckpoint, EnvironmentState, load_state, dump_state
+
+
+class CheckpointUtilUT(object):
+
+    def __init__(self):
+        self.backup = {
+            'your_eb_env_name': {
+                'i-0123456789': {
+                    '/var/log/httpd/access_log': {'offset': 4096, 'inode': 42, 'head': 'd41d8cd98f00b204e9800998ecf8427e',
+                                                  'head_length': 512, 'nb_lines': 30,
+                                                  'deferred': {'offset': 1024, 'inode': 41, 'head': 'a' * 32,
+                                                               'head_length': 512, 'nb_lines': 8}},
+                    '/var/log/httpd/error_log': {'nb_lines': 12}
+                },
+                'i-9876543210': {},
+                'last_time_updated': '2017-10-10 13:55:36'
+            }
+        }
+
+    def test_round_trip(self):
+        state = load_state(json.loads(json.dumps(self.backup)))
+        environment = state['your_eb_env_name']
+        checkpoint = environment.instances['i-0123456789']['/var/log/httpd/access_log']
+        assert isinstance(checkpoint, FileCheckpoint) and checkpoint.offset == 4096 and checkpoint.deferred.inode == 41
+        assert environment.last_time_updated == '2017-10-10 13:55:36'
+        assert dump_state(state) == self.backup
+        logger.info(json.dumps(dump_state(state), sort_keys=True))
+
+    def test_legacy_checkpoint(self):
+        # Checkpoints of previous versions only count lines
+        checkpoint = load_state(self.backup)['your_eb_env_name'].instances['i-0123456789']['/var/log/httpd/error_log']
+        assert checkpoint.nb_lines == 12 and checkpoint.offset is None and checkpoint.inode is None
+        assert checkpoint.to_dict() == {'nb_lines': 12}
+
+    def test_interned_paths(self):
+        environments = [load_state(json.loads(json.dumps(self.backup)))['your_eb_env_name'] for _ in range(2)]
+        paths = [next(iter(environment.instances['i-0123456789'])) for environment in environments]
+        assert paths[0] is paths[1]
+
+    def test_prune(self):
+        environment = load_state(self.backup)['your_eb_env_name']
+        environment.instance('i-new')
+        environment.prune({'i-0123456789', 'i-new'})
+        assert sorted(environment.instances) == ['i-0123456789', 'i-new']
+
+    def test_copy(self):
+        checkpoint = load_state(self.backup)['your_eb_env_name'].instances['i-0123456789']['/var/log/httpd/access_log']
+        previous = checkpoint.copy()
+        checkpoint.offset = 0
+        assert previous.offset == 4096 and previous.deferred is None
+        assert EnvironmentState().to_dict() == {}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_checkpoint_util')
+
+    test_checkpoint_util = CheckpointUtilUT()
+
+    logger.info("###### TEST ROUND TRIP #####")
+    test_checkpoint_util.test_round_trip()
+
+    logger.info("###### TEST LEGACY CHECKPOINT #####")
+    test_checkpoint_util.test_legacy_checkpoint()
+
+    logger.info("###### TEST INTERNED PATHS #####")
+    test_checkpoint_util.test_interned_paths()
+
+    logger.info("###### TEST PRUNE #####")
+    test_checkpoint_util.test_prune()
+
+    logger.info("###### TEST COPY #####")
+    test_checkpoint_util.test_copy()
@@ -0,0 +1,85 @@
+import logging
+import os
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from util.curl_util import curl_post_chunks, acknowledgements_file, remove_acknowledgements
+
+
+class FlakyEndpoint(ThreadingHTTPServer):
+    """
+    Local endpoint keeping the bodies it accepts, and failing the requests whose number is in failures
+    """
+    daemon_threads = True
+
+    def __init__(self, failures):
+        super(FlakyEndpoint, self).__init__(('127.0.0.1', 0), _FlakyRequestHandler)
+        self.failures = failures
+        self.nb_requests = 0
+        self.bodies = []
+
+
+class _FlakyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.nb_requests += 1
+        if self.server.nb_requests in self.server.failures:
+            self.send_response(503)
+        else:
+            self.server.bodies.append(body)
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CurlUtilUT(object):
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.dir, 'i-1_20171010_access_log')
+        with open(self.file_name, 'wb') as log_file:
+            for i in range(20000):
+                log_file.write(b'[env] - 10.0.0.1 - - "GET /items/' + str(i).encode() + b' HTTP/1.1" 200 512\n')
+
+    def test_resume_after_failure(self):
+        # The third chunk fails once
+        endpoint = FlakyEndpoint(failures={3})
+        threading.Thread(target=endpoint.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{port}/'.format(port=endpoint.server_address[1])
+
+        assert not curl_post_chunks(url, self.file_name, logger, chunk_size=64 * 1024)
+        assert os.path.exists(acknowledgements_file(self.file_name, url))
+        assert curl_post_chunks(url, self.file_name, logger, chunk_size=64 * 1024)
+
+        with open(self.file_name, 'rb') as log_file:
+            data = log_file.read()
+        # Every byte accepted once, each chunk made of whole lines
+        assert b''.join(endpoint.bodies) == data
+        assert all(body.endswith(b'\n') for body in endpoint.bodies)
+        logger.info("{size} bytes uploaded in {nb} chunks".format(size=len(data), nb=len(endpoint.bodies)))
+
+        # Acknowledged files are not sent again
+        nb_requests = endpoint.nb_requests
+        assert curl_post_chunks(url, self.file_name, logger, chunk_size=64 * 1024)
+        assert endpoint.nb_requests == nb_requests
+
+        remove_acknowledgements(self.file_name)
+        assert not os.path.exists(acknowledgements_file(self.file_name, url))
+        endpoint.shutdown()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_curl_util')
+
+    test_curl_util = CurlUtilUT()
+
+    logger.info("###### TEST RESUME AFTER FAILURE #####")
+    test_curl_util.test_resume_after_failure()
@@ -0,0 +1,42 @@
+import io
+import logging
+
+from util.framing_util import count_lines, skip_lines, frame_blocks, decode_lines
+
+
+class FramingUtilUT(object):
+
+    def __init__(self):
+        self.prefix = "[your_eb_env_name] - "
+        self.data = b'first line\n\nthird line \xc3\xa9\r\nlast line without newline'
+        self.lines = [line.decode('utf-8') for line in io.BytesIO(self.data).readlines()]
+
+    def test_same_lines_as_readlines(self):
+        assert count_lines(self.data) == len(self.lines) == 4
+        assert count_lines(b'') == 0 and count_lines(b'\n') == 1
+        for nb_lines in range(6):
+            assert decode_lines(self.data, skip_lines(self.data, nb_lines)) == self.lines[nb_lines:]
+
+    def test_frame_blocks(self):
+        for nb_lines in range(5):
+            expected = ''.join(self.prefix + line for line in self.lines[nb_lines:]).encode('utf-8')
+            # Tiny blocks make every line a block of its own
+            for block_size in (1, 16, 1024):
+                buffers = [buffer for block in frame_blocks(self.data, self.prefix.encode('utf-8'),
+                                                            skip_lines(self.data, nb_lines), block_size)
+                           for buffer in block]
+                assert b''.join(buffers) == expected
+        logger.info(expected)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_framing_util')
+
+    test_framing_util = FramingUtilUT()
+
+    logger.info("###### TEST SAME LINES AS READLINES #####")
+    test_framing_util.test_same_lines_as_readlines()
+
+    logger.info("###### TEST FRAME BLOCKS #####")
+    test_framing_util.test_frame_blocks()
@@ -0,0 +1,69 @@
+import logging
+
+from util.hash_ring import ConsistentHashRing
+
+
+class HashRingUT(object):
+
+    def __init__(self):
+        self.keys = ['eb-env-{i}'.format(i=i) for i in range(1000)]
+
+    def test_partitioning(self):
+        ring = ConsistentHashRing(['worker-0', 'worker-1', 'worker-2'])
+        owners = {key: ring.get_node(key) for key in self.keys}
+        counts = {node: list(owners.values()).count(node) for node in ('worker-0', 'worker-1', 'worker-2')}
+        # Every node gets a share of the keys, and the same key always maps to the same node
+        assert sum(counts.values()) == len(self.keys)
+        assert min(counts.values()) > len(self.keys) / 6
+        assert all(ConsistentHashRing(['worker-2', 'worker-0', 'worker-1']).get_node(key) == node
+                   for key, node in owners.items())
+        logger.info("Keys per node: {counts}".format(counts=counts))
+
+    def test_add_node(self):
+        ring = ConsistentHashRing(['worker-0', 'worker-1', 'worker-2'])
+        before = {key: ring.get_node(key) for key in self.keys}
+        ring.add_node('worker-3')
+        moved = [key for key in self.keys if ring.get_node(key) != before[key]]
+        # Only keys taken over by the new node move
+        assert len(moved) > 0
+        assert all(ring.get_node(key) == 'worker-3' for key in moved)
+        assert len(moved) < len(self.keys) / 2
+
+    def test_remove_node(self):
+        ring = ConsistentHashRing(['worker-0', 'worker-1', 'worker-2'])
+        before = {key: ring.get_node(key) for key in self.keys}
+        ring.remove_node('worker-1')
+        assert len(ring.hashes) == 2 * ring.replicas
+        for key in self.keys:
+            if before[key] != 'worker-1':
+                assert ring.get_node(key) == before[key]
+            else:
+                assert ring.get_node(key) in ('worker-0', 'worker-2')
+        # Removing an unknown node changes nothing
+        ring.remove_node('worker-9')
+        assert len(ring.hashes) == 2 * ring.replicas
+
+    def test_empty_ring(self):
+        ring = ConsistentHashRing()
+        assert ring.get_node('eb-env-0') is None
+        ring.add_node('worker-0')
+        assert ring.get_node('eb-env-0') == 'worker-0'
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_hash_ring')
+
+    test_hash_ring = HashRingUT()
+
+    logger.info("###### TEST PARTITIONING #####")
+    test_hash_ring.test_partitioning()
+
+    logger.info("###### TEST ADD NODE #####")
+    test_hash_ring.test_add_node()
+
+    logger.info("###### TEST REMOVE NODE #####")
+    test_hash_ring.test_remove_node()
+
+    logger.info("###### TEST EMPTY RING #####")
+    test_hash_ring.test_empty_ring()
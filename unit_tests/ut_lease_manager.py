@@ -0,0 +1,88 @@
+import logging
+import os
+import tempfile
+import time
+
+from classes.lease_manager import LeaseManager
+
+
+class LeaseManagerUT(object):
+
+    def __init__(self):
+        self.environments = ["your_eb_env_name_{i}".format(i=i) for i in range(4)]
+        self.path = os.path.join(tempfile.mkdtemp(), 'aws_eb_log_retrieval_leases.db')
+
+    def node(self, node_id, ttl=600):
+        return LeaseManager({'node_id': node_id, 'path': self.path, 'lease_ttl_in_seconds': ttl}, logger)
+
+    def test_nodes_share_environments(self):
+        node_1 = self.node('collector-1')
+        node_2 = self.node('collector-2')
+
+        node_1.claim_environments(self.environments)
+        assert len(node_1.owned) == 4
+
+        # The second node joins, the first one hands over half of its environments on its next cycle
+        node_2.claim_environments(self.environments)
+        node_1.claim_environments(self.environments)
+        node_2.claim_environments(self.environments)
+        assert len(node_1.owned) == 2 and len(node_2.owned) == 2
+        assert node_1.owned.isdisjoint(node_2.owned)
+        logger.info("collector-1 owns {envs}".format(envs=sorted(node_1.owned)))
+        logger.info("collector-2 owns {envs}".format(envs=sorted(node_2.owned)))
+
+    def test_takeover_from_last_checkpoint(self):
+        node_1 = self.node('collector-3', ttl=1)
+        node_1.claim_environments(self.environments[:1])
+        checkpoint = {'i-0123456789': {'/var/log/httpd/access_log': {'nb_lines': 42}}}
+        assert node_1.commit(self.environments[0], checkpoint)
+
+        # The first node stops renewing its leases
+        time.sleep(1.5)
+        node_2 = self.node('collector-4', ttl=1)
+        acquired = node_2.claim_environments(self.environments[:1])
+        assert acquired[self.environments[0]] == checkpoint
+
+        # The dead node cannot commit anymore
+        assert not node_1.commit(self.environments[0], {})
+        logger.info("{env} taken over with its checkpoint".format(env=self.environments[0]))
+
+    def test_reloaded_environments(self):
+        node_1 = self.node('collector-5')
+        node_2 = self.node('collector-6')
+        node_1.claim_environments(self.environments)
+        node_2.claim_environments(self.environments)
+        node_1.claim_environments(self.environments)
+        node_2.claim_environments(self.environments)
+        assert len(node_1.owned) == 2 and len(node_2.owned) == 2
+
+        # The configuration file is re-loaded without the environments of the first node, and with two new ones
+        removed = sorted(node_1.owned)
+        environments = [env for env in self.environments if env not in removed] + \
+                       ["your_new_eb_env_name_{i}".format(i=i) for i in range(2)]
+        node_1.claim_environments(environments)
+        node_2.claim_environments(environments)
+        # Leases of the removed environments are released, they no longer count toward the fair share
+        assert node_1.owned.isdisjoint(removed)
+        assert set(node_1.backend.owned_by('collector-5')).isdisjoint(removed)
+        assert len(node_1.owned) == 2 and len(node_2.owned) == 2
+        assert node_1.owned | node_2.owned == set(environments)
+        logger.info("collector-5 owns {envs} after the reload".format(envs=sorted(node_1.owned)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_lease_manager')
+
+    test_lease_manager = LeaseManagerUT()
+
+    logger.info("###### TEST NODES SHARE ENVIRONMENTS #####")
+    test_lease_manager.test_nodes_share_environments()
+
+    test_lease_manager = LeaseManagerUT()
+    logger.info("###### TEST TAKEOVER FROM LAST CHECKPOINT #####")
+    test_lease_manager.test_takeover_from_last_checkpoint()
+
+    test_lease_manager = LeaseManagerUT()
+    logger.info("###### TEST RELOADED ENVIRONMENTS #####")
+    test_lease_manager.test_reloaded_environments()
@@ -0,0 +1,93 @@
+import logging
+import os
+import tempfile
+
+from util.merge_util import merge_log_files, parse_log_timestamp
+
+
+class MergeUtilUT(object):
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = "[your_eb_env_name] - "
+
+    def write(self, file_name, lines):
+        path = os.path.join(self.dir, file_name)
+        with open(path, 'w') as log_file:
+            for line in lines:
+                log_file.write(self.prefix + line + "\n")
+        return path
+
+    def test_parse_timestamps(self):
+        access_log = '10.0.0.1 - - [10/Oct/2017:13:55:36 +0200] "GET / HTTP/1.1" 200 512'
+        catalina = '10-Oct-2017 11:55:36.250 INFO [main] org.apache.catalina.startup.Catalina.start'
+        catalina_7 = 'Oct 10, 2017 11:55:36 AM org.apache.catalina.startup.Catalina start'
+        access_log, catalina, catalina_7 = [log.encode('utf-8') for log in (access_log, catalina, catalina_7)]
+        assert parse_log_timestamp(access_log) == parse_log_timestamp(catalina_7) == 1507636536
+        assert parse_log_timestamp(catalina) == 1507636536.25
+        assert parse_log_timestamp(self.prefix.encode('utf-8') + access_log, len(self.prefix)) == 1507636536
+        assert parse_log_timestamp(b'\tat java.lang.Thread.run(Thread.java:745)') is None
+
+    def test_merge_instances(self):
+        instance_1 = self.write('i-1_access_log', [
+            '10.0.0.1 - - [10/Oct/2017:13:55:30 +0000] "GET /a HTTP/1.1" 200 512',
+            '10.0.0.1 - - [10/Oct/2017:13:55:34 +0000] "GET /c HTTP/1.1" 200 512',
+            # A slow request logged late, within the reorder window
+            '10.0.0.1 - - [10/Oct/2017:13:55:32 +0000] "GET /b HTTP/1.1" 200 512',
+        ])
+        instance_2 = self.write('i-2_catalina.out', [
+            '10-Oct-2017 13:55:31.000 SEVERE [http-nio-8080-exec-1] Exception',
+            'java.lang.NullPointerException',
+            '\tat com.example.Service.run(Service.java:42)',
+            '10-Oct-2017 13:55:33.000 INFO [main] Started',
+        ])
+        merged = os.path.join(self.dir, 'merged.log')
+        assert merge_log_files([instance_1, instance_2], merged, 5, len(self.prefix)) == 7
+
+        with open(merged) as merged_file:
+            lines = [line[len(self.prefix):].rstrip("\n") for line in merged_file]
+        for line in lines:
+            logger.info(line)
+        assert '/a' in lines[0] and 'SEVERE' in lines[1]
+        assert lines[2] == 'java.lang.NullPointerException' and lines[3].startswith('\tat')
+        assert '/b' in lines[4] and 'Started' in lines[5] and '/c' in lines[6]
+
+    def test_merge_sources(self):
+        instance_1 = self.write('i-1_access_log', [
+            '10.0.0.1 - - [10/Oct/2017:13:55:30 +0000] "GET /a HTTP/1.1" 200 512',
+            '10.0.0.1 - - [10/Oct/2017:13:55:32 +0000] "GET /c HTTP/1.1" 200 512',
+        ])
+        instance_2 = os.path.join(self.dir, 'i-2_catalina.out')
+        with open(instance_2, 'wb') as log_file:
+            # Not UTF-8, e.g. a Latin-1 message, with a carriage return which does not end the line
+            log_file.write(self.prefix.encode('utf-8') + b'10-Oct-2017 13:55:31.000 INFO [main] caf\xe9\rdone\n')
+        merged = os.path.join(self.dir, 'merged_sources.log')
+        sources = ['[i-1 /var/log/httpd/access_log] ', '[i-2 /var/log/tomcat8/catalina.out] ']
+        assert merge_log_files([instance_1, instance_2], merged, 5, len(self.prefix), sources) == 3
+
+        with open(merged, 'rb') as merged_file:
+            lines = merged_file.read().split(b'\n')
+        for line in lines:
+            logger.info(line)
+        assert lines[0].startswith(self.prefix.encode('utf-8') + b'[i-1 /var/log/httpd/access_log] 10.0.0.1')
+        assert b'/a' in lines[0]
+        # Lines are merged byte for byte
+        assert lines[1] == self.prefix.encode('utf-8') + \
+            b'[i-2 /var/log/tomcat8/catalina.out] 10-Oct-2017 13:55:31.000 INFO [main] caf\xe9\rdone'
+        assert b'/c' in lines[2] and lines[3] == b''
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_merge_util')
+
+    test_merge_util = MergeUtilUT()
+
+    logger.info("###### TEST PARSE TIMESTAMPS #####")
+    test_merge_util.test_parse_timestamps()
+
+    logger.info("###### TEST MERGE INSTANCES #####")
+    test_merge_util.test_merge_instances()
+
+    logger.info("###### TEST MERGE SOURCES #####")
+    test_merge_util.test_merge_sources()
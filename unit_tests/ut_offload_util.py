@@ -0,0 +1,51 @@
+import gzip
+import io
+import logging
+import os
+import tempfile
+
+from util.framing_util import frame_blocks
+from util.offload_util import OffloadPool
+
+
+class OffloadUtilUT(object):
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = b"[your_eb_env_name] - "
+        self.data = b''.join(b'10.0.0.1 - - [10/Oct/2017:13:55:36 +0000] "GET /items/' + str(i).encode() + b' HTTP/1.1" 200 512\n'
+                             for i in range(20000)) + b'last line without newline'
+        # Small chunks to spread the framing across the workers
+        self.pool = OffloadPool(2, chunk_size=64 * 1024)
+
+    def test_write_framed(self):
+        start = self.data.find(b'\n', 1000) + 1
+        expected = b''.join(buffer for block in frame_blocks(self.data, self.prefix, start) for buffer in block)
+
+        output = io.BytesIO()
+        assert self.pool.write_framed(output, self.data, start, self.prefix) == len(expected)
+        assert output.getvalue() == expected
+        logger.info("{nb} bytes framed by the pool".format(nb=len(expected)))
+
+    def test_decompress(self):
+        archive = os.path.join(self.dir, 'access_log.gz')
+        with gzip.open(archive, 'wb') as gz:
+            gz.write(self.data)
+        self.pool.decompress(archive, os.path.join(self.dir, 'access_log'))
+        with open(os.path.join(self.dir, 'access_log'), 'rb') as log_file:
+            assert log_file.read() == self.data
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_offload_util')
+
+    test_offload_util = OffloadUtilUT()
+
+    logger.info("###### TEST WRITE FRAMED #####")
+    test_offload_util.test_write_framed()
+
+    logger.info("###### TEST DECOMPRESS #####")
+    test_offload_util.test_decompress()
+
+    test_offload_util.pool.close()
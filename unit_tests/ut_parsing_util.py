@@ -0,0 +1,57 @@
+import io
+import json
+import logging
+
+from util.parsing_util import LOG_FORMATS, parse_batches, write_records
+
+
+class ParsingUtilUT(object):
+
+    def __init__(self):
+        self.tags = {'eb_env': 'your_eb_env_name', 'instance': 'i-0123456789'}
+
+    def test_access_log_ndjson(self):
+        lines = ['10.0.0.1 - frank [10/Oct/2017:13:55:36 +0000] "GET /index.html HTTP/1.1" 200 2326 '
+                 '"http://example.com/" "Mozilla/5.0 (X11; Linux x86_64)"\n',
+                 '10.0.0.2 - - [10/Oct/2017:13:55:37 +0000] "POST /api HTTP/1.1" 204 -\n',
+                 'not an access log\n']
+        output = io.StringIO()
+        write_records(output, lines, LOG_FORMATS['combined'], 'ndjson', self.tags)
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        for record in records:
+            logger.info(record)
+        assert records[0]['user'] == 'frank' and records[0]['status'] == 200 and records[0]['size'] == 2326
+        assert records[0]['agent'] == 'Mozilla/5.0 (X11; Linux x86_64)' and records[0]['instance'] == 'i-0123456789'
+        assert records[1]['method'] == 'POST' and records[1]['size'] == 0 and records[1]['referer'] is None
+        assert records[2]['message'] == 'not an access log'
+
+    def test_catalina_columnar(self):
+        lines = ['10-Oct-2017 13:55:36.123 SEVERE [http-nio-8080-exec-1] com.example.Service.run Failure\n',
+                 'java.lang.NullPointerException\n',
+                 '\tat com.example.Service.run(Service.java:42)\n',
+                 '10-Oct-2017 13:55:37.000 INFO [main] org.apache.catalina.startup.Catalina.start Started\n']
+
+        # The stack trace is not split from its entry by the batch boundary
+        batches = list(parse_batches(lines, LOG_FORMATS['catalina'], batch_size=2))
+        assert [len(batch.records) for batch in batches] == [1, 1]
+
+        output = io.StringIO()
+        write_records(output, lines, LOG_FORMATS['catalina'], 'columnar', self.tags)
+        batch = json.loads(output.getvalue())
+        logger.info(batch)
+        assert batch['count'] == 2 and batch['columns']['level'] == ['SEVERE', 'INFO']
+        assert batch['columns']['message'][0].endswith('(Service.java:42)')
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_parsing_util')
+
+    test_parsing_util = ParsingUtilUT()
+
+    logger.info("###### TEST ACCESS LOG NDJSON #####")
+    test_parsing_util.test_access_log_ndjson()
+
+    logger.info("###### TEST CATALINA COLUMNAR #####")
+    test_parsing_util.test_catalina_columnar()
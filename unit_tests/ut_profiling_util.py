@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import tempfile
+
+import util.profiling_util as profiling_util
+from util.profiling_util import start_profiling, profiling_cycle_started, profiling_cycle_completed, profiled_stage
+
+
+@profiled_stage('ProfilingUtilUT.stage')
+def stage(value):
+    return value * 2
+
+
+@profiled_stage('ProfilingUtilUT.failing_stage')
+def failing_stage():
+    raise ValueError('stage failed')
+
+
+class ProfilingUtilUT(object):
+
+    def __init__(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def test_disabled(self):
+        assert profiling_util._active_profiler is None
+        assert stage(21) == 42
+
+    def test_profiled_cycles(self):
+        start_profiling(self.output_dir, 2, False, logger)
+        for _ in range(2):
+            profiling_cycle_started()
+            assert stage(21) == 42
+            profiling_cycle_completed()
+        assert profiling_util._active_profiler is None
+
+        cycle_dirs = sorted(os.listdir(self.output_dir))
+        assert len(cycle_dirs) == 2
+        for cycle_dir in cycle_dirs:
+            files = os.listdir(os.path.join(self.output_dir, cycle_dir))
+            assert any(file_name.endswith('.prof') for file_name in files)
+            with open(os.path.join(self.output_dir, cycle_dir, 'stages.json')) as timings_file:
+                assert [timing['stage'] for timing in json.load(timings_file)] == ['ProfilingUtilUT.stage']
+        logger.info("Profiles: {dirs}".format(dirs=cycle_dirs))
+
+    def test_failed_cycle(self):
+        # A stage raising still records its timing, and the cycle still counts
+        output_dir = tempfile.mkdtemp()
+        start_profiling(output_dir, 1, False, logger)
+        profiling_cycle_started()
+        try:
+            failing_stage()
+        except ValueError:
+            pass
+        finally:
+            profiling_cycle_completed()
+        assert profiling_util._active_profiler is None
+        cycle_dir = os.path.join(output_dir, os.listdir(output_dir)[0])
+        with open(os.path.join(cycle_dir, 'stages.json')) as timings_file:
+            assert json.load(timings_file)[0]['stage'] == 'ProfilingUtilUT.failing_stage'
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_profiling_util')
+
+    test_profiling_util = ProfilingUtilUT()
+
+    logger.info("###### TEST DISABLED #####")
+    test_profiling_util.test_disabled()
+
+    logger.info("###### TEST PROFILED CYCLES #####")
+    test_profiling_util.test_profiled_cycles()
+
+    logger.info("###### TEST FAILED CYCLE #####")
+    test_profiling_util.test_failed_cycle()
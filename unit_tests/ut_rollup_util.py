@@ -0,0 +1,63 @@
+import io
+import json
+import logging
+import random
+
+from util.parsing_util import LOG_FORMATS
+from util.rollup_util import AccessLogRollup, QuantileSketch, url_template
+
+
+class RollupUtilUT(object):
+
+    def test_url_templates(self):
+        assert url_template('/api/v1/items/42?expand=true') == '/api/v1/items/{id}'
+        assert url_template('/users/0b1e7c7e-8f5a-4a8e-9a4e-2d4c1f0e9b11/orders/7') == '/users/{id}/orders/{id}'
+        assert url_template('/v2/health') == '/v2/health'
+
+    def test_sketches_merge(self):
+        rand = random.Random(0)
+        values = [rand.expovariate(1 / 200.0) for _ in range(20000)]
+        sketch_1, sketch_2 = QuantileSketch(), QuantileSketch()
+        for i, value in enumerate(values):
+            (sketch_1 if i % 2 else sketch_2).add(value)
+        sketch_1.merge(sketch_2)
+
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            logger.info("p{q}: exact {exact:.2f}, sketch {estimate:.2f}".format(q=int(q * 100), exact=exact,
+                                                                               estimate=sketch_1.quantile(q)))
+            assert abs(sketch_1.quantile(q) - exact) <= 0.02 * exact
+
+    def test_rollups_per_minute(self):
+        lines = ['10.0.0.1 - - [10/Oct/2017:13:55:{s:02d} +0000] "GET /items/{i} HTTP/1.1" {status} 512 "-" "ua" {d}\n'
+                 .format(s=s, i=s, status=500 if s % 10 == 0 else 200, d=1000 * (s + 1)) for s in range(60)]
+        lines.append('10.0.0.1 - - [10/Oct/2017:13:56:00 +0000] "GET /health HTTP/1.1" 200 2\n')
+
+        rollup = AccessLogRollup('your_eb_env_name')
+        assert rollup.add_lines(lines, LOG_FORMATS['combined']) == 61
+        output = io.StringIO()
+        assert rollup.flush(output) == 2 and rollup.nb_lines == 0
+
+        rollups = {r['url_template']: r for r in map(json.loads, output.getvalue().splitlines())}
+        logger.info(rollups['/items/{id}']['latency_ms'])
+        assert rollups['/items/{id}']['minute'] == '2017-10-10T13:55:00+00:00'
+        assert rollups['/items/{id}']['statuses'] == {'200': 54, '500': 6}
+        assert abs(rollups['/items/{id}']['latency_ms']['p50'] - 30.0) <= 0.6
+        assert rollups['/health']['count'] == 1 and rollups['/health']['latency_ms']['p50'] is None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_rollup_util')
+
+    test_rollup_util = RollupUtilUT()
+
+    logger.info("###### TEST URL TEMPLATES #####")
+    test_rollup_util.test_url_templates()
+
+    logger.info("###### TEST SKETCHES MERGE #####")
+    test_rollup_util.test_sketches_merge()
+
+    logger.info("###### TEST ROLLUPS PER MINUTE #####")
+    test_rollup_util.test_rollups_per_minute()
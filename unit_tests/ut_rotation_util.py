@@ -0,0 +1,82 @@
+import logging
+import os
+import subprocess
+import tempfile
+
+from util.checkpoint_util import FileCheckpoint
+from util.rotation_util import tail_command, parse_tail_output, has_rotated, starts_with_head, update_checkpoint
+
+
+class RotationUtilUT(object):
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.dir, 'access_log')
+        self.lines = [b'10.0.0.1 - - [10/Oct/2017:13:55:' + str(i % 60).zfill(2).encode() + b' +0000] "GET /items/'
+                      + str(i).encode() + b' HTTP/1.1" 200 512\n' for i in range(50)]
+        with open(self.log_file, 'wb') as log_file:
+            log_file.writelines(self.lines[:20])
+
+    def tail(self, offset):
+        output = subprocess.check_output(['/bin/sh', '-c', tail_command(self.log_file, offset)])
+        identity, start = parse_tail_output(output)
+        return identity, output[start:]
+
+    def test_incremental_tail(self):
+        checkpoint = FileCheckpoint()
+        identity, content = self.tail(0)
+        assert content == b''.join(self.lines[:20])
+        update_checkpoint(checkpoint, identity, len(content))
+
+        with open(self.log_file, 'ab') as log_file:
+            log_file.writelines(self.lines[20:30])
+        identity, content = self.tail(checkpoint.offset)
+        assert not has_rotated(checkpoint, identity)
+        assert content == b''.join(self.lines[20:30])
+        logger.info(checkpoint.to_dict())
+
+    def test_rotations(self):
+        checkpoint = FileCheckpoint()
+        identity, content = self.tail(0)
+        update_checkpoint(checkpoint, identity, len(content))
+        with open(self.log_file, 'rb') as log_file:
+            archive = log_file.read()
+
+        # copytruncate: same inode, the file grew again past the collected size with other lines
+        with open(self.log_file, 'wb') as log_file:
+            log_file.writelines(self.lines[20:50])
+        identity, content = self.tail(0)
+        assert identity['inode'] == checkpoint.inode and identity['size'] >= checkpoint.offset
+        assert has_rotated(checkpoint, identity)
+
+        # create: the file is replaced by a new one
+        os.rename(self.log_file, self.log_file + '.1')
+        with open(self.log_file, 'wb') as log_file:
+            log_file.writelines(self.lines[30:31])
+        identity, content = self.tail(0)
+        assert has_rotated(checkpoint, identity)
+
+        # The archive is the file previously tailed, its new lines start at the collected offset
+        assert starts_with_head(archive, checkpoint)
+        assert not starts_with_head(b''.join(self.lines[20:50]), checkpoint)
+
+    def test_missing_file(self):
+        output = subprocess.run(['/bin/sh', '-c', tail_command(os.path.join(self.dir, 'missing'), 0)],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+        assert parse_tail_output(output)[0] is None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_rotation_util')
+
+    test_rotation_util = RotationUtilUT()
+
+    logger.info("###### TEST INCREMENTAL TAIL #####")
+    test_rotation_util.test_incremental_tail()
+
+    logger.info("###### TEST ROTATIONS #####")
+    test_rotation_util.test_rotations()
+
+    logger.info("###### TEST MISSING FILE #####")
+    test_rotation_util.test_missing_file()
@@ -0,0 +1,44 @@
+import logging
+
+from util.sampling_util import SamplingPolicy
+
+
+class SamplingUtilUT(object):
+
+    def __init__(self):
+        self.lines = ['10.0.0.1 - - [10/Oct/2017:13:55:36 +0000] "GET /items/{i} HTTP/1.1" {status} 512\n'.format(
+            i=i, status=500 if i % 100 == 0 else 200) for i in range(100000)]
+
+    def test_exact_counts(self):
+        policy = SamplingPolicy.from_config({'keep_pattern': '" 5[0-9][0-9] ', 'rate': 0.05})
+        counts = policy.new_counts()
+        kept = policy.sample(self.lines, counts)
+        logger.info(counts)
+
+        assert counts['lines'] == len(self.lines) == len(kept) + counts['sampled_out']
+        assert counts['kept_by_pattern'] == 1000
+        assert all(line in kept for line in self.lines if '" 500 ' in line)
+        assert abs(counts['kept_by_sample'] - 0.05 * 99000) < 0.1 * 0.05 * 99000
+
+    def test_deterministic_sample(self):
+        policy_1 = SamplingPolicy(rate=0.1)
+        policy_2 = SamplingPolicy(rate=0.1)
+        # Every collector keeps the same lines, whatever the batches they are sampled in
+        kept_1 = policy_1.sample(self.lines, policy_1.new_counts())
+        kept_2 = policy_2.sample(self.lines[:500], policy_2.new_counts()) + \
+            policy_2.sample(self.lines[500:], policy_2.new_counts())
+        assert kept_1 == kept_2
+        assert SamplingPolicy.from_config(None) is None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_sampling_util')
+
+    test_sampling_util = SamplingUtilUT()
+
+    logger.info("###### TEST EXACT COUNTS #####")
+    test_sampling_util.test_exact_counts()
+
+    logger.info("###### TEST DETERMINISTIC SAMPLE #####")
+    test_sampling_util.test_deterministic_sample()
@@ -0,0 +1,68 @@
+import logging
+import time
+
+from util.scheduling_util import CycleScheduler, SHED_WORK
+
+
+class SchedulingUtilUT(object):
+
+    def run_cycle(self, scheduler, seconds):
+        shed_work = scheduler.start_cycle()
+        time.sleep(seconds)
+        return shed_work, scheduler.cycle_completed()
+
+    def test_overruns(self):
+        scheduler = CycleScheduler(0.05)
+        shed = []
+        for seconds in (0.08, 0.08, 0.08, 0.08):
+            shed_work, overrun = self.run_cycle(scheduler, seconds)
+            assert overrun > 0
+            shed.append(shed_work)
+        # One more kind of work shed after each overrun, by priority
+        assert shed == [frozenset(SHED_WORK[:level]) for level in (0, 1, 2, 3)]
+        assert scheduler.stats['cycle_overruns'] == 4
+        assert scheduler.stats['cycle_overrun_seconds'] >= 4 * 0.03
+        logger.info("Overruns: {stats}".format(stats=scheduler.stats))
+
+    def test_relief(self):
+        scheduler = CycleScheduler(0.05)
+        scheduler.level = 2
+        # Within the deadline but without headroom, the work shed is kept
+        assert self.run_cycle(scheduler, 0.045)[1] == 0 and scheduler.level == 2
+        self.run_cycle(scheduler, 0)
+        assert scheduler.level == 1 and scheduler.shed_work() == frozenset(['rotated_archives'])
+
+    def test_no_load_shedding(self):
+        scheduler = CycleScheduler(0.01, load_shedding=False)
+        self.run_cycle(scheduler, 0.02)
+        assert scheduler.stats['cycle_overruns'] == 1 and scheduler.shed_work() == frozenset()
+
+    def test_remaining_seconds(self):
+        scheduler = CycleScheduler(0.05)
+        scheduler.start_cycle()
+        time.sleep(0.02)
+        assert 0 < scheduler.remaining_seconds(0.05) <= 0.03
+        assert not scheduler.past_deadline()
+        time.sleep(0.04)
+        # An overrunning cycle is followed by the next one right away
+        assert scheduler.remaining_seconds(0.05) == 0
+        assert scheduler.past_deadline()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_scheduling_util')
+
+    test_scheduling_util = SchedulingUtilUT()
+
+    logger.info("###### TEST OVERRUNS #####")
+    test_scheduling_util.test_overruns()
+
+    logger.info("###### TEST RELIEF #####")
+    test_scheduling_util.test_relief()
+
+    logger.info("###### TEST NO LOAD SHEDDING #####")
+    test_scheduling_util.test_no_load_shedding()
+
+    logger.info("###### TEST REMAINING SECONDS #####")
+    test_scheduling_util.test_remaining_seconds()
@@ -0,0 +1,117 @@
+import logging
+import os
+import tempfile
+import time
+
+from util.sink_util import Sink, ArchiveSink, ship_files
+
+
+class RecordingSink(Sink):
+    """
+    Sink recording the batches it delivers, slowed down or failing on demand
+    """
+
+    def __init__(self, name, logger, delay=0.0, failures=0, **options):
+        self.delay = delay
+        self.failures = failures
+        self.batches = []
+        super(RecordingSink, self).__init__(name, logger, retry_backoff_in_seconds=0.01, **options)
+
+    def deliver(self, file_names):
+        time.sleep(self.delay)
+        if self.failures > 0:
+            self.failures -= 1
+            return False
+        for file_name in file_names:
+            assert os.path.exists(file_name)
+        self.batches.append(file_names)
+        return True
+
+
+class SinkUtilUT(object):
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp()
+
+    def save_files(self, nb_files):
+        file_names = []
+        for i in range(nb_files):
+            file_name = os.path.join(self.dir, 'i-1_20171010_access_log_{i}'.format(i=i))
+            with open(file_name, 'w') as log_file:
+                log_file.write('[env] - line {i}\n'.format(i=i))
+            file_names.append(file_name)
+        return file_names
+
+    def test_slow_sink_only_delays_itself(self):
+        slow_sink = RecordingSink('slow', logger, delay=0.5)
+        fast_sink = RecordingSink('fast', logger, batch_size=4)
+        archive_sink = ArchiveSink(os.path.join(self.dir, 'archive'), logger)
+
+        start = time.time()
+        shipped_file_names = ship_files(self.save_files(8), [slow_sink, fast_sink, archive_sink], keep_files=False)
+        assert time.time() - start < 0.1
+
+        fast_sink.close()
+        archive_sink.close()
+        assert sum(len(batch) for batch in fast_sink.batches) == 8 and len(fast_sink.batches) < 8
+        assert len(os.listdir(os.path.join(self.dir, 'archive'))) == 8
+        # Files are removed once every sink is done with them
+        assert all(os.path.exists(file_name) for file_name in shipped_file_names)
+        slow_sink.close()
+        assert not any(os.path.exists(file_name) for file_name in shipped_file_names)
+        logger.info("{nb} files shipped in {sec} s".format(nb=len(shipped_file_names), sec=round(time.time() - start, 2)))
+
+    def test_retries_and_full_queue(self):
+        failing_sink = RecordingSink('failing', logger, failures=2)
+        ship_files(self.save_files(1), [failing_sink], keep_files=False)
+        failing_sink.close()
+        assert failing_sink.stats == {'delivered': 1, 'failed': 0, 'dropped': 0, 'spooled': 0}
+
+        # A file still not delivered after every attempt is kept on disk
+        failed_sink = RecordingSink('failed', logger, failures=3)
+        shipped_file_names = ship_files(self.save_files(1), [failed_sink], keep_files=False)
+        failed_sink.close()
+        assert failed_sink.stats['failed'] == 1 and os.path.exists(shipped_file_names[0])
+
+        spool_directory = os.path.join(self.dir, 'spool')
+        full_sink = RecordingSink('full', logger, delay=0.2, queue_size=1, spool_directory=spool_directory)
+        shipped_file_names = ship_files(self.save_files(4), [full_sink], keep_files=True)
+        assert full_sink.stats['spooled'] > 0 and full_sink.stats['dropped'] == 0
+        assert all(os.path.exists(file_name) for file_name in shipped_file_names)
+        # Spooled files are queued again once there is room
+        time.sleep(1)
+        full_sink.close()
+        assert full_sink.stats['delivered'] == 4 and len(os.listdir(spool_directory)) == 0
+
+    def test_spool_across_restarts(self):
+        spool_directory = os.path.join(self.dir, 'restart_spool')
+        slow_sink = RecordingSink('slow', logger, delay=0.1, queue_size=1, spool_directory=spool_directory)
+        shipped_file_names = ship_files(self.save_files(5), [slow_sink], keep_files=False)
+        assert slow_sink.stats['spooled'] > 0
+        # Queued and spooled files are delivered before stopping
+        slow_sink.close()
+        assert slow_sink.stats['delivered'] == 5 and len(os.listdir(spool_directory)) == 0
+        assert not any(os.path.exists(file_name) for file_name in shipped_file_names)
+
+        # Files left in the spool by a process which did not stop are delivered by the next one
+        for file_name in self.save_files(3):
+            os.rename(file_name, os.path.join(spool_directory, os.path.basename(file_name)))
+        next_sink = RecordingSink('slow', logger, spool_directory=spool_directory)
+        next_sink.close()
+        assert next_sink.stats['delivered'] == 3 and len(os.listdir(spool_directory)) == 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_sink_util')
+
+    test_sink_util = SinkUtilUT()
+
+    logger.info("###### TEST SLOW SINK ONLY DELAYS ITSELF #####")
+    test_sink_util.test_slow_sink_only_delays_itself()
+
+    logger.info("###### TEST RETRIES AND FULL QUEUE #####")
+    test_sink_util.test_retries_and_full_queue()
+
+    logger.info("###### TEST SPOOL ACROSS RESTARTS #####")
+    test_sink_util.test_spool_across_restarts()
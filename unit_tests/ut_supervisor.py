@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import signal
+import tempfile
+import time
+
+import yaml
+
+from classes.eb_log_retrieval_supervisor import EBLogRetrievalSupervisor, EBLogRetrievalWorker
+
+
+class FakeProcess(object):
+
+    def __init__(self, alive, exitcode=None):
+        self.alive = alive
+        self.exitcode = exitcode
+        self.pid = 4242
+
+    def is_alive(self):
+        return self.alive
+
+
+class SupervisorUT(object):
+
+    def __init__(self):
+        self.config = {'job_name': 'ut-supervisor', 'workers': 3, 'backup_directory': tempfile.mkdtemp(),
+                       'backup_file_name': 'backup', 'sleeping_window_in_seconds': 60,
+                       'coordination': {'node_id': 'node-a'},
+                       'environments': [{'name': 'eb-env-{i}'.format(i=i)} for i in range(30)] +
+                                       [{'id': 'e-{i}'.format(i=i)} for i in range(10)]}
+
+    def supervisor(self):
+        supervisor = EBLogRetrievalSupervisor(self.config, 'config', logger)
+        supervisor.started = []
+        supervisor.start_worker = lambda worker_id: supervisor.started.append(worker_id)
+        return supervisor
+
+    def test_partitioning(self):
+        partitions = self.supervisor().partition_environments()
+        assert sorted(partitions) == ['worker-0', 'worker-1', 'worker-2']
+        # Every environment goes to exactly one worker, always the same one
+        assigned = [env for environments in partitions.values() for env in environments]
+        assert sorted(map(str, assigned)) == sorted(map(str, self.config['environments']))
+        assert partitions == self.supervisor().partition_environments()
+        logger.info("Environments per worker: {nb}".format(
+            nb={worker_id: len(environments) for worker_id, environments in partitions.items()}))
+
+    def test_worker_config(self):
+        environments = self.config['environments'][:2]
+        config = self.supervisor().worker_config('worker-1', environments)
+        assert 'workers' not in config
+        assert config['environments'] == environments
+        assert config['backup_file_name'] == 'backup_worker-1'
+        assert config['coordination'] == {'group': 'worker-1', 'node_id': 'node-a_worker-1'}
+        # The configuration of the supervisor is left unchanged
+        assert self.config['backup_file_name'] == 'backup' and self.config['coordination'] == {'node_id': 'node-a'}
+
+    def test_restart_backoff(self):
+        supervisor = self.supervisor()
+        supervisor.workers = {
+            'worker-0': {'process': FakeProcess(True), 'restarts': 0, 'started_at': time.time() - 1000},
+            'worker-1': {'process': FakeProcess(False, 1), 'restarts': 0, 'started_at': time.time() - 5},
+            'worker-2': {'process': FakeProcess(False, 1), 'restarts': 0, 'started_at': time.time() - 11}
+        }
+        supervisor.check_workers()
+        # A living worker is left alone, a dead one is restarted once its backoff of 10 s is over
+        assert supervisor.started == ['worker-2']
+        assert supervisor.workers['worker-2']['restarts'] == 1
+
+        # The backoff doubles after each restart, up to 5 minutes
+        supervisor.started = []
+        supervisor.workers['worker-2']['started_at'] = time.time() - 15
+        supervisor.check_workers()
+        assert supervisor.started == []
+        supervisor.workers['worker-2']['started_at'] = time.time() - 21
+        supervisor.check_workers()
+        assert supervisor.started == ['worker-2'] and supervisor.workers['worker-2']['restarts'] == 2
+
+        supervisor.started = []
+        supervisor.workers['worker-2']['restarts'] = 10
+        supervisor.workers['worker-2']['started_at'] = time.time() - 301
+        supervisor.check_workers()
+        assert supervisor.started == ['worker-2']
+
+    def test_merged_metrics(self):
+        supervisor = self.supervisor()
+        supervisor.workers = {
+            'worker-0': {'metrics': {'cycles': 3, 'lines_collected': 100, 'last_cycle_seconds': 1.5,
+                                     'last_cycle_completed_at': 1000.0}},
+            'worker-1': {'metrics': {'cycles': 2, 'lines_collected': 50, 'last_cycle_seconds': 2.5,
+                                     'last_cycle_completed_at': 900.0, 'engine': 'asyncio'}},
+            'worker-2': {'metrics': {}}
+        }
+        # Counters are summed, 'last_*' values are maxed and values which are not numbers are left out
+        assert supervisor.merged_metrics() == {'cycles': 5, 'lines_collected': 150, 'last_cycle_seconds': 2.5,
+                                               'last_cycle_completed_at': 1000.0}
+
+    def test_reload(self):
+        config = dict(self.config, environments=self.config['environments'][:1])
+        supervisor = EBLogRetrievalSupervisor(config, 'config', logger,
+                                              config_file_path=os.path.join(tempfile.mkdtemp(), 'config.yml'))
+        supervisor.started = []
+        supervisor.start_worker = lambda worker_id: supervisor.started.append(worker_id)
+        supervisor.forwarded = []
+        supervisor.forward_signal = lambda signum, stack: supervisor.forwarded.append(signum)
+        supervisor.assign_environments()
+        assert len(supervisor.started) == 1
+        first_worker = supervisor.started[0]
+
+        # The signal handler only requests the reload
+        supervisor.request_reload(signal.SIGUSR1, None)
+        assert supervisor.reload_requested and supervisor.forwarded == []
+
+        with open(supervisor.config_file_path, 'w') as yml_file:
+            yaml.safe_dump(dict(self.config, workers=5), yml_file)
+        supervisor.reload_config()
+        assert not supervisor.reload_requested
+        # Running workers re-load their share, the others are started with theirs, the number of workers is kept
+        assert supervisor.forwarded == [signal.SIGUSR1]
+        assert sorted(supervisor.started) == ['worker-0', 'worker-1', 'worker-2']
+        assert supervisor.started.count(first_worker) == 1
+        assert sum(len(worker['environments']) for worker in supervisor.workers.values()) == 40
+        # Each worker cuts the re-loaded configuration file down to the same share
+        worker = EBLogRetrievalWorker(first_worker, 3, config=supervisor.workers[first_worker]['config'],
+                                      config_relative_dir_name='config', logger=logger)
+        with open(supervisor.config_file_path, 'r') as yml_file:
+            assert worker.reloaded_config(yaml.safe_load(yml_file)) == supervisor.workers[first_worker]['config']
+
+        # An invalid configuration file is not applied
+        with open(supervisor.config_file_path, 'w') as yml_file:
+            yaml.safe_dump(dict(self.config, environments=[{'files': []}]), yml_file)
+        supervisor.reload_config()
+        assert len(supervisor.config['environments']) == 40
+
+    def test_seed_backup(self):
+        backup_directory = tempfile.mkdtemp()
+        config = dict(self.config, backup_directory=backup_directory)
+        # Checkpoints left by the single process mode, and by a worker of a former number of workers
+        with open(os.path.join(backup_directory, 'backup'), 'w') as backup:
+            json.dump({'eb-env-{i}'.format(i=i): {'i-1': {'/var/log/app.log': {'offset': i}},
+                                                  'last_time_updated': '2024-01-01 00:00:00'}
+                       for i in range(30)}, backup)
+        with open(os.path.join(backup_directory, 'backup_worker-7'), 'w') as backup:
+            json.dump({'eb-env-0': {'i-1': {'/var/log/app.log': {'offset': 100}},
+                                    'last_time_updated': '2024-01-02 00:00:00'}}, backup)
+        # Health file and spool directories are not backup files
+        with open(os.path.join(backup_directory, 'backup_health.json'), 'w') as health:
+            health.write('{"workers": {}}')
+        os.mkdir(os.path.join(backup_directory, 'backup_worker-0_spool'))
+
+        supervisor = EBLogRetrievalSupervisor(config, 'config', logger)
+        supervisor.start_worker = lambda worker_id: None
+        supervisor.assign_environments()
+        seeded = {}
+        for worker_id, worker in supervisor.workers.items():
+            with open(os.path.join(backup_directory, 'backup_' + worker_id), 'r') as backup:
+                checkpoints = json.load(backup)
+            assert sorted(checkpoints) == sorted(env for env in worker['environments'] if env.startswith('eb-env'))
+            seeded.update(checkpoints)
+        # Every environment gets its most recently updated checkpoint
+        assert seeded['eb-env-0']['i-1']['/var/log/app.log']['offset'] == 100
+        assert all(seeded['eb-env-{i}'.format(i=i)]['i-1']['/var/log/app.log']['offset'] == i for i in range(1, 30))
+
+        # The checkpoints of a worker's own backup file are kept when no other backup file is more recent
+        with open(os.path.join(backup_directory, 'backup_worker-7'), 'w') as backup:
+            json.dump({}, backup)
+        worker_id = next(iter(supervisor.workers))
+        eb_env = supervisor.workers[worker_id]['environments'][0]
+        with open(os.path.join(backup_directory, 'backup_' + worker_id), 'w') as backup:
+            json.dump({eb_env: {'i-2': {}, 'last_time_updated': '2024-01-01 00:00:00'}}, backup)
+        supervisor.seed_backup(worker_id)
+        with open(os.path.join(backup_directory, 'backup_' + worker_id), 'r') as backup:
+            assert json.load(backup)[eb_env] == {'i-2': {}, 'last_time_updated': '2024-01-01 00:00:00'}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    logger = logging.getLogger('ut_supervisor')
+
+    test_supervisor = SupervisorUT()
+
+    logger.info("###### TEST PARTITIONING #####")
+    test_supervisor.test_partitioning()
+
+    logger.info("###### TEST WORKER CONFIG #####")
+    test_supervisor.test_worker_config()
+
+    logger.info("###### TEST RESTART BACKOFF #####")
+    test_supervisor.test_restart_backoff()
+
+    logger.info("###### TEST MERGED METRICS #####")
+    test_supervisor.test_merged_metrics()
+
+    logger.info("###### TEST RELOAD #####")
+    test_supervisor.test_reload()
+
+    logger.info("###### TEST SEED BACKUP #####")
+    test_supervisor.test_seed_backup()
@@ -5,7 +5,9 @@ import logging
 
 from ebcli.lib.aws import set_region
 
+from benchmarks.aws_stubs import StubEC2Client, StubElasticBeanstalkClient
 from classes.tail_eb_environment import TailEBEnvironment
+from util.checkpoint_util import EnvironmentState, dump_state
 
 
 class TailEBEnvironmentUT(object):
@@ -31,23 +33,23 @@ class TailEBEnvironmentUT(object):
         self.api_endpoint = None
         self.key_pem = 'key_pem_file_path'
         self.ec2_user = 'ec2-user'
-        self.environment_1_dict = {}
-        self.environment_2_dict = {}
-        self.environment_3_dict = {}
+        self.environment_1_dict = EnvironmentState()
+        self.environment_2_dict = EnvironmentState()
+        self.environment_3_dict = EnvironmentState()
 
 
     def test_find_instances_by_eb_name(self):
         try:
             config = {'name': 'your_eb_env_name_or_id', 'key_pem': '', 'files': []}
-            eb_env = TailEBEnvironment("eb_env_alias_1", self.eb_client, self.ec2_client, config, {}, logger)
+            eb_env = TailEBEnvironment("eb_env_alias_1", self.eb_client, self.ec2_client, config, EnvironmentState(), logger)
             eb_env.find_instances()
 
             config = {'name': 'another_of_your_eb_env_name_or_id', 'key_pem': '', 'files': []}
-            eb_env = TailEBEnvironment("eb_env_alias_2", self.eb_client, self.ec2_client, config, {}, logger)
+            eb_env = TailEBEnvironment("eb_env_alias_2", self.eb_client, self.ec2_client, config, EnvironmentState(), logger)
             eb_env.find_instances()
 
             config = {'name': 'another_of_your_eb_env_name_or_id', 'key_pem': '', 'files': []}
-            eb_env = TailEBEnvironment("eb_env_alias_3", self.eb_client, self.ec2_client, config, {}, logger)
+            eb_env = TailEBEnvironment("eb_env_alias_3", self.eb_client, self.ec2_client, config, EnvironmentState(), logger)
             eb_env.find_instances()
         except Exception as e:
             logger.error(str(e))
@@ -55,7 +57,7 @@ class TailEBEnvironmentUT(object):
     def test_find_instances_by_eb_id(self):
         try:
             config = {'id': 'your_eb_env_id', 'key_pem': '', 'files': []}
-            eb_env = TailEBEnvironment("eb_env_alias_1", self.eb_client, self.ec2_client, config, {}, logger)
+            eb_env = TailEBEnvironment("eb_env_alias_1", self.eb_client, self.ec2_client, config, EnvironmentState(), logger)
             eb_env.find_instances()
         except Exception as e:
             logger.error(str(e))
@@ -63,12 +65,41 @@ class TailEBEnvironmentUT(object):
     def test_find_ec2_hosts(self):
         try:
             config = {'name': 'your_eb_env_name', 'key_pem': '', 'files': []}
-            env = TailEBEnvironment("eb_env_alias_1", self.eb_client, self.ec2_client, config, {}, logger)
+            env = TailEBEnvironment("eb_env_alias_1", self.eb_client, self.ec2_client, config, EnvironmentState(), logger)
             env.find_instances()
             env.find_ec2_instance_hosts()
         except Exception as e:
             logger.error(str(e))
 
+    def test_find_leaving_hosts(self):
+        # Runs locally against the stubs of the benchmarks
+        environment_instances = {'your_eb_env_name': ['i-1', 'i-2', 'i-3']}
+        eb_client = StubElasticBeanstalkClient(environment_instances)
+        ec2_client = StubEC2Client({'i-1': '10.0.0.1', 'i-2': '10.0.0.2', 'i-3': '10.0.0.3'})
+        config = {'name': 'your_eb_env_name', 'key_pem': '', 'files': []}
+        env = TailEBEnvironment("eb_env_alias_1", eb_client, ec2_client, config, EnvironmentState(), logger)
+        env.find_instances()
+        env.find_ec2_instance_hosts()
+        assert sorted(env.hosts) == ['i-1', 'i-2', 'i-3'] and env.leaving_hosts == {}
+
+        # i-3 disappears from the environment, i-2 is shutting down, both are flushed with their cached host
+        environment_instances['your_eb_env_name'].remove('i-3')
+        ec2_client.instance_states['i-2'] = 'shutting-down'
+        env.prepare_cycle(eb_client, ec2_client, EnvironmentState())
+        env.find_instances()
+        env.find_ec2_instance_hosts()
+        assert env.hosts == {'i-1': '10.0.0.1'}
+        assert env.leaving_hosts == {'i-2': '10.0.0.2', 'i-3': '10.0.0.3'}
+        assert [final for instance_id, host, final in env.instances_to_tail()] == [True, True, False]
+
+        # Once flushed, i-2 is not tailed again while the environment still lists it
+        env.close_leaving_hosts()
+        env.prepare_cycle(eb_client, ec2_client, EnvironmentState())
+        env.find_instances()
+        env.find_ec2_instance_hosts()
+        assert env.hosts == {'i-1': '10.0.0.1'} and env.leaving_hosts == {}
+        logger.info("Leaving instances flushed once: {left}".format(left=sorted(env.left_instances)))
+
     def test_tail_multiple_eb_environments(self):
         config1 = {'name': 'your_eb_env_name',
                              'key_pem': self.key_pem,
@@ -96,9 +127,9 @@ class TailEBEnvironmentUT(object):
                                                     ec2_client=self.ec2_client, config=config3,
                                                     environment_dict=self.environment_3_dict, logger=logger).run()
 
-        logger.info(json.dumps({config1['name']: self.environment_1_dict}, indent=4, sort_keys=True))
-        logger.info(json.dumps({config2['name']: self.environment_2_dict}, indent=4, sort_keys=True))
-        logger.info(json.dumps({config3['name']: self.environment_3_dict}, indent=4, sort_keys=True))
+        logger.info(json.dumps(dump_state({config1['name']: self.environment_1_dict}), indent=4, sort_keys=True))
+        logger.info(json.dumps(dump_state({config2['name']: self.environment_2_dict}), indent=4, sort_keys=True))
+        logger.info(json.dumps(dump_state({config3['name']: self.environment_3_dict}), indent=4, sort_keys=True))
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -120,5 +151,8 @@ if __name__ == "__main__":
     logger.info("###### TEST FIND EC2 HOSTS #####")
     test_tail_eb_env.test_find_ec2_hosts()
 
+    logger.info("###### TEST FIND LEAVING HOSTS #####")
+    test_tail_eb_env.test_find_leaving_hosts()
+
     logger.info("###### TEST TAIL MULTIPLE EB ENVIRONMENTS #####")
     test_tail_eb_env.test_tail_multiple_eb_environments()
\ No newline at end of file
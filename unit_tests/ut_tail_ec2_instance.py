@@ -5,6 +5,7 @@ import logging
 from ebcli.lib.aws import set_region
 
 from classes.tail_ec2_instance import TailEC2Instance
+from util.checkpoint_util import EnvironmentState, dump_state
 
 
 class TailEC2InstanceUT(object):
@@ -34,14 +35,14 @@ class TailEC2InstanceUT(object):
         instance_id_1 = 'your_ec2_instance_id'
         host_1 = 'your_ec2_instance_host'
         instance_1_dict = {}
-        environment_1_dict = {}
+        environment_1_dict = EnvironmentState()
 
         # Config EB environment 2
         eb_env_2 = 'another_of_your_eb_env_name'
         instance_id_2 = 'another_of_your_ec2_instance_id'
         host_2 = 'another_of_your_ec2_instance_host'
         instance_2_dict = {}
-        environment_2_dict = {}
+        environment_2_dict = EnvironmentState()
 
         instance_1_dict = TailEC2Instance(eb_environment_id=eb_env_1, instance_id=instance_id_1,
                                     host=host_1, user=ec2_user, files=self.files,
@@ -53,18 +54,14 @@ class TailEC2InstanceUT(object):
                                     key_pem=key_pem_path, instance_dict=instance_2_dict,
                                     api_endpoint=api_endpoint, keep_files=keep_files, logger=logger).run()
 
-        environment_1_dict.update({
-            instance_id_1: instance_1_dict,
-            'last_time_updated': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        environment_1_dict.instances[instance_id_1] = instance_1_dict
+        environment_1_dict.last_time_updated = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        environment_2_dict.update({
-            instance_id_2: instance_2_dict,
-            'last_time_updated': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        environment_2_dict.instances[instance_id_2] = instance_2_dict
+        environment_2_dict.last_time_updated = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        logger.info(json.dumps({eb_env_1: environment_1_dict}, indent=4, sort_keys=True))
-        logger.info(json.dumps({eb_env_2: environment_2_dict}, indent=4, sort_keys=True))
+        logger.info(json.dumps(dump_state({eb_env_1: environment_1_dict}), indent=4, sort_keys=True))
+        logger.info(json.dumps(dump_state({eb_env_2: environment_2_dict}), indent=4, sort_keys=True))
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,107 @@
+import functools
+import threading
+
+ENGINES = ('threads', 'asyncio')
+
+# Defaults of the limits shared by every environment of the process
+MAX_CONCURRENT_CHANNELS = 64
+MAX_CONCURRENT_AWS_CALLS = 8
+
+
+class AsyncEngine(object):
+    """
+    Event loop scheduling the collection of every environment as tasks: AWS discovery calls and SSH channels,
+    saved files being shipped by the sinks. Their limits are semaphores shared by every environment, and the blocking libraries
+    (boto3, paramiko) run in one executor sized after them instead of threads started per file
+    The loop runs in its own thread so that the run() methods keep returning their dictionaries
+    """
+
+    def __init__(self, max_channels=MAX_CONCURRENT_CHANNELS, max_aws_calls=MAX_CONCURRENT_AWS_CALLS):
+        # The engine is only loaded when enabled
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.limits = {'channels': max_channels, 'aws': max_aws_calls}
+        self.executor = ThreadPoolExecutor(max_workers=max_channels + max_aws_calls,
+                                           thread_name_prefix='collection')
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self.loop.run_forever, name='collection-loop', daemon=True)
+        self.thread.start()
+        self.semaphores = self.run(self.create_semaphores())
+
+    async def create_semaphores(self):
+        import asyncio
+
+        return {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine in the loop and waits for its result, from any thread but the loop's
+        :param coroutine:
+        :return:
+        """
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def blocking(self, limit, function, *args):
+        """
+        Runs a blocking function in the executor
+        :param limit: 'channels', 'aws' or None if the function is not limited
+        :param function:
+        :param args:
+        :return: result of the function
+        """
+        if limit is None:
+            return await self.loop.run_in_executor(None, functools.partial(function, *args))
+        async with self.semaphores[limit]:
+            return await self.loop.run_in_executor(None, functools.partial(function, *args))
+
+    async def gather(self, coroutines):
+        """
+        Runs coroutines as concurrent tasks
+        :param coroutines:
+        :return: list of their results
+        """
+        import asyncio
+
+        return await asyncio.gather(*coroutines)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait=True)
+
+
+_async_engine = None
+
+
+def start_async_engine(max_channels=MAX_CONCURRENT_CHANNELS, max_aws_calls=MAX_CONCURRENT_AWS_CALLS):
+    """
+    Starts the engine of the current process, or keeps the running one if it has the same limits
+    :return:
+    """
+    global _async_engine
+    limits = {'channels': max_channels, 'aws': max_aws_calls}
+    if _async_engine is not None and _async_engine.limits == limits:
+        return _async_engine
+    stop_async_engine()
+    _async_engine = AsyncEngine(max_channels, max_aws_calls)
+    return _async_engine
+
+
+def get_async_engine():
+    """
+    Engine of the current process
+    :return: AsyncEngine, None if environments are collected with threads
+    """
+    return _async_engine
+
+
+def stop_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        _async_engine.close()
+        _async_engine = None
@@ -1,18 +1,19 @@
-import boto.sns
+import os
 
 from datetime import datetime
-from ebcli.lib import ec2
 
 
 class AWSConfig(object):
     def __init__(self, logger):
         super(AWSConfig, self).__init__()
-        self.access_key_id = boto.config.get_value('Credentials', 'aws_access_key_id')
-        self.secret_key = boto.config.get_value('Credentials', 'aws_secret_access_key')
         self.logger = logger
 
     def sns_publish(self, subject, message, target_arn):
+        # The legacy boto SNS client is only loaded when a target ARN is configured
+        if not target_arn:
+            return None
         try:
+            import boto.sns
             sns = boto.sns.SNSConnection()
             sns.publish(target_arn=target_arn, subject=subject, message=message)
             return sns
@@ -22,6 +23,7 @@ class AWSConfig(object):
 
 # Opens port 22 to allow SSH connection into the given EC2 instance
 def authorize_ssh(ec2_instance_id, logger):
+    from ebcli.lib import ec2
     instance = ec2.describe_instance(ec2_instance_id)
     security_groups = instance['SecurityGroups']
 
@@ -49,6 +51,7 @@ def authorize_ssh(ec2_instance_id, logger):
 # Revokes SSH authorization on port 22 for the given instance
 def revoke_ssh_authorization(ec2_instance_id, group, logger):
     if group:
+        from ebcli.lib import ec2
         logger.debug("{instance}: Closing port 22 for {group}".format(instance=ec2_instance_id, group=group))
         ec2.revoke_ssh(group)
         logger.debug("{instance}: SSH port 22 closed for {group}".format(instance=ec2_instance_id, group=group))
@@ -59,3 +62,10 @@ def format_aws_file(file_base_name, ec2_instance):
     ydm = datetime.now().strftime("%Y%d%m")
     return "{instance}_{datetime}_{file}".format(instance=ec2_instance,
                                                  datetime=ydm, file=file_base_name)
+
+
+# Formats the path of a key pem file, bare file names are looked for in ~/.ssh
+def format_key_pem_path(key_pem):
+    if os.path.basename(key_pem) == key_pem:
+        return os.path.join(os.path.expanduser('~'), '.ssh', key_pem)
+    return key_pem
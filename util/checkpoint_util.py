@@ -0,0 +1,109 @@
+import sys
+
+
+class FileCheckpoint(object):
+    """
+    Position reached in one log file of an instance: byte offset, identity of the file (inode and fingerprint of
+    its head) and number of lines, with the checkpoint of its previous file while its archive catch-up is deferred
+    Fields of a checkpoint never collected are None
+    """
+
+    __slots__ = ('offset', 'inode', 'head', 'head_length', 'nb_lines', 'deferred')
+
+    def __init__(self, offset=None, inode=None, head=None, head_length=None, nb_lines=None, deferred=None):
+        self.offset = offset
+        self.inode = inode
+        self.head = head
+        self.head_length = head_length
+        self.nb_lines = nb_lines
+        self.deferred = deferred
+
+    def copy(self):
+        """
+        :return: copy of the position and identity of the file, without its deferred checkpoint
+        """
+        return FileCheckpoint(self.offset, self.inode, self.head, self.head_length, self.nb_lines)
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        deferred = dictionary.get('deferred')
+        return cls(dictionary.get('offset'), dictionary.get('inode'), dictionary.get('head'),
+                   dictionary.get('head_length'), dictionary.get('nb_lines'),
+                   cls.from_dict(deferred) if isinstance(deferred, dict) else None)
+
+    def to_dict(self):
+        dictionary = {}
+        for key in ('offset', 'inode', 'head', 'head_length', 'nb_lines'):
+            value = getattr(self, key)
+            if value is not None:
+                dictionary[key] = value
+        if self.deferred is not None:
+            dictionary['deferred'] = self.deferred.to_dict()
+        return dictionary
+
+
+class EnvironmentState(object):
+    """
+    Checkpoints of one EB environment: instance identifier -> log file path -> FileCheckpoint
+    Identifiers and paths are interned, so that every checkpoint of a file shares the same string
+    """
+
+    __slots__ = ('instances', 'last_time_updated')
+
+    def __init__(self, instances=None, last_time_updated=None):
+        self.instances = instances if instances is not None else {}
+        self.last_time_updated = last_time_updated
+
+    def instance(self, instance_id):
+        """
+        :param instance_id:
+        :return: dictionary of the checkpoints of one instance, created if needed
+        """
+        if instance_id not in self.instances:
+            self.instances[sys.intern(instance_id)] = {}
+        return self.instances[instance_id]
+
+    def prune(self, instance_ids):
+        """
+        Removes the checkpoints of the instances which are not in the given ones
+        :param instance_ids: set-like
+        :return:
+        """
+        for instance_id in self.instances.keys() - instance_ids:
+            del self.instances[instance_id]
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        instances = {}
+        for instance_id, files in dictionary.items():
+            if instance_id == 'last_time_updated' or not isinstance(files, dict):
+                continue
+            instances[sys.intern(instance_id)] = {sys.intern(file_name): FileCheckpoint.from_dict(checkpoint)
+                                                  for file_name, checkpoint in files.items()
+                                                  if isinstance(checkpoint, dict)}
+        return cls(instances, dictionary.get('last_time_updated'))
+
+    def to_dict(self):
+        dictionary = {instance_id: {file_name: checkpoint.to_dict() for file_name, checkpoint in files.items()}
+                      for instance_id, files in self.instances.items()}
+        if self.last_time_updated is not None:
+            dictionary['last_time_updated'] = self.last_time_updated
+        return dictionary
+
+
+def load_state(dictionary):
+    """
+    Checkpoints of every EB environment from their persisted format, e.g. the backup file
+    :param dictionary: EB environment -> instance identifier -> log file path -> checkpoint dictionary
+    :return: dictionary of EB environment -> EnvironmentState
+    """
+    return {eb_env: EnvironmentState.from_dict(environment) for eb_env, environment in dictionary.items()
+            if isinstance(environment, dict)}
+
+
+def dump_state(state):
+    """
+    :param state: dictionary of EB environment -> EnvironmentState
+    :return: persisted format of the checkpoints, see load_state
+    """
+    return {eb_env: environment.to_dict() for eb_env, environment in state.items()}
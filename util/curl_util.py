@@ -1,18 +1,34 @@
+import glob
+import json
+import mmap
 import os
-import pycurl
+import zlib
 
 __author__ = 'rhuberdeau'
 
+# Retained files are uploaded by chunks of this size cut on newlines, each chunk in its own request
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def curl_upload(api_endpoint, read, size, logger):
+    """
+    Uploads size bytes given by a read function in one request
+    :param api_endpoint:
+    :param read: READFUNCTION, returns at most the requested number of bytes
+    :param size:
+    :param logger:
+    :return: whether or not the endpoint accepted them
+    """
+    # pycurl is only loaded when logs are sent to an endpoint
+    import pycurl
 
-def curl_post_data(api_endpoint, filename, logger):
     c = pycurl.Curl()
     c.setopt(c.URL, api_endpoint)
     c.setopt(c.UPLOAD, True)
-    c.setopt(c.VERBOSE, True)
     c.setopt(pycurl.CONNECTTIMEOUT, 5)
     c.setopt(pycurl.TIMEOUT, 5)
-    c.setopt(pycurl.READFUNCTION, open(filename, 'rb').read)
-    c.setopt(pycurl.INFILESIZE, os.path.getsize(filename))
+    c.setopt(pycurl.READFUNCTION, read)
+    c.setopt(pycurl.INFILESIZE, size)
 
     try:
         c.perform()
@@ -21,9 +37,126 @@ def curl_post_data(api_endpoint, filename, logger):
 
         if response_code != 200:
             logger.error("CODE == {code}".format(code=response_code))
+        return response_code == 200
     except pycurl.error as e:
         logger.error("Pycurl error: " + str(e))
     except Exception as e:
         logger.error("curl error: " + str(e))
     finally:
         c.close()
+    return False
+
+
+def curl_post_data(api_endpoint, filename, logger):
+    with open(filename, 'rb') as data_file:
+        return curl_upload(api_endpoint, data_file.read, os.path.getsize(filename), logger)
+
+
+def curl_post_files(api_endpoint, file_names, logger):
+    """
+    Uploads several files as the body of one request
+    :param api_endpoint:
+    :param file_names:
+    :param logger:
+    :return: whether or not the endpoint accepted them
+    """
+    files = []
+    try:
+        for file_name in file_names:
+            files.append(open(file_name, 'rb'))
+
+        def read(size):
+            while len(files) > 0:
+                data = files[0].read(size)
+                if len(data) > 0:
+                    return data
+                files.pop(0).close()
+            return b''
+
+        return curl_upload(api_endpoint, read, sum(os.path.getsize(file_name) for file_name in file_names), logger)
+    finally:
+        for file in files:
+            file.close()
+
+
+def acknowledgements_file(file_name, api_endpoint):
+    """
+    Sidecar file of the byte ranges of a file acknowledged by an endpoint
+    :param file_name:
+    :param api_endpoint:
+    :return:
+    """
+    return "{file}.{endpoint:08x}.ack".format(file=file_name, endpoint=zlib.crc32(api_endpoint.encode('utf-8')))
+
+
+def acknowledged_offset(ack_file_name, size):
+    """
+    :param ack_file_name:
+    :param size: current size of the file, ranges recorded for another size are ignored
+    :return: end of the acknowledged range starting at 0
+    """
+    try:
+        with open(ack_file_name) as ack_file:
+            acknowledgements = json.load(ack_file)
+    except (FileNotFoundError, ValueError):
+        return 0
+    if acknowledgements.get('size') != size:
+        return 0
+    return max([end for start, end in acknowledgements.get('ranges', []) if start == 0] or [0])
+
+
+def remove_acknowledgements(file_name):
+    """
+    Removes the sidecar files of a file, once it has been removed
+    :param file_name:
+    :return:
+    """
+    for ack_file_name in glob.glob(glob.escape(file_name) + '.*.ack'):
+        os.remove(ack_file_name)
+
+
+def curl_post_chunks(api_endpoint, file_name, logger, chunk_size=CHUNK_SIZE):
+    """
+    Uploads a retained file by chunks read from a memory map, each chunk in its own request
+    The byte ranges acknowledged by the endpoint are recorded next to the file, so that an upload which failed
+    resumes from the last acknowledged chunk instead of the beginning of the file
+    :param api_endpoint:
+    :param file_name:
+    :param logger:
+    :param chunk_size:
+    :return: whether or not the whole file has been acknowledged
+    """
+    size = os.path.getsize(file_name)
+    ack_file_name = acknowledgements_file(file_name, api_endpoint)
+    offset = acknowledged_offset(ack_file_name, size)
+    if offset >= size:
+        return True
+    if offset > 0:
+        logger.info("Resuming the upload of {file} at {offset}/{size} bytes".format(file=file_name, offset=offset,
+                                                                                    size=size))
+
+    with open(file_name, 'rb') as data_file, mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while offset < size:
+            end = offset + chunk_size
+            if end >= size:
+                end = size
+            else:
+                newline = data.find(b'\n', end)
+                end = size if newline == -1 else newline + 1
+
+            position = [offset]
+
+            def read(nb_bytes):
+                start = position[0]
+                position[0] = min(start + nb_bytes, end)
+                return data[start:position[0]]
+
+            if not curl_upload(api_endpoint, read, end - offset, logger):
+                return False
+            offset = end
+
+            # Replaced at once so that a crash never leaves a partial record
+            with open(ack_file_name + '.tmp', 'w') as ack_file:
+                json.dump({'size': size, 'ranges': [[0, offset]]}, ack_file)
+            os.replace(ack_file_name + '.tmp', ack_file_name)
+    return True
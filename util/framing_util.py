@@ -0,0 +1,82 @@
+import io
+
+# Size of the blocks written at once, cut on line boundaries
+BLOCK_SIZE = 1024 * 1024
+
+# Size of the regions whose lines are counted at once when looking for a line
+SCAN_SIZE = 64 * 1024
+
+NEWLINE = b'\n'
+
+
+def count_lines(data):
+    """
+    Number of lines of raw logs, like len(readlines()): the last line may not end with a newline
+    :param data: bytes
+    :return:
+    """
+    nb_lines = data.count(NEWLINE)
+    if len(data) > 0 and data[-1:] != NEWLINE:
+        nb_lines += 1
+    return nb_lines
+
+
+def skip_lines(data, nb_lines, start=0):
+    """
+    Offset of the first line following nb_lines lines, newlines are counted by regions instead of line by line
+    :param data: bytes
+    :param nb_lines:
+    :param start: offset to start from
+    :return: offset, len(data) if there are not as many lines
+    """
+    offset = start
+    size = len(data)
+    while nb_lines > 0 and offset < size:
+        end = min(offset + SCAN_SIZE, size)
+        nb_region_lines = data.count(NEWLINE, offset, end)
+        if nb_region_lines < nb_lines:
+            nb_lines -= nb_region_lines
+            offset = end
+            continue
+        while nb_lines > 0:
+            offset = data.find(NEWLINE, offset, end) + 1
+            nb_lines -= 1
+    return min(offset, size)
+
+
+def frame_blocks(data, prefix, start=0, block_size=BLOCK_SIZE):
+    """
+    Prefixes every line of raw logs, a block of lines at a time with a single replace instead of a format per line
+    :param data: bytes
+    :param prefix: bytes put in front of every line
+    :param start: offset of the first line
+    :param block_size:
+    :return: generator of lists of buffers, to be written with writelines
+    """
+    size = len(data)
+    separator = NEWLINE + prefix
+    while start < size:
+        end = start + block_size
+        if end >= size:
+            end = size
+        else:
+            newline = data.find(NEWLINE, end)
+            end = size if newline == -1 else newline + 1
+
+        framed = data[start:end].replace(NEWLINE, separator)
+        if framed.endswith(separator):
+            # The prefix following the last newline belongs to the next block
+            yield [prefix, memoryview(framed)[:-len(prefix)]]
+        else:
+            yield [prefix, framed]
+        start = end
+
+
+def decode_lines(data, start=0):
+    """
+    Decodes raw logs into lines for the stages working on text: rollups, sampling and parsing
+    :param data: bytes
+    :param start: offset of the first line
+    :return: list of str ending with their newline
+    """
+    return io.StringIO(data[start:].decode('utf-8', 'replace'), newline='\n').readlines()
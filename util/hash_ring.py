@@ -0,0 +1,43 @@
+import bisect
+import hashlib
+
+
+class ConsistentHashRing(object):
+    """
+    Consistent hash ring mapping keys (EB environments) onto nodes (workers)
+    Adding or removing one node only moves the keys of that node
+    """
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.hashes = []
+        self.ring = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            point = self.hash('{node}#{replica}'.format(node=node, replica=replica))
+            self.ring[point] = node
+            bisect.insort(self.hashes, point)
+
+    def remove_node(self, node):
+        for replica in range(self.replicas):
+            point = self.hash('{node}#{replica}'.format(node=node, replica=replica))
+            if self.ring.pop(point, None) is not None:
+                self.hashes.remove(point)
+
+    def get_node(self, key):
+        """
+        Node owning the given key
+        :param key:
+        :return:
+        """
+        if not self.hashes:
+            return None
+        index = bisect.bisect(self.hashes, self.hash(key)) % len(self.hashes)
+        return self.ring[self.hashes[index]]
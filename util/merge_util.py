@@ -0,0 +1,110 @@
+import calendar
+import heapq
+import re
+
+# Lines are merged as bytes, so that every merged line is identical to its source whatever its encoding
+MONTHS = {month: i for i, month in enumerate([b'Jan', b'Feb', b'Mar', b'Apr', b'May', b'Jun',
+                                               b'Jul', b'Aug', b'Sep', b'Oct', b'Nov', b'Dec'], 1)}
+
+# Apache/nginx access logs: 10.0.0.1 - - [10/Oct/2017:13:55:36 +0000] "GET / HTTP/1.1" ...
+ACCESS_LOG_TIME = re.compile(rb'\[(\d{2})/(\w{3})/(\d{4}):(\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})\]')
+# Tomcat 8+ catalina.out: 10-Oct-2017 13:55:36.123 INFO ...
+CATALINA_TIME = re.compile(rb'(\d{2})-(\w{3})-(\d{4}) (\d{2}):(\d{2}):(\d{2})(?:\.(\d{3}))?')
+# Tomcat 7 catalina.out: Oct 10, 2017 1:55:36 PM org.apache...
+CATALINA_7_TIME = re.compile(rb'(\w{3}) (\d{1,2}), (\d{4}) (\d{1,2}):(\d{2}):(\d{2}) ([AP]M)')
+# log4j/logback style: 2017-10-10 13:55:36,123 INFO ...
+ISO_TIME = re.compile(rb'(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})(?:[.,](\d{3}))?')
+
+# The access log timestamp follows the client address and identity, it is only looked for in this many bytes
+ACCESS_LOG_TIME_SEARCH_LENGTH = 96
+
+
+def parse_log_timestamp(line, start=0):
+    """
+    Parses the leading timestamp of an access log or catalina line
+    :param line: bytes
+    :param start: offset of the log in the line, after the [eb_env] - prefix
+    :return: seconds since the epoch (UTC for access logs, local time of the instance otherwise), None if not found
+    """
+    match = CATALINA_TIME.match(line, start)
+    if match is not None:
+        day, month, year, hours, minutes, seconds, millis = match.groups()
+        month = MONTHS.get(month)
+        if month is not None:
+            timestamp = calendar.timegm((int(year), month, int(day), int(hours), int(minutes), int(seconds)))
+            return timestamp + int(millis) / 1000.0 if millis else timestamp
+
+    match = ISO_TIME.match(line, start)
+    if match is not None:
+        year, month, day, hours, minutes, seconds, millis = match.groups()
+        timestamp = calendar.timegm((int(year), int(month), int(day), int(hours), int(minutes), int(seconds)))
+        return timestamp + int(millis) / 1000.0 if millis else timestamp
+
+    match = CATALINA_7_TIME.match(line, start)
+    if match is not None:
+        month, day, year, hours, minutes, seconds, meridiem = match.groups()
+        month = MONTHS.get(month)
+        if month is not None:
+            hours = int(hours) % 12 + (12 if meridiem == b'PM' else 0)
+            return calendar.timegm((int(year), month, int(day), hours, int(minutes), int(seconds)))
+
+    match = ACCESS_LOG_TIME.search(line, start, start + ACCESS_LOG_TIME_SEARCH_LENGTH)
+    if match is not None:
+        day, month, year, hours, minutes, seconds, sign, offset_hours, offset_minutes = match.groups()
+        month = MONTHS.get(month)
+        if month is not None:
+            offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+            timestamp = calendar.timegm((int(year), month, int(day), int(hours), int(minutes), int(seconds)))
+            return timestamp - offset if sign == b'+' else timestamp + offset
+
+    return None
+
+
+def ordered_lines(file_name, stream_index, reorder_window, prefix_length=0):
+    """
+    Reads one log file as (timestamp, stream index, line number, line) tuples in time order
+    Lines up to reorder_window seconds late are put back in order, lines without a timestamp
+    (e.g. stack traces) stay right after the line they belong to
+    :param file_name:
+    :param stream_index: tie breaker between the streams of the merge
+    :param reorder_window: in seconds
+    :param prefix_length: length in bytes of the [eb_env] - prefix to skip before the timestamp
+    :return: generator
+    """
+    buffer = []
+    timestamp = float('-inf')
+    # Read as bytes, lines are only cut on newlines and an invalid byte does not stop the merge
+    with open(file_name, 'rb') as log_file:
+        for line_number, line in enumerate(log_file):
+            line_timestamp = parse_log_timestamp(line, prefix_length)
+            if line_timestamp is not None:
+                timestamp = line_timestamp
+            heapq.heappush(buffer, (timestamp, stream_index, line_number, line))
+            while buffer[0][0] <= timestamp - reorder_window:
+                yield heapq.heappop(buffer)
+    while buffer:
+        yield heapq.heappop(buffer)
+
+
+def merge_log_files(file_names, merged_file_name, reorder_window=5, prefix_length=0, sources=None):
+    """
+    Streaming k-way merge of log files into a single time ordered file
+    Memory is bounded by the lines of the reorder window, not by the size of the files
+    :param file_names:
+    :param merged_file_name:
+    :param reorder_window: in seconds
+    :param prefix_length: length in bytes of the [eb_env] - prefix to skip before the timestamp
+    :param sources: label of each file inserted after the prefix of its lines, e.g. its instance and log file
+    :return: number of lines merged
+    """
+    streams = [ordered_lines(file_name, i, reorder_window, prefix_length) for i, file_name in enumerate(file_names)]
+    if sources is not None:
+        sources = [source.encode('utf-8') for source in sources]
+    nb_lines = 0
+    with open(merged_file_name, 'wb') as merged_file:
+        for timestamp, stream_index, line_number, line in heapq.merge(*streams):
+            if sources is not None:
+                line = line[:prefix_length] + sources[stream_index] + line[prefix_length:]
+            merged_file.write(line)
+            nb_lines += 1
+    return nb_lines
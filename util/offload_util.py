@@ -0,0 +1,172 @@
+import gzip
+import os
+import shutil
+
+from util.framing_util import frame_blocks
+
+# Raw logs are framed by chunks of this size cut on newlines, each chunk by one worker
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Smaller logs are framed in the calling thread, handing them over would cost more than framing them
+MIN_OFFLOAD_SIZE = 256 * 1024
+
+
+def _attach(name):
+    """
+    Attaches a shared memory block created by the parent process, which unlinks it
+    Workers share the resource tracker of the parent process, the block is tracked once
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13
+        return SharedMemory(name=name)
+
+
+def _frame_chunk(input_name, output_name, start, end, output_offset, prefix):
+    """
+    Worker side: frames the lines of input[start:end] into output[output_offset:]
+    :return: number of bytes written
+    """
+    input_memory = _attach(input_name)
+    output_memory = _attach(output_name)
+    try:
+        data = bytes(input_memory.buf[start:end])
+        offset = output_offset
+        for buffers in frame_blocks(data, prefix):
+            for buffer in buffers:
+                output_memory.buf[offset:offset + len(buffer)] = buffer
+                offset += len(buffer)
+        return offset - output_offset
+    finally:
+        input_memory.close()
+        output_memory.close()
+
+
+def _decompress(archive, output, chunk_size=1024 * 1024):
+    """
+    Worker side: decompresses a gzip archive into a file
+    """
+    with gzip.open(archive, 'rb') as gz, open(output, 'wb') as output_file:
+        shutil.copyfileobj(gz, output_file, chunk_size)
+
+
+class OffloadPool(object):
+    """
+    Process pool for the CPU-bound stages of the collection, so that they do not compete for the GIL
+    with the SSH threads: framing raw logs and decompressing rotated archives
+    Parsing, sampling and rollups are not offloaded, they run in the calling process
+    Raw logs are handed over to the workers through shared memory instead of being pickled
+    """
+
+    def __init__(self, workers, chunk_size=CHUNK_SIZE):
+        # The pool is only loaded when enabled
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # Forking a process running paramiko threads is not safe
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def chunks(self, data, start, prefix_length):
+        """
+        Cuts raw logs on newlines into chunks, with the offset of each framed chunk in the output
+        :return: tuple (list of (start, end, output offset), output size)
+        """
+        size = len(data)
+        chunks = []
+        output_size = 0
+        while start < size:
+            end = start + self.chunk_size
+            if end >= size:
+                end = size
+            else:
+                newline = data.find(b'\n', end)
+                end = size if newline == -1 else newline + 1
+            nb_lines = data.count(b'\n', start, end)
+            if end == size and data[-1:] != b'\n':
+                nb_lines += 1
+            chunks.append((start, end, output_size))
+            output_size += end - start + nb_lines * prefix_length
+            start = end
+        return chunks, output_size
+
+    def write_framed(self, log_file, data, start, prefix):
+        """
+        Frames raw logs in the workers and writes them to a binary file
+        :param log_file: file opened in binary mode
+        :param data: raw logs
+        :param start: offset of the first line
+        :param prefix: bytes put in front of every line
+        :return: number of bytes written
+        """
+        from multiprocessing.shared_memory import SharedMemory
+
+        chunks, output_size = self.chunks(data, start, len(prefix))
+        if output_size == 0:
+            return 0
+
+        input_memory = SharedMemory(create=True, size=len(data) - start)
+        output_memory = SharedMemory(create=True, size=output_size)
+        try:
+            input_memory.buf[:len(data) - start] = memoryview(data)[start:]
+            futures = [self.executor.submit(_frame_chunk, input_memory.name, output_memory.name,
+                                            chunk_start - start, chunk_end - start, output_offset, prefix)
+                       for chunk_start, chunk_end, output_offset in chunks]
+            for future in futures:
+                future.result()
+            log_file.write(output_memory.buf[:output_size])
+        finally:
+            input_memory.close()
+            input_memory.unlink()
+            output_memory.close()
+            output_memory.unlink()
+        return output_size
+
+    def decompress(self, archive, output):
+        """
+        Decompresses a gzip archive into a file in a worker
+        :param archive:
+        :param output:
+        :return:
+        """
+        self.executor.submit(_decompress, os.path.abspath(archive), os.path.abspath(output)).result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+_offload_pool = None
+
+
+def start_offload_pool(workers):
+    """
+    Starts the offload pool of the current process, stops it if no worker is requested
+    :param workers:
+    :return:
+    """
+    global _offload_pool
+    if _offload_pool is not None and _offload_pool.workers == workers:
+        return _offload_pool
+    stop_offload_pool()
+    if workers > 0:
+        _offload_pool = OffloadPool(workers)
+    return _offload_pool
+
+
+def get_offload_pool():
+    """
+    Offload pool of the current process
+    :return: OffloadPool, None if CPU-bound stages run in the calling thread
+    """
+    return _offload_pool
+
+
+def stop_offload_pool():
+    global _offload_pool
+    if _offload_pool is not None:
+        _offload_pool.close()
+        _offload_pool = None
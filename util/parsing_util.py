@@ -0,0 +1,198 @@
+import json
+import re
+
+from operator import attrgetter
+
+OUTPUTS = ('raw', 'ndjson', 'columnar')
+
+# Lines parsed and written at once
+BATCH_SIZE = 10000
+
+
+class AccessLogRecord(object):
+    """
+    One request of an Apache/nginx access log (common or combined format)
+    """
+    __slots__ = ('host', 'ident', 'user', 'time', 'method', 'path', 'protocol', 'status', 'size', 'referer', 'agent',
+                 'latency')
+
+    def __init__(self, host, ident, user, time, method, path, protocol, status, size, referer, agent, latency):
+        self.host = host
+        self.ident = ident
+        self.user = user
+        self.time = time
+        self.method = method
+        self.path = path
+        self.protocol = protocol
+        self.status = int(status)
+        self.size = int(size) if size != '-' else 0
+        self.referer = referer
+        self.agent = agent
+        # In milliseconds, from Apache's %D (microseconds) or nginx's $request_time (seconds) appended to the format
+        if latency is None:
+            self.latency = None
+        elif '.' in latency:
+            self.latency = float(latency) * 1000
+        else:
+            self.latency = int(latency) / 1000.0
+
+
+class CatalinaRecord(object):
+    """
+    One entry of Tomcat's catalina.out, lines without a timestamp (e.g. stack traces) are part of the message
+    """
+    __slots__ = ('time', 'level', 'thread', 'logger', 'message')
+
+    def __init__(self, time, level, thread, logger, message):
+        self.time = time
+        self.level = level
+        self.thread = thread
+        self.logger = logger
+        self.message = message
+
+
+class LogFormat(object):
+    """
+    Precompiled definition of a log format
+    """
+
+    def __init__(self, name, pattern, record_class, multiline=False):
+        self.name = name
+        self.regex = re.compile(pattern)
+        self.record_class = record_class
+        self.fields = record_class.__slots__
+        self.get_fields = attrgetter(*self.fields)
+        # Lines not matching the format continue the message of the previous record
+        self.multiline = multiline
+
+
+LOG_FORMATS = {log_format.name: log_format for log_format in (
+    # 10.0.0.1 - frank [10/Oct/2017:13:55:36 +0000] "GET /index.html HTTP/1.1" 200 2326 "http://referer/" "Mozilla/5.0"
+    LogFormat('combined',
+              r'(\S+) (\S+) (\S+) \[([^\]]+)\] "(\S+) (\S+)(?: (\S+))?" (\d{3}) (\d+|-)'
+              r'(?: "((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)")?(?: (\d+(?:\.\d+)?)$)?',
+              AccessLogRecord),
+    # 10-Oct-2017 13:55:36.123 SEVERE [http-nio-8080-exec-1] org.apache.catalina.core.StandardWrapperValve.invoke Message
+    LogFormat('catalina',
+              r'(\d{2}-\w{3}-\d{4} \d{2}:\d{2}:\d{2}(?:\.\d{3})?) ([A-Z]+) \[([^\]]*)\] (\S+) ?(.*)',
+              CatalinaRecord, multiline=True),
+)}
+
+
+class RecordBatch(object):
+    """
+    Records parsed from a batch of lines and the lines matching no format, kept as they are
+    """
+    __slots__ = ('log_format', 'records', 'unparsed')
+
+    def __init__(self, log_format):
+        self.log_format = log_format
+        self.records = []
+        self.unparsed = []
+
+
+def get_log_format(name):
+    """
+    :param name: name of a format of LOG_FORMATS
+    :return: LogFormat, None if no format is given
+    """
+    if name is None:
+        return None
+    if name not in LOG_FORMATS:
+        raise ValueError("Unknown log format {name}, expected one of {formats}".format(
+            name=name, formats=', '.join(sorted(LOG_FORMATS))))
+    return LOG_FORMATS[name]
+
+
+def parse_batches(lines, log_format, batch_size=BATCH_SIZE):
+    """
+    Parses lines into record batches
+    :param lines: iterable of log lines
+    :param log_format: LogFormat
+    :param batch_size:
+    :return: generator of RecordBatch
+    """
+    match = log_format.regex.match
+    record_class = log_format.record_class
+    batch = RecordBatch(log_format)
+    nb_lines = 0
+    for line in lines:
+        line = line.rstrip('\n')
+        matched = match(line)
+
+        # Multiline records are never split across two batches
+        if nb_lines >= batch_size and (matched is not None or not log_format.multiline):
+            yield batch
+            batch = RecordBatch(log_format)
+            nb_lines = 0
+
+        if matched is not None:
+            batch.records.append(record_class(*matched.groups()))
+        elif log_format.multiline and len(batch.records) > 0:
+            last_record = batch.records[-1]
+            last_record.message = last_record.message + '\n' + line
+        elif line != '':
+            batch.unparsed.append(line)
+        nb_lines += 1
+    if len(batch.records) > 0 or len(batch.unparsed) > 0:
+        yield batch
+
+
+def write_ndjson(output_file, batch, tags):
+    """
+    Writes one JSON object per record, unparsed lines are written as a message
+    :param output_file:
+    :param batch:
+    :param tags: fields added to every object, e.g. the EB environment and the instance
+    :return: number of characters written
+    """
+    fields = batch.log_format.fields
+    get_fields = batch.log_format.get_fields
+    dumps = json.dumps
+    tags = dumps(tags)[1:-1]
+    separator = ', ' if tags else ''
+    lines = ['{' + tags + separator + dumps(dict(zip(fields, get_fields(record))))[1:] + '\n'
+             for record in batch.records]
+    lines += ['{' + tags + separator + dumps({'message': line})[1:] + '\n' for line in batch.unparsed]
+    data = ''.join(lines)
+    output_file.write(data)
+    return len(data)
+
+
+def write_columnar(output_file, batch, tags):
+    """
+    Writes the batch as one JSON object holding one array per field
+    :param output_file:
+    :param batch:
+    :param tags: fields added to the object, e.g. the EB environment and the instance
+    :return: number of characters written
+    """
+    columns = list(zip(*map(batch.log_format.get_fields, batch.records))) or [()] * len(batch.log_format.fields)
+    document = dict(tags)
+    document['format'] = batch.log_format.name
+    document['count'] = len(batch.records)
+    document['columns'] = dict(zip(batch.log_format.fields, columns))
+    document['unparsed'] = batch.unparsed
+    data = json.dumps(document) + '\n'
+    output_file.write(data)
+    return len(data)
+
+
+WRITERS = {'ndjson': write_ndjson, 'columnar': write_columnar}
+
+
+def write_records(output_file, lines, log_format, output, tags):
+    """
+    Parses log lines in batches and writes them in the given structured output
+    :param output_file:
+    :param lines:
+    :param log_format: LogFormat
+    :param output: 'ndjson' or 'columnar'
+    :param tags:
+    :return: number of characters written
+    """
+    writer = WRITERS[output]
+    nb_chars = 0
+    for batch in parse_batches(lines, log_format):
+        nb_chars += writer(output_file, batch, tags)
+    return nb_chars
@@ -0,0 +1,154 @@
+import cProfile
+import functools
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+# Profiler of the cycles currently profiled, None when profiling is disabled
+_active_profiler = None
+
+
+class StageProfiler(object):
+    """
+    Collects cProfile statistics, wall times and tracemalloc snapshots of each pipeline stage
+    for a fixed number of cycles, then disables itself
+    """
+
+    def __init__(self, output_dir, nb_cycles, use_tracemalloc, logger):
+        self.output_dir = os.path.expanduser(output_dir)
+        self.remaining_cycles = nb_cycles
+        self.use_tracemalloc = use_tracemalloc
+        self.logger = logger
+
+        self.cycle = 0
+        self.cycle_dir = None
+        self.sequence = 0
+        self.timings = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def start_cycle(self):
+        """
+        Creates the dump directory of the new cycle
+        :return:
+        """
+        self.cycle += 1
+        self.cycle_dir = os.path.join(self.output_dir, '{start}_cycle_{cycle:04d}'.format(
+            start=time.strftime('%Y%m%d%H%M%S'), cycle=self.cycle))
+        os.makedirs(self.cycle_dir, exist_ok=True)
+        self.timings = []
+        if self.use_tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+        self.logger.info("Profiling cycle dumped into {dir}".format(dir=self.cycle_dir))
+
+    def end_cycle(self):
+        """
+        Dumps stage timings of the cycle
+        :return: True if more cycles have to be profiled
+        """
+        with open(os.path.join(self.cycle_dir, 'stages.json'), 'w') as timings_file:
+            timings_file.write(json.dumps(self.timings, indent=4))
+
+        if self.use_tracemalloc and tracemalloc.is_tracing():
+            self.dump_snapshot('cycle')
+
+        self.remaining_cycles -= 1
+        if self.remaining_cycles <= 0 and self.use_tracemalloc:
+            tracemalloc.stop()
+        return self.remaining_cycles > 0
+
+    def next_file_name(self, stage, extension):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        return os.path.join(self.cycle_dir, '{seq:05d}_{stage}_{thread}.{ext}'.format(
+            seq=sequence, stage=stage, thread=re.sub(r'\W+', '_', threading.current_thread().name).strip('_'), ext=extension))
+
+    def dump_snapshot(self, stage):
+        """
+        Dumps the allocation snapshot and its top allocating lines
+        :param stage:
+        :return:
+        """
+        snapshot = tracemalloc.take_snapshot()
+        file_name = self.next_file_name(stage, 'snapshot')
+        snapshot.dump(file_name)
+        with open(file_name.replace('.snapshot', '_top.txt'), 'w') as top_file:
+            for stat in snapshot.statistics('lineno')[:50]:
+                top_file.write("{stat}\n".format(stat=stat))
+
+    def profile(self, stage, func, *args, **kwargs):
+        """
+        Runs one stage under cProfile
+        Nested stages, and stages running while another thread is profiled, only get their wall time
+        recorded since a single profiler can be active at once
+        :param stage:
+        :param func:
+        :return: the result of the stage
+        """
+        profile = None
+        if not getattr(self.local, 'profiling', False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.local.profiling = True
+            except ValueError:
+                profile = None
+
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self.local.profiling = False
+                profile.dump_stats(self.next_file_name(stage, 'prof'))
+                if self.use_tracemalloc and tracemalloc.is_tracing():
+                    self.dump_snapshot(stage)
+            with self.lock:
+                self.timings.append({'stage': stage, 'thread': threading.current_thread().name,
+                                     'seconds': round(elapsed, 6)})
+
+
+def start_profiling(output_dir, nb_cycles, use_tracemalloc, logger):
+    """
+    Enables profiling for the next nb_cycles cycles
+    :return:
+    """
+    global _active_profiler
+    _active_profiler = StageProfiler(output_dir, nb_cycles, use_tracemalloc, logger)
+    logger.info("Profiling enabled for the next {nb} cycles".format(nb=nb_cycles))
+
+
+def profiling_cycle_started():
+    if _active_profiler is not None:
+        _active_profiler.start_cycle()
+
+
+def profiling_cycle_completed():
+    global _active_profiler
+    profiler = _active_profiler
+    if profiler is not None and not profiler.end_cycle():
+        _active_profiler = None
+        profiler.logger.info("Profiling disabled, profiles available in {dir}".format(dir=profiler.output_dir))
+
+
+def profiled_stage(stage):
+    """
+    Decorates one pipeline stage, costs a single global lookup when profiling is disabled
+    :param stage:
+    :return:
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active_profiler
+            if profiler is None or profiler.cycle_dir is None:
+                return func(*args, **kwargs)
+            return profiler.profile(stage, func, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,167 @@
+import json
+import math
+import re
+import threading
+
+from datetime import datetime
+
+from util.parsing_util import parse_batches
+
+# Path segments replaced by {id} in URL templates: numbers, UUIDs and long hexadecimal identifiers
+ID_SEGMENT = re.compile(r'/(?:\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|'
+                        r'[0-9a-fA-F]{16,})(?=/|$)')
+
+# URL templates kept per minute, the other requests are counted under OTHER_TEMPLATE
+MAX_TEMPLATES_PER_MINUTE = 1000
+OTHER_TEMPLATE = '{other}'
+
+
+def url_template(path):
+    """
+    URL of a request without its query string and with its identifiers replaced, e.g. /items/{id}/reviews
+    :param path:
+    :return:
+    """
+    query = path.find('?')
+    if query != -1:
+        path = path[:query]
+    return ID_SEGMENT.sub('/{id}', path)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch with a bounded relative error (DDSketch): values are counted
+    in logarithmic buckets so that sketches of several instances or minutes can be added up
+    """
+    __slots__ = ('gamma', 'log_gamma', 'buckets', 'zeros', 'count', 'max')
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """
+        :param q: between 0 and 1
+        :return: estimated value, None if the sketch is empty
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return min(2 * self.gamma ** index / (self.gamma + 1), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'gamma': self.gamma, 'zeros': self.zeros, 'count': self.count, 'max': self.max,
+                'buckets': {str(index): count for index, count in self.buckets.items()}}
+
+
+class AccessLogRollup(object):
+    """
+    Streaming per-minute rollups of the access logs of one EB environment:
+    request counts by URL template and status code, and latency sketches by URL template
+    """
+
+    def __init__(self, eb_env_alias, relative_accuracy=0.01):
+        self.eb_env_alias = eb_env_alias
+        self.relative_accuracy = relative_accuracy
+        # minute -> URL template -> {'statuses': {status: count}, 'latency': QuantileSketch}
+        self.minutes = {}
+        self.nb_lines = 0
+        # Instances of the environment can be tailed concurrently
+        self.lock = threading.Lock()
+
+    def add_lines(self, lines, log_format):
+        """
+        Aggregates access log lines
+        :param lines:
+        :param log_format: access log LogFormat
+        :return: number of requests aggregated
+        """
+        nb_requests = 0
+        for batch in parse_batches(lines, log_format):
+            with self.lock:
+                for record in batch.records:
+                    self.add(record)
+                self.nb_lines += len(batch.records)
+            nb_requests += len(batch.records)
+        return nb_requests
+
+    def add(self, record):
+        # 10/Oct/2017:13:55:36 +0000 -> 10/Oct/2017:13:55 +0000
+        minute = record.time[:17] + record.time[20:]
+        templates = self.minutes.get(minute)
+        if templates is None:
+            templates = self.minutes[minute] = {}
+
+        template = url_template(record.path)
+        rollup = templates.get(template)
+        if rollup is None:
+            if len(templates) >= MAX_TEMPLATES_PER_MINUTE:
+                template = OTHER_TEMPLATE
+                rollup = templates.get(template)
+            if rollup is None:
+                rollup = templates[template] = {'statuses': {}, 'latency': QuantileSketch(self.relative_accuracy)}
+
+        statuses = rollup['statuses']
+        statuses[record.status] = statuses.get(record.status, 0) + 1
+        if record.latency is not None:
+            rollup['latency'].add(record.latency)
+
+    def flush(self, rollup_file):
+        """
+        Writes one JSON object per minute and URL template, then starts new rollups
+        :param rollup_file: opened local file
+        :return: number of rollups written
+        """
+        with self.lock:
+            minutes = self.minutes
+            self.minutes = {}
+            self.nb_lines = 0
+
+        nb_rollups = 0
+        for minute, templates in minutes.items():
+            try:
+                minute_time = datetime.strptime(minute, '%d/%b/%Y:%H:%M %z').isoformat()
+            except ValueError:
+                minute_time = minute
+            for template, rollup in templates.items():
+                latency = rollup['latency']
+                rollup_file.write(json.dumps({
+                    'eb_env': self.eb_env_alias,
+                    'minute': minute_time,
+                    'url_template': template,
+                    'count': sum(rollup['statuses'].values()),
+                    'statuses': {str(status): count for status, count in rollup['statuses'].items()},
+                    'latency_ms': {'p50': latency.quantile(0.5), 'p90': latency.quantile(0.9),
+                                   'p99': latency.quantile(0.99), 'max': latency.max if latency.count else None},
+                    'latency_sketch': latency.to_dict()
+                }) + '\n')
+                nb_rollups += 1
+        return nb_rollups
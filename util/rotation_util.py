@@ -0,0 +1,80 @@
+import base64
+import hashlib
+
+# Bytes of the beginning of a file kept as its fingerprint
+HEAD_LENGTH = 512
+
+
+def tail_command(file_name, offset, command_prefix=''):
+    """
+    Remote command printing the identity of a file (inode and size, then its head in base64) on two lines,
+    followed by its content from the given byte offset
+    :param file_name:
+    :param offset: bytes already collected
+    :param command_prefix: e.g. nice/ionice
+    :return:
+    """
+    return "stat -c '%i %s' {file} && head -c {head_length} {file} | base64 -w 0 && echo && " \
+           "{prefix}tail -c +{start} {file}".format(file=file_name, head_length=HEAD_LENGTH,
+                                                    prefix=command_prefix, start=offset + 1)
+
+
+def parse_tail_output(output):
+    """
+    :param output: raw output of tail_command
+    :return: tuple (identity dictionary of inode, size and head, offset of the content in the output),
+             identity is None if the file could not be read
+    """
+    first_newline = output.find(b'\n')
+    second_newline = output.find(b'\n', first_newline + 1)
+    if first_newline == -1 or second_newline == -1:
+        return None, len(output)
+    try:
+        inode, size = output[:first_newline].split()
+        identity = {'inode': int(inode), 'size': int(size), 'head': base64.b64decode(output[first_newline + 1:second_newline])}
+    except ValueError:
+        return None, len(output)
+    return identity, second_newline + 1
+
+
+def head_digest(head):
+    return hashlib.md5(head).hexdigest()
+
+
+def starts_with_head(data, checkpoint):
+    """
+    Whether or not data begins like the file of the checkpoint
+    :param data: bytes
+    :param checkpoint: FileCheckpoint with the head and head_length of a file
+    :return:
+    """
+    head_length = checkpoint.head_length
+    return len(data) >= head_length and head_digest(data[:head_length]) == checkpoint.head
+
+
+def has_rotated(checkpoint, identity):
+    """
+    Whether or not the file of the checkpoint has been replaced (new inode) or truncated (copytruncate)
+    since it was collected, even if it grew again past the collected size
+    :param checkpoint: FileCheckpoint of the file
+    :param identity: current identity of the file
+    :return:
+    """
+    if checkpoint.inode is None:
+        return False
+    return identity['inode'] != checkpoint.inode or identity['size'] < checkpoint.offset \
+        or not starts_with_head(identity['head'], checkpoint)
+
+
+def update_checkpoint(checkpoint, identity, offset):
+    """
+    Records the identity of a file and the bytes collected from it
+    :param checkpoint: FileCheckpoint of the file
+    :param identity:
+    :param offset:
+    :return:
+    """
+    checkpoint.inode = identity['inode']
+    checkpoint.offset = offset
+    checkpoint.head = head_digest(identity['head'])
+    checkpoint.head_length = len(identity['head'])
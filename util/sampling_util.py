@@ -0,0 +1,56 @@
+import re
+import zlib
+
+HASH_RANGE = 2 ** 32
+
+
+class SamplingPolicy(object):
+    """
+    Keeps every line matching a pattern and a deterministic sample of the other lines
+    A line is sampled on the hash of its content, so that the same line is kept or dropped by every
+    collector, worker and retry
+    """
+
+    def __init__(self, keep_pattern=None, rate=1.0):
+        self.keep_pattern = keep_pattern
+        self.keep_regex = re.compile(keep_pattern) if keep_pattern else None
+        self.rate = float(rate)
+        self.threshold = int(self.rate * HASH_RANGE)
+
+    @classmethod
+    def from_config(cls, sampling_config):
+        """
+        :param sampling_config: 'sampling' section of a file, None if the file is not sampled
+        :return: SamplingPolicy, None if the file is not sampled
+        """
+        if sampling_config is None:
+            return None
+        return cls(sampling_config['keep_pattern'] if 'keep_pattern' in sampling_config else None,
+                   sampling_config['rate'] if 'rate' in sampling_config else 1.0)
+
+    def sample(self, lines, counts):
+        """
+        :param lines:
+        :param counts: dictionary of lines, kept_by_pattern, kept_by_sample and sampled_out counts to update
+        :return: lines kept
+        """
+        search = self.keep_regex.search if self.keep_regex is not None else None
+        threshold = self.threshold
+        crc32 = zlib.crc32
+        kept = []
+        kept_by_pattern = 0
+        for line in lines:
+            if search is not None and search(line) is not None:
+                kept.append(line)
+                kept_by_pattern += 1
+            elif crc32(line.encode('utf-8', 'replace')) < threshold:
+                kept.append(line)
+        counts['lines'] += len(lines)
+        counts['kept_by_pattern'] += kept_by_pattern
+        counts['kept_by_sample'] += len(kept) - kept_by_pattern
+        counts['sampled_out'] += len(lines) - len(kept)
+        return kept
+
+    def new_counts(self):
+        return {'lines': 0, 'kept_by_pattern': 0, 'kept_by_sample': 0, 'sampled_out': 0,
+                'rate': self.rate, 'keep_pattern': self.keep_pattern}
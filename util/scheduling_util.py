@@ -0,0 +1,72 @@
+import time
+
+# Work shed under overload, in this order: rotated archives still to catch up, environments with a lower priority,
+# then backfills of the instances without checkpoint whose files are read from their beginning
+SHED_WORK = ('rotated_archives', 'environments', 'backfills')
+
+# Shedding is relaxed one step after a cycle completed within this share of its deadline
+RELIEF_RATIO = 0.75
+
+
+class CycleScheduler(object):
+    """
+    Deadline of the collection cycles: a cycle overruns when it takes longer than its deadline
+    Each overrun sheds one more kind of work from the next cycles, a cycle completed with enough headroom
+    takes one back
+    """
+
+    def __init__(self, deadline_in_seconds, load_shedding=True):
+        self.deadline_in_seconds = deadline_in_seconds
+        self.load_shedding = load_shedding
+        self.level = 0
+        self.cycle_start_time = time.time()
+        self.stats = {'cycle_overruns': 0, 'cycle_overrun_seconds': 0.0,
+                      'shed_rotated_archives': 0, 'shed_environments': 0, 'shed_backfills': 0}
+
+    def start_cycle(self):
+        """
+        :return: work shed during this cycle
+        """
+        self.cycle_start_time = time.time()
+        return self.shed_work()
+
+    def shed_work(self):
+        return frozenset(SHED_WORK[:self.level])
+
+    def deadline(self):
+        return self.cycle_start_time + self.deadline_in_seconds
+
+    def past_deadline(self):
+        return time.time() > self.deadline()
+
+    def count(self, work, nb):
+        """
+        :param work: one of SHED_WORK
+        :param nb: units of work shed
+        :return:
+        """
+        self.stats['shed_{work}'.format(work=work)] += nb
+
+    def cycle_completed(self):
+        """
+        Records an overrun and adapts the work shed from the next cycles
+        :return: seconds spent past the deadline, 0 if the cycle completed in time
+        """
+        elapsed = time.time() - self.cycle_start_time
+        overrun = max(elapsed - self.deadline_in_seconds, 0.0)
+        if overrun > 0:
+            self.stats['cycle_overruns'] += 1
+            self.stats['cycle_overrun_seconds'] += overrun
+            if self.load_shedding:
+                self.level = min(self.level + 1, len(SHED_WORK))
+        elif elapsed <= self.deadline_in_seconds * RELIEF_RATIO:
+            self.level = max(self.level - 1, 0)
+        return overrun
+
+    def remaining_seconds(self, window_in_seconds):
+        """
+        Time left to sleep so that cycles start every window, none once the window is over
+        :param window_in_seconds:
+        :return:
+        """
+        return max(self.cycle_start_time + window_in_seconds - time.time(), 0.0)
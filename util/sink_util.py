@@ -0,0 +1,344 @@
+import collections
+import hashlib
+import itertools
+import os
+import queue
+import shutil
+import threading
+import time
+
+from util.curl_util import CHUNK_SIZE, curl_post_files, curl_post_chunks, remove_acknowledgements
+
+SINK_TYPES = ('http', 'archive')
+
+# Suffixes making the names of shipped files unique, the next cycles save their logs under the same names
+_spool_sequence = itertools.count()
+
+# Files submitted to a full queue are spooled under this directory, one sub-directory per sink
+_spool_directory = 'sink_spool'
+
+
+class ShippedFile(object):
+    """
+    Saved file handed over to several sinks, removed once every sink is done with it unless it is kept
+    A file that a sink failed to deliver is kept on disk
+    """
+
+    def __init__(self, file_name, nb_sinks, keep_file):
+        self.file_name = file_name
+        self.keep_file = keep_file
+        self.refcount = nb_sinks
+        self.lock = threading.Lock()
+
+    def release(self, delivered=True):
+        """
+        :param delivered: False if the sink failed to deliver the file
+        :return:
+        """
+        with self.lock:
+            self.refcount -= 1
+            self.keep_file = self.keep_file or not delivered
+            done = self.refcount == 0
+        if done and not self.keep_file:
+            try:
+                os.remove(self.file_name)
+            except FileNotFoundError:
+                pass
+            remove_acknowledgements(self.file_name)
+
+
+class Sink(object):
+    """
+    Destination of the saved files with its own bounded queue, workers, batching and retries,
+    so that a slow destination only delays itself: neither the SSH collection nor the other sinks
+    Files submitted while the queue is full are spooled to disk and queued again once there is room,
+    files left in the spool by a previous process are queued again too
+    """
+
+    def __init__(self, name, logger, queue_size=1000, workers=1, batch_size=1, max_attempts=3,
+                 retry_backoff_in_seconds=1.0, spool_directory=None):
+        self.name = name
+        self.logger = logger
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff_in_seconds
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {'delivered': 0, 'failed': 0, 'dropped': 0, 'spooled': 0}
+        self.stats_lock = threading.Lock()
+        self.spool_directory = spool_directory if spool_directory is not None else os.path.abspath(
+            os.path.join(_spool_directory, hashlib.md5(name.encode('utf-8')).hexdigest()[:12]))
+        self.spooled = collections.deque(self.spooled_files())
+        self.spool_lock = threading.Lock()
+        if len(self.spooled) > 0:
+            self.logger.info("{sink}: {nb} spooled files queued again".format(sink=self.name, nb=len(self.spooled)))
+        self.stopping = threading.Event()
+        self.threads = [threading.Thread(target=self.work, name='sink-{name}-{i}'.format(name=name, i=i), daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, shipped_file):
+        """
+        Queues a file without waiting
+        :param shipped_file: ShippedFile
+        :return: False if the file has been dropped
+        """
+        try:
+            self.queue.put_nowait(shipped_file)
+            return True
+        except queue.Full:
+            return self.spool(shipped_file)
+
+    def spool(self, shipped_file):
+        """
+        Keeps a file submitted while the queue is full in the spool directory of the sink, linked when possible
+        :param shipped_file: ShippedFile
+        :return: False if the file could not be spooled and has been dropped
+        """
+        spooled_file_name = os.path.join(self.spool_directory, os.path.basename(shipped_file.file_name))
+        try:
+            os.makedirs(self.spool_directory, exist_ok=True)
+            try:
+                os.link(shipped_file.file_name, spooled_file_name)
+            except OSError:
+                shutil.copyfile(shipped_file.file_name, spooled_file_name)
+        except OSError as e:
+            self.logger.error("{sink}: queue full, {file} dropped, {error}".format(
+                sink=self.name, file=shipped_file.file_name, error=str(e)))
+            self.count('dropped', 1)
+            return False
+        else:
+            self.logger.warning("{sink}: queue full, {file} spooled".format(sink=self.name, file=shipped_file.file_name))
+            self.count('spooled', 1)
+            with self.spool_lock:
+                self.spooled.append(spooled_file_name)
+            return True
+        finally:
+            shipped_file.release()
+
+    def spooled_files(self):
+        """
+        :return: files of the spool directory, oldest first
+        """
+        if not os.path.isdir(self.spool_directory):
+            return []
+        file_names = [os.path.join(self.spool_directory, file_name) for file_name in os.listdir(self.spool_directory)
+                      if not file_name.endswith('.ack')]
+        return sorted(file_names, key=os.path.getmtime)
+
+    def refill(self):
+        """
+        Queues spooled files again while the queue has room
+        :return:
+        """
+        with self.spool_lock:
+            while len(self.spooled) > 0:
+                try:
+                    self.queue.put_nowait(ShippedFile(self.spooled[0], 1, False))
+                except queue.Full:
+                    return
+                self.spooled.popleft()
+
+    def work(self):
+        while True:
+            self.refill()
+            try:
+                batch = [self.queue.get(timeout=0.2)]
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            delivered = False
+            try:
+                delivered = self.deliver_batch(batch)
+            finally:
+                for shipped_file in batch:
+                    shipped_file.release(delivered)
+                    self.queue.task_done()
+
+    def deliver_batch(self, batch):
+        """
+        Delivers a batch of files, retried with an exponential backoff
+        :param batch: ShippedFile
+        :return: whether or not the files have been delivered
+        """
+        file_names = [shipped_file.file_name for shipped_file in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if self.deliver(file_names):
+                    self.count('delivered', len(batch))
+                    return True
+            except Exception as e:
+                self.logger.error("{sink}: {error}".format(sink=self.name, error=str(e)))
+            if attempt < self.max_attempts:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+        self.logger.error("{sink}: {files} not delivered after {attempts} attempts, kept on disk".format(
+            sink=self.name, files=', '.join(file_names), attempts=self.max_attempts))
+        self.count('failed', len(batch))
+        return False
+
+    def count(self, key, nb_files):
+        with self.stats_lock:
+            self.stats[key] += nb_files
+
+    def deliver(self, file_names):
+        """
+        :param file_names:
+        :return: whether or not the files have been delivered
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Waits for the queued and spooled files to be delivered, then stops the workers
+        :return:
+        """
+        while True:
+            self.queue.join()
+            with self.spool_lock:
+                if len(self.spooled) == 0:
+                    break
+            self.refill()
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+
+class HTTPSink(Sink):
+    """
+    Uploads files to an endpoint, a batch of small files in one request
+    Larger batches are uploaded file by file and resumable, by acknowledged chunks
+    """
+
+    def __init__(self, url, logger, **options):
+        # Set before the workers start, they may deliver spooled files right away
+        self.url = url
+        super(HTTPSink, self).__init__(url, logger, **options)
+
+    def deliver(self, file_names):
+        if sum(os.path.getsize(file_name) for file_name in file_names) <= CHUNK_SIZE:
+            return curl_post_files(self.url, file_names, self.logger)
+        # A retried batch resumes from the chunks already acknowledged
+        return all(curl_post_chunks(self.url, file_name, self.logger) for file_name in file_names)
+
+
+class ArchiveSink(Sink):
+    """
+    Keeps files in a local directory, linked instead of copied when on the same filesystem
+    """
+
+    def __init__(self, directory, logger, **options):
+        self.directory = os.path.expanduser(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        super(ArchiveSink, self).__init__(directory, logger, **options)
+
+    def deliver(self, file_names):
+        for file_name in file_names:
+            archived_file_name = os.path.join(self.directory, os.path.basename(file_name))
+            try:
+                os.link(file_name, archived_file_name)
+            except OSError:
+                shutil.copyfile(file_name, archived_file_name)
+        return True
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def set_spool_directory(directory):
+    """
+    Directory of the spools of the sinks created next, each process needs its own
+    :param directory:
+    :return:
+    """
+    global _spool_directory
+    _spool_directory = directory
+
+
+def get_sink(config, logger):
+    """
+    Sink of the current process for a destination, shared by every environment shipping to it
+    The options of the first config of a destination are kept
+    :param config: {type: http, url: str} or {type: archive, directory: str}, with optional queue_size, workers,
+                   batch_size, max_attempts, retry_backoff_in_seconds and spool_directory
+    :param logger:
+    :return: Sink
+    """
+    options = {key: config[key] for key in ('queue_size', 'workers', 'batch_size', 'max_attempts',
+                                            'retry_backoff_in_seconds', 'spool_directory') if key in config}
+    if 'spool_directory' in options:
+        options['spool_directory'] = os.path.expanduser(options['spool_directory'])
+    with _sinks_lock:
+        if config['type'] == 'http':
+            key = ('http', config['url'])
+            if key not in _sinks:
+                _sinks[key] = HTTPSink(config['url'], logger, **options)
+        elif config['type'] == 'archive':
+            key = ('archive', os.path.expanduser(config['directory']))
+            if key not in _sinks:
+                _sinks[key] = ArchiveSink(config['directory'], logger, **options)
+        else:
+            raise KeyError("Sink type {sink_type} unknown, expected one of {types}".format(
+                sink_type=config['type'], types=', '.join(SINK_TYPES)))
+        return _sinks[key]
+
+
+def sink_stats():
+    """
+    Files delivered, failed, dropped, spooled and still queued (or waiting in the spool) by every sink of the
+    current process
+    :return:
+    """
+    stats = {'delivered': 0, 'failed': 0, 'dropped': 0, 'spooled': 0, 'queued': 0}
+    for sink in list(_sinks.values()):
+        for key in sink.stats:
+            stats[key] += sink.stats[key]
+        stats['queued'] += sink.queue.qsize() + len(sink.spooled)
+    return stats
+
+
+def stop_sinks():
+    """
+    Delivers the queued files of every sink, e.g. before stopping
+    :return:
+    """
+    with _sinks_lock:
+        sinks = list(_sinks.values())
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
+
+
+def ship_files(file_names, sinks, keep_files):
+    """
+    Hands saved files over to every sink
+    Files are first renamed to unique names, they are then kept under these names or removed once shipped
+    :param file_names:
+    :param sinks: Sink
+    :param keep_files: whether or not files are kept on disk once shipped
+    :return: names of the shipped files
+    """
+    if len(sinks) == 0:
+        if not keep_files:
+            for file_name in file_names:
+                os.remove(file_name)
+        return file_names
+
+    shipped_file_names = []
+    for file_name in file_names:
+        # Absolute, sinks may deliver it once the working directory changed
+        shipped_file_name = "{file}.{time}-{sequence}".format(file=os.path.abspath(file_name),
+                                                              time=int(time.time() * 1000),
+                                                              sequence=next(_spool_sequence))
+        os.rename(file_name, shipped_file_name)
+        shipped_file = ShippedFile(shipped_file_name, len(sinks), keep_files)
+        for sink in sinks:
+            sink.submit(shipped_file)
+        shipped_file_names.append(shipped_file_name)
+    return shipped_file_names
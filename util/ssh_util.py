@@ -0,0 +1,134 @@
+import threading
+import time
+
+# OpenSSH servers accept 10 sessions per connection by default (MaxSessions)
+MAX_CHANNELS_PER_CONNECTION = 10
+
+
+class _PooledConnection(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.channels = 0
+        self.last_used = time.time()
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+
+class SSHConnectionPool(object):
+    """
+    Keeps SSH connections to EC2 hosts open across cycles so that each tail or archive
+    retrieval opens a channel instead of negotiating a new SSH connection
+    A pool belongs to one process, worker processes get their own
+    """
+
+    def __init__(self, max_channels=MAX_CHANNELS_PER_CONNECTION):
+        self.max_channels = max_channels
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host, port, user, key_filename):
+        """
+        Gets a connected SSH client with a free channel slot
+        :return: SSH client, to be given back with release()
+        """
+        key = (host, port, user, key_filename)
+        with self.lock:
+            connections = self.connections.setdefault(key, [])
+            connections[:] = [c for c in connections if c.is_active() or c.channels > 0]
+            for connection in connections:
+                if connection.channels < self.max_channels and connection.is_active():
+                    connection.channels += 1
+                    return connection.client
+
+        import paramiko
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.load_system_host_keys()
+        client.connect(hostname=host, port=port, username=user, key_filename=key_filename)
+        connection = _PooledConnection(client)
+        connection.channels = 1
+        with self.lock:
+            self.connections.setdefault(key, []).append(connection)
+        return client
+
+    def release(self, client, broken=False):
+        """
+        Gives a client back to the pool, broken connections are closed
+        :param client:
+        :param broken:
+        :return:
+        """
+        with self.lock:
+            for key, connections in self.connections.items():
+                for connection in connections:
+                    if connection.client is client:
+                        connection.channels -= 1
+                        connection.last_used = time.time()
+                        if broken:
+                            connections.remove(connection)
+                            client.close()
+                        return
+        client.close()
+
+    def close_host(self, host):
+        """
+        Closes every connection to one host, e.g. once its instance left the environment
+        :param host:
+        :return:
+        """
+        with self.lock:
+            for key in [k for k in self.connections if k[0] == host]:
+                for connection in self.connections.pop(key):
+                    connection.client.close()
+
+    def close_idle(self, max_idle_seconds):
+        """
+        Closes connections unused for more than max_idle_seconds
+        :param max_idle_seconds:
+        :return:
+        """
+        now = time.time()
+        with self.lock:
+            for key, connections in list(self.connections.items()):
+                for connection in list(connections):
+                    if connection.channels == 0 and now - connection.last_used > max_idle_seconds:
+                        connections.remove(connection)
+                        connection.client.close()
+                if not connections:
+                    del self.connections[key]
+
+    def close_all(self):
+        with self.lock:
+            for connections in self.connections.values():
+                for connection in connections:
+                    connection.client.close()
+            self.connections = {}
+
+
+_ssh_pool = None
+_ssh_pool_lock = threading.Lock()
+
+
+def get_ssh_pool():
+    """
+    SSH connection pool of the current process
+    :return:
+    """
+    global _ssh_pool
+    with _ssh_pool_lock:
+        if _ssh_pool is None:
+            _ssh_pool = SSHConnectionPool()
+        return _ssh_pool
+
+
+def reset_ssh_pool():
+    """
+    Forgets the connections inherited from a parent process, to be called by forked workers
+    :return:
+    """
+    global _ssh_pool
+    _ssh_pool = None
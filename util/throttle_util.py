@@ -0,0 +1,84 @@
+import contextlib
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, e.g. bytes per second shared by several transfers
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def consume(self, amount):
+        """
+        Blocks until the given amount of tokens has been consumed
+        Amounts larger than the bucket capacity are consumed in several parts
+        :param amount:
+        :return:
+        """
+        while amount > 0:
+            part = min(amount, self.capacity)
+            with self.lock:
+                self.refill()
+                if self.tokens >= part:
+                    self.tokens -= part
+                    amount -= part
+                    continue
+                wait = (part - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostThrottle(object):
+    """
+    Limits of the collection on one EC2 host: bandwidth shared by its transfers and concurrent SSH channels
+    """
+
+    def __init__(self, bytes_per_second=None, max_channels=None):
+        self.bucket = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self.max_channels = max_channels
+        self.channels = threading.BoundedSemaphore(max_channels) if max_channels else None
+        # Channel slots of the asyncio engine, created in its loop and again when the engine is restarted
+        self.async_channels = None
+        self.async_loop = None
+
+    @contextlib.contextmanager
+    def channel(self):
+        """
+        Waits for a free channel slot on the host
+        :return:
+        """
+        if self.channels is None:
+            yield
+            return
+        with self.channels:
+            yield
+
+    @contextlib.asynccontextmanager
+    async def async_channel(self):
+        """
+        Waits for a free channel slot on the host in the event loop of the asyncio engine, without holding a thread
+        of its executor nor one of its 'channels' slots. Within it, channel() does not wait
+        :return:
+        """
+        if self.max_channels is None:
+            yield
+            return
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if self.async_loop is not loop:
+            self.async_channels = asyncio.Semaphore(self.max_channels)
+            self.async_loop = loop
+        async with self.async_channels:
+            yield